@@ -0,0 +1,439 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+SEASON_SPLIT_COLUMNS = ['season_name', 'crop_production_system']
+
+# Ways a crop's yearly time series can be broken down: one aggregated series,
+# one per season/production system, or one per admin_1 / admin_2 unit.
+TIME_SERIES_LAYOUTS = ('total', 'split', 'admin_1', 'admin_2')
+
+# Fields each time series point can carry besides its year
+POINT_FIELDS = ('production', 'area', 'yield')
+
+# Which of a crop's series to emit and with which fields: the `top_n`
+# largest by total production (largest first; None = all, in label order),
+# then `limit` of them starting at `offset`, with only `fields` per point.
+SeriesOptions = namedtuple('SeriesOptions', ['top_n', 'offset', 'limit', 'fields'], defaults=[None, 0, None, POINT_FIELDS])
+ALL_SERIES = SeriesOptions()
+
+# Which records to aggregate: harvest years from `year_from` to `year_to`
+# (inclusive; None = unbounded) of the given seasons and production systems
+# (empty = all). Records without a harvest year are left out of year ranges.
+RowFilters = namedtuple('RowFilters', ['year_from', 'year_to', 'seasons', 'production_systems'], defaults=[None, None, (), ()])
+ALL_ROWS = RowFilters()
+
+
+def row_filter_mask(df, filters):
+    """Boolean mask of the rows of `df` that `filters` keeps."""
+    keep = np.ones(len(df), dtype=bool)
+    if filters.year_from is not None or filters.year_to is not None:
+        years = df['harvest_year'].to_numpy(dtype=np.float64, na_value=np.nan)
+        if filters.year_from is not None:
+            keep &= years >= filters.year_from
+        if filters.year_to is not None:
+            keep &= years <= filters.year_to
+    for col, values in (('season_name', filters.seasons), ('crop_production_system', filters.production_systems)):
+        if values:
+            keep &= df[col].isin(values).to_numpy(dtype=bool, na_value=False) if col in df.columns else False
+    return keep
+
+
+def time_series_layout(columns, timeseries_admin_level, split_by_season_production_system):
+    """Map the request's time series options to a layout name (None if unavailable)."""
+    if 'harvest_year' not in columns:
+        return None
+    if timeseries_admin_level == 0:
+        if split_by_season_production_system and any(col in columns for col in SEASON_SPLIT_COLUMNS):
+            return 'split'
+        return 'total'
+    if timeseries_admin_level == 1 and 'admin_1' in columns:
+        return 'admin_1'
+    if timeseries_admin_level == 2 and 'admin_2' in columns:
+        return 'admin_2'
+    return None
+
+
+def _layout_columns(layout, columns):
+    if layout == 'split':
+        return [col for col in SEASON_SPLIT_COLUMNS if col in columns]
+    if layout == 'season':
+        return ['season_name']
+    if layout in ('admin_1', 'admin_2'):
+        return [layout]
+    return []
+
+
+def _as_key(value):
+    # groupby keys are scalars or tuples depending on the pandas version.
+    return value if isinstance(value, tuple) else (value,)
+
+
+def _grouper(df, keys):
+    # With no keys the whole frame is a single group.
+    return keys if keys else np.zeros(len(df), dtype=np.int8)
+
+
+def _group_sums(df, keys):
+    """Production/area sums per `keys` group (NaN skipped), sorted by key.
+
+    Grouped sums visit rows in file order, so the same rows always give the
+    same bits whether they are summed per request or in the rollups.
+    """
+    sums = df.groupby(_grouper(df, keys), sort=True, observed=True)[['production', 'area']].sum()
+    return sums.reset_index(drop=not keys)
+
+
+def _group_ids(df, keys):
+    """Position of each row's `keys` group in sorted group order, -1 for rows with a missing key."""
+    if not keys:
+        return np.zeros(len(df), dtype=np.int64)
+    if not all(isinstance(df[col].dtype, pd.CategoricalDtype) for col in keys):
+        return df.groupby(keys, sort=True, observed=True).ngroup().fillna(-1).to_numpy().astype(np.int64)
+    # Categorical groups sort by category codes, so the groups are the distinct code tuples
+    codes = [df[col].cat.codes.to_numpy().astype(np.int64) for col in keys]
+    combined = np.ravel_multi_index([np.maximum(c, 0) for c in codes], [max(len(df[col].cat.categories), 1) for col in keys])
+    missing = np.logical_or.reduce([c < 0 for c in codes])
+    _, group_ids = np.unique(combined[~missing], return_inverse=True)
+    ids = np.full(len(df), -1, dtype=np.int64)
+    ids[~missing] = group_ids.reshape(-1)
+    return ids
+
+
+def _group_totals(df, keys):
+    """`_group_sums` with every sum bit for bit the ``Series.sum`` of the group's rows.
+
+    Grouped sums are compensated while ``Series.sum`` adds pairwise, so the
+    two can differ in the last digit. Crop, season and unit totals have
+    always been ``Series.sum``; yearly points have always been grouped sums.
+    """
+    totals = _group_sums(df, keys)
+    if not len(totals):
+        return totals
+    group_ids = _group_ids(df, keys)
+    order = np.argsort(group_ids, kind='stable')
+    order = order[group_ids[order] >= 0]
+    bounds = np.searchsorted(group_ids[order], np.arange(len(totals) + 1))
+    # Missing values as zeros in place, as Series.sum adds them; one row per column
+    # so each group's slice of both is reduced pairwise in one call
+    values = np.nan_to_num(np.stack([df[col].to_numpy(dtype=np.float64, na_value=np.nan)[order] for col in ('production', 'area')]))
+    sizes = np.diff(bounds)
+    sums = values[:, bounds[:-1]]
+    # One or two rows add up the same in any order
+    pairs = np.flatnonzero(sizes == 2)
+    sums[:, pairs] += values[:, bounds[pairs] + 1]
+    for group in np.flatnonzero(sizes > 2).tolist():
+        sums[:, group] = np.add.reduce(values[:, bounds[group]:bounds[group + 1]], axis=1)
+    totals['production'] = sums[0]
+    totals['area'] = sums[1]
+    return totals
+
+
+def _key_tuples(frame, columns):
+    if not columns:
+        return [()] * len(frame)
+    return list(zip(*(frame[col].tolist() for col in columns)))
+
+
+def block_ranges(frame, columns):
+    """Map each `columns` key of a frame sorted by those columns to its (start, stop) rows."""
+    if not columns:
+        return {(): (0, len(frame))} if len(frame) else {}
+    indices = frame.groupby(columns, sort=False, observed=True).indices
+    return {_as_key(key): (int(rows[0]), int(rows[-1]) + 1) for key, rows in indices.items()}
+
+
+def _series_table(df, by, layout):
+    series_columns = _layout_columns(layout, df.columns)
+    series_keys = by + [col for col in series_columns if col not in by]
+    yearly = _group_sums(df, series_keys + ['harvest_year'])
+
+    if series_keys and len(yearly):
+        series_id = yearly.groupby(series_keys, sort=False, observed=True).ngroup().to_numpy()
+    else:
+        series_id = np.zeros(len(yearly), dtype=np.int64)
+
+    first_rows = np.flatnonzero(np.r_[True, series_id[1:] != series_id[:-1]]) if len(yearly) else np.array([], dtype=np.int64)
+    if layout == 'total':
+        labels = ['Total'] * len(first_rows)
+    else:
+        firsts = yearly.iloc[first_rows]
+        if len(series_columns) == 2:
+            labels = [f"{a} - {b}" for a, b in _key_tuples(firsts, series_columns)]
+        else:
+            labels = [str(v) for v in firsts[series_columns[0]].tolist()]
+
+    production = yearly['production'].to_numpy()
+    return {
+        'series_id': series_id,
+        'year': yearly['harvest_year'].to_numpy(),
+        'production': production,
+        'area': yearly['area'].to_numpy(),
+        'labels': labels,
+        'ranges': block_ranges(yearly, by),
+        # The layout's key values of each series (e.g. its season and system)
+        'series_columns': series_columns,
+        'series_values': _key_tuples(yearly.iloc[first_rows], series_columns),
+        # Row span and total production of each series, for top-N and paging
+        'series_start': first_rows,
+        'series_stop': np.r_[first_rows[1:], len(yearly)].astype(np.int64),
+        'series_production': np.bincount(series_id, weights=np.nan_to_num(production), minlength=len(first_rows)) if len(yearly) else np.array([]),
+    }
+
+
+def _unique_lists(df, keys, column, index, sort_values):
+    """Per-group lists of the distinct values of `column`, aligned to `index`.
+
+    Values keep their order of first appearance (NaN included, like
+    unique()), or are sorted with NaN dropped when `sort_values` is set.
+    """
+    if column not in df.columns or not len(index):
+        return [[] for _ in range(len(index))]
+    values = df[keys + [column]]
+    if sort_values:
+        values = values.dropna(subset=[column])
+    values = values.drop_duplicates()
+    if sort_values:
+        values = values.sort_values(column, kind='stable')
+    grouped = values.groupby(keys, sort=True, observed=True)
+    # Rows with a missing key get no group id
+    group_ids = grouped.ngroup().fillna(-1).astype(np.int64).tolist()
+    lists = [[] for _ in range(grouped.ngroups)]
+    for group_id, value in zip(group_ids, values[column].astype(object).tolist()):
+        if group_id >= 0:
+            lists[group_id].append(value)
+    positions = grouped.size().index.get_indexer(index)
+    return [lists[p] if p >= 0 else [] for p in positions.tolist()]
+
+
+def _season_table(df, by):
+    keys = by + ['season_name']
+    sums = _group_totals(df, keys)
+    index = pd.MultiIndex.from_frame(sums[keys]) if len(keys) > 1 else pd.Index(sums[keys[0]])
+    return {
+        'season_name': sums['season_name'].tolist(),
+        'production': sums['production'].to_numpy(),
+        'area': sums['area'].to_numpy(),
+        'production_systems': _unique_lists(df, keys, 'crop_production_system', index, sort_values=False),
+        'planting_months': _unique_lists(df, keys, 'planting_month', index, sort_values=True),
+        'harvest_months': _unique_lists(df, keys, 'harvest_month', index, sort_values=True),
+        'ranges': block_ranges(sums, by),
+    }
+
+
+def build_tables(df, by, layouts, seasons=True):
+    """Aggregate `df` into the tables crop details are emitted from.
+
+    ``keys``/``production``/``area`` hold one row of totals per `by` key and
+    ``groups`` is the same as a frame. ``seasons`` and every ``series``
+    layout are sorted by `by` and carry the (start, stop) rows of each key,
+    so emitting one group only touches that group's rows. Without
+    `seasons` (time series only) the season table is None.
+    """
+    groups = _group_totals(df, by)
+    tables = {
+        'keys': _key_tuples(groups, by),
+        'production': groups['production'].to_numpy(),
+        'area': groups['area'].to_numpy(),
+        'groups': groups,
+        'seasons': _season_table(df, by) if seasons and 'season_name' in df.columns else None,
+        'series': {},
+    }
+    for layout in layouts:
+        if layout is not None:
+            tables['series'][layout] = _series_table(df, by, layout)
+    return tables
+
+
+def _emit_time_series(series, block, fields=POINT_FIELDS):
+    start, stop = block
+    labels = series['labels']
+    time_series_data = []
+    current = None
+    points = None
+    fields = set(fields)
+    for series_id, year, prod, ar in zip(
+        series['series_id'][start:stop].tolist(),
+        series['year'][start:stop].tolist(),
+        series['production'][start:stop].tolist(),
+        series['area'][start:stop].tolist(),
+    ):
+        if series_id != current:
+            current = series_id
+            points = []
+            time_series_data.append({'admin_unit': labels[series_id], 'data': points})
+        prod = prod if not pd.isna(prod) else 0
+        ar = ar if not pd.isna(ar) else 0
+        point = {'year': int(year)}
+        if 'production' in fields:
+            point['production'] = prod
+        if 'area' in fields:
+            point['area'] = ar
+        if 'yield' in fields:
+            point['yield'] = prod / ar if ar > 0 else 0
+        points.append(point)
+    return time_series_data
+
+
+def select_series(series, block, options):
+    """Ids of the series of `block` that `options` selects, and how many there are."""
+    start, stop = block
+    first, last = int(series['series_id'][start]), int(series['series_id'][stop - 1])
+    ids = np.arange(first, last + 1)
+    if options.top_n is not None:
+        # Largest totals first; ties keep label order
+        ids = ids[np.argsort(-series['series_production'][first:last + 1], kind='stable')][:options.top_n]
+    total = len(ids)
+    stop_at = None if options.limit is None else options.offset + options.limit
+    return ids[options.offset:stop_at], total
+
+
+def empty_time_series_page(layout):
+    """The time series page of a group without points (see `emit_time_series_page`)."""
+    # The aggregated series is reported even when it has no points.
+    return ([{'admin_unit': 'Total', 'data': []}], 1) if layout == 'total' else ([], 0)
+
+
+def emit_time_series_page(tables, key, layout, options=ALL_SERIES):
+    """Time series list for one group key, plus the number of series `options` pages over.
+
+    Only the selected series are emitted, so the cost follows the page size
+    rather than the number of admin units.
+    """
+    if layout is None:
+        return [], 0
+    series = tables['series'][layout]
+    block = series['ranges'].get(key)
+    if block is None:
+        return empty_time_series_page(layout)
+    if options == ALL_SERIES:
+        data = _emit_time_series(series, block)
+        return data, len(data)
+    ids, total = select_series(series, block, options)
+    data = []
+    for series_id in ids.tolist():
+        data.extend(_emit_time_series(series, (series['series_start'][series_id], series['series_stop'][series_id]), options.fields))
+    return data, total
+
+
+def emit_time_series(tables, key, layout, options=ALL_SERIES):
+    """Time series list for one group key, as returned in ``time_series_data``."""
+    return emit_time_series_page(tables, key, layout, options)[0]
+
+
+def next_series_cursor(options, total):
+    """Cursor of the page after the one `options` selects, or None on the last page."""
+    if options.limit is None or options.offset + options.limit >= total:
+        return None
+    return str(options.offset + options.limit)
+
+
+def _emit_seasons(seasons, key, crop_production):
+    if seasons is None or key not in seasons['ranges']:
+        return []
+    start, stop = seasons['ranges'][key]
+    seasons_data = []
+    for i in range(start, stop):
+        season_production = seasons['production'][i]
+        season_area = seasons['area'][i]
+        seasons_data.append({
+            'season_name': seasons['season_name'][i],
+            'production_absolute': season_production,
+            'production_percentage_of_crop': (season_production / crop_production * 100) if crop_production else 0,
+            'area_harvested': season_area,
+            'yield': season_production / season_area if season_area else 0,
+            'production_systems': seasons['production_systems'][i],
+            'planting_months': seasons['planting_months'][i],
+            'harvest_months': seasons['harvest_months'][i],
+        })
+    return seasons_data
+
+
+def emit_crop_details(tables, position, layout, options=ALL_SERIES):
+    """Crop details dict for the group at `position` in ``tables['keys']``.
+
+    When `options` narrows the series, the details also report how many
+    series there are and the cursor of the next page.
+    """
+    key = tables['keys'][position]
+    crop_production = tables['production'][position]
+    crop_area = tables['area'][position]
+    time_series_data, total = emit_time_series_page(tables, key, layout, options)
+    details = {
+        'total_production': crop_production,
+        'total_area_harvested': crop_area,
+        'average_yield': crop_production / crop_area if crop_area else 0,
+        'time_series_data': time_series_data,
+        'season_specific_breakdown': _emit_seasons(tables['seasons'], key, crop_production),
+    }
+    if options != ALL_SERIES:
+        details['time_series_count'] = total
+        details['next_series_cursor'] = next_series_cursor(options, total)
+    return details
+
+
+def calculate_crop_details(df_crop, total_country_production_for_crop, timeseries_admin_level=0, split_by_season_production_system=False):
+    layout = time_series_layout(df_crop.columns, timeseries_admin_level, split_by_season_production_system)
+    tables = build_tables(df_crop, [], [layout])
+    return emit_crop_details(tables, 0, layout)
+
+
+def calculate_crops_summary(df, timeseries_admin_level=0, split_by_season_production_system=False):
+    """calculate_crop_details for every product in `df`, keyed by product name.
+
+    All crops share one set of groupbys instead of regrouping each crop's rows.
+    """
+    if 'product' not in df.columns:
+        return {}
+    layout = time_series_layout(df.columns, timeseries_admin_level, split_by_season_production_system)
+    tables = build_tables(df, ['product'], [layout])
+    return {key[0]: emit_crop_details(tables, i, layout) for i, key in enumerate(tables['keys'])}
+
+
+def missing_years(years):
+    """Gaps between the first and last of the given (integer) years."""
+    if not years:
+        return []
+    min_year, max_year = min(years), max(years)
+    if min_year == max_year:
+        return []
+    return sorted(set(range(min_year, max_year + 1)) - set(years))
+
+
+def scope_summaries(df, scope_columns, child_column=None):
+    """Headline figures for every `scope_columns` group of `df`.
+
+    Each entry has the crop count, total production, the number of distinct
+    `child_column` units and the planting year range with its gaps.
+    """
+    totals = _group_totals(df, scope_columns)
+    keys = _key_tuples(totals, scope_columns)
+    grouped = df.groupby(_grouper(df, scope_columns), sort=True, observed=True)
+
+    def distinct_counts(column):
+        if column is None or column not in df.columns:
+            return [0] * len(keys)
+        return grouped[column].nunique().tolist()
+
+    crops_counts = distinct_counts('product')
+    child_counts = distinct_counts(child_column)
+
+    years_by_key = {}
+    if 'planting_year' in df.columns:
+        years = df[scope_columns + ['planting_year']].dropna(subset=['planting_year']).drop_duplicates()
+        for key, group in years.groupby(_grouper(years, scope_columns), sort=False, observed=True)['planting_year']:
+            years_by_key[_as_key(key) if scope_columns else ()] = [int(y) for y in group.tolist()]
+
+    summaries = {}
+    for i, key in enumerate(keys):
+        years = years_by_key.get(key, [])
+        summaries[key] = {
+            'unique_crops_count': int(crops_counts[i]),
+            'total_production': totals['production'].iloc[i],
+            'unique_children_count': int(child_counts[i]),
+            'min_planting_year': min(years) if years else None,
+            'max_planting_year': max(years) if years else None,
+            'missing_planting_years': missing_years(years),
+        }
+    return summaries
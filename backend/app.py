@@ -1,270 +1,286 @@
 import pandas as pd
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 import numpy as np
 import logging
+import os
+
+from aggregation import (ALL_ROWS, POINT_FIELDS, RowFilters, SeriesOptions, empty_time_series_page, next_series_cursor,
+                         time_series_layout)
+from cache import ResponseCache, cached_route
+from coverage import COVERAGE_COLUMNS, emit_coverage
+from dataset import DEFAULT_SNAPSHOT_DIR, MAX_INVALID_FRACTION, DatasetValidationError, child_names, country_names, has_rows
+from export import EXPORT_EXTENSIONS, EXPORT_MIMETYPES, export_chunks, export_formats, stream_export
+from ingest import DeltaError
+from metrics import PROMETHEUS_CONTENT_TYPE, Gauge, MetricsRegistry, SlowRequestProfiler, instrument_app, mark
+from offload import ComputePool, OffloadTimeout, PoolBusy, SingleFlight
+from qc import attach_qc_flags, parse_qc_flags
+from rollups import (rollup_continental, rollup_coverage, rollup_crop_statistics, rollup_crop_time_series,
+                     rollup_crop_time_series_pages, rollup_crops_summary, rollup_summary, scope_key)
+from serialization import FastJSONProvider, precompress
+from store import DatasetStore, snapshot_rollups, snapshot_slice_rollups
+from trends import OUTLIER_Z
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load the CSV data
+# Load the CSV data (or its columnar snapshot when the CSV is unchanged)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'public')
+DATA_PATH = os.environ.get('HVSTAT_DATA_PATH', os.path.join(DATA_DIR, 'hvstat_africa_data_v1.0.csv'))
+SNAPSHOT_DIR = os.environ.get('HVSTAT_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR)
+# Per-country/crop outlier and low-variance counts attached to crops_summary
+QC_PATH = os.environ.get('HVSTAT_QC_PATH', os.path.join(DATA_DIR, 'qcFlags_hvstat_africa_data_v1.0.csv'))
+# Columns to leave out of memory (and exports), e.g. "fnid,country_code"
+DROP_COLUMNS = [col.strip() for col in os.environ.get('HVSTAT_DROP_COLUMNS', '').split(',') if col.strip()]
+# Processes parsing a large CSV (0: one per core) and the share of a numeric
+# column's values that may fail to parse before a file is refused
+LOAD_PROCESSES = int(os.environ.get('HVSTAT_LOAD_PROCESSES', '0'))
+MAX_INVALID_FRACTION = float(os.environ.get('HVSTAT_MAX_INVALID_FRACTION', str(MAX_INVALID_FRACTION)))
+
+# Response cache sizing and the max-age clients may reuse a response for
+RESPONSE_CACHE_ENTRIES = int(os.environ.get('HVSTAT_RESPONSE_CACHE_ENTRIES', '1024'))
+RESPONSE_CACHE_MB = int(os.environ.get('HVSTAT_RESPONSE_CACHE_MB', '256'))
+CACHE_MAX_AGE = int(os.environ.get('HVSTAT_CACHE_MAX_AGE', '300'))
+
+# CPU offload: processes building filtered rollups and compressing large
+# response bodies (0 = do both on the request thread), how many tasks may be
+# queued or running at once and how long a request waits for one of those
+# slots before it gets 503, the smallest body worth shipping to the pool, and
+# how long a request waits for the pool or for an identical in-flight
+# request. serve.py turns HVSTAT_START_COMPUTE_POOL off and starts the pool
+# in each server worker instead.
+COMPUTE_PROCESSES = int(os.environ.get('HVSTAT_COMPUTE_PROCESSES', '2'))
+COMPUTE_MAX_PENDING = int(os.environ.get('HVSTAT_COMPUTE_MAX_PENDING', str(max(1, COMPUTE_PROCESSES) * 4)))
+COMPUTE_QUEUE_TIMEOUT = float(os.environ.get('HVSTAT_COMPUTE_QUEUE_TIMEOUT', '5'))
+OFFLOAD_MIN_BYTES = int(os.environ.get('HVSTAT_OFFLOAD_MIN_KB', '64')) * 1024
+COMPUTE_TIMEOUT = float(os.environ.get('HVSTAT_COMPUTE_TIMEOUT', '30'))
+START_COMPUTE_POOL = os.environ.get('HVSTAT_START_COMPUTE_POOL', '1') != '0'
+
+# Hot reload: token guarding the admin endpoints (unset = disabled), how often
+# to poll the CSV for changes (0 = never) and how many of the most recently
+# used responses to rebuild for a new dataset before it goes live
+ADMIN_TOKEN = os.environ.get('HVSTAT_ADMIN_TOKEN')
+WATCH_INTERVAL = float(os.environ.get('HVSTAT_WATCH_INTERVAL', '0'))
+WARM_ENTRIES = int(os.environ.get('HVSTAT_WARM_ENTRIES', '128'))
+
+# Most (unit, crop) time series one /api/crop-timeseries/batch request may ask for
+MAX_BATCH_ITEMS = int(os.environ.get('HVSTAT_MAX_BATCH_ITEMS', '500'))
+
+# Observability: Server-Timing headers (on unless set to 0) and an opt-in
+# profiler that profiles a random fraction of requests and keeps the
+# profiles of those slower than the threshold
+SERVER_TIMING = os.environ.get('HVSTAT_SERVER_TIMING', '1') != '0'
+PROFILE_SAMPLE_RATE = float(os.environ.get('HVSTAT_PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_MS = float(os.environ.get('HVSTAT_PROFILE_SLOW_MS', '500'))
+PROFILE_DIR = os.environ.get('HVSTAT_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.profiles'))
+
+# Forkserver/spawn pool workers of `python app.py` re-import this file as
+# __mp_main__; they only run the functions they are sent, so they neither
+# start pools of their own nor load the dataset
+POOL_WORKER = __name__ == '__mp_main__'
+
+compute_pool = ComputePool(COMPUTE_PROCESSES, COMPUTE_MAX_PENDING, COMPUTE_QUEUE_TIMEOUT)
+# Fork the pool while this is the only thread and before the dataset is
+# loaded, so its workers stay small (see `ComputePool.start`)
+if START_COMPUTE_POOL and not POOL_WORKER:
+    compute_pool.start()
+
+
+def run_in_pool(fn, *args):
+    # Builds over many rows run in the pool, off the request threads
+    return compute_pool.run(COMPUTE_TIMEOUT, fn, *args)
+
+
+# The dataset with its row index and rollups, swapped as a whole on reload
+store = DatasetStore(DATA_PATH, SNAPSHOT_DIR, DROP_COLUMNS, QC_PATH,
+                     {'processes': LOAD_PROCESSES or None, 'max_invalid_fraction': MAX_INVALID_FRACTION})
 try:
-    data = pd.read_csv('../public/hvstat_africa_data_v1.0.csv')
-    # Convert relevant columns to numeric, coercing errors to NaN
-    numeric_cols = ['planting_year', 'harvest_year', 'area', 'production', 'yield']
-    for col in numeric_cols:
-        if col in data.columns:
-            data[col] = pd.to_numeric(data[col], errors='coerce')
-    logging.info("CSV data loaded and processed successfully.")
+    if not POOL_WORKER:
+        store.load()
+        logging.info("CSV data loaded and processed successfully.")
 except FileNotFoundError:
-    logging.error("FATAL: The CSV file 'public/hvstat_africa_data_v1.0.csv' was not found.")
-    data = pd.DataFrame() # Create an empty DataFrame to prevent further errors
+    logging.error(f"FATAL: The CSV file '{DATA_PATH}' was not found.")
+except DatasetValidationError as e:
+    logging.error(f"FATAL: The CSV file '{DATA_PATH}' failed validation: {e}")
+    for col, entry in e.report['columns'].items():
+        if entry['invalid']:
+            logging.error(f"  {col}: {entry['invalid']} invalid values, e.g. {entry['examples']}")
 except Exception as e:
     logging.error(f"FATAL: An unexpected error occurred during CSV loading: {e}")
-    data = pd.DataFrame()
 
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # orjson-backed jsonify with NaN/inf encoded as null
 CORS(app)  # Enable CORS for all routes
 
-def get_missing_years(years_series):
-    if years_series.empty or years_series.isnull().all():
-        return []
-    min_year = int(years_series.min())
-    max_year = int(years_series.max())
-    if min_year == max_year: # Avoid issues with range if only one year
-        return []
-    present_years = set(years_series.dropna().astype(int))
-    expected_years = set(range(min_year, max_year + 1))
-    return sorted(list(expected_years - present_years))
-
-def calculate_crop_details(df_crop, total_country_production_for_crop, timeseries_admin_level=0, split_by_season_production_system=False):
-    crop_production = df_crop['production'].sum()
-    crop_area = df_crop['area'].sum()
-    crop_yield = crop_production / crop_area if crop_area else 0
-
-    # Calculate time series data by harvest year and admin level
-    time_series_data = []
-    if 'harvest_year' in df_crop.columns:
-        if timeseries_admin_level == 0:
-            if split_by_season_production_system:
-                # Split by season and production system combination
-                group_columns = []
-                if 'season_name' in df_crop.columns:
-                    group_columns.append('season_name')
-                if 'crop_production_system' in df_crop.columns:
-                    group_columns.append('crop_production_system')
-                
-                if group_columns:
-                    for group_values, group_df in df_crop.groupby(group_columns):
-                        # Handle both single values and tuples
-                        if isinstance(group_values, tuple):
-                            if any(pd.isna(val) for val in group_values):
-                                continue
-                        else:
-                            if pd.isna(group_values):
-                                continue
-                            
-                        yearly_data = group_df.groupby('harvest_year').agg({
-                            'production': 'sum',
-                            'area': 'sum'
-                        }).reset_index()
-                        
-                        series_data = []
-                        for _, row in yearly_data.iterrows():
-                            year = int(row['harvest_year']) if not pd.isna(row['harvest_year']) else None
-                            production = row['production'] if not pd.isna(row['production']) else 0
-                            area = row['area'] if not pd.isna(row['area']) else 0
-                            yield_value = production / area if area > 0 else 0
-                            
-                            if year is not None:
-                                series_data.append({
-                                    'year': year,
-                                    'production': production,
-                                    'area': area,
-                                    'yield': yield_value
-                                })
-                        
-                        if series_data:
-                            # Create descriptive label for the series
-                            if len(group_columns) == 2:
-                                if isinstance(group_values, tuple):
-                                    season_name, production_system = group_values
-                                else:
-                                    season_name, production_system = group_values, 'Unknown'
-                                series_label = f"{season_name} - {production_system}"
-                            else:
-                                series_label = str(group_values)
-                            
-                            time_series_data.append({
-                                'admin_unit': series_label,
-                                'data': sorted(series_data, key=lambda x: x['year'])
-                            })
-                else:
-                    # Fallback to single aggregated if no group columns available
-                    yearly_data = df_crop.groupby('harvest_year').agg({
-                        'production': 'sum',
-                        'area': 'sum'
-                    }).reset_index()
-                    
-                    series_data = []
-                    for _, row in yearly_data.iterrows():
-                        year = int(row['harvest_year']) if not pd.isna(row['harvest_year']) else None
-                        production = row['production'] if not pd.isna(row['production']) else 0
-                        area = row['area'] if not pd.isna(row['area']) else 0
-                        yield_value = production / area if area > 0 else 0
-                        
-                        if year is not None:
-                            series_data.append({
-                                'year': year,
-                                'production': production,
-                                'area': area,
-                                'yield': yield_value
-                            })
-                    
-                    time_series_data = [{
-                        'admin_unit': 'Total',
-                        'data': sorted(series_data, key=lambda x: x['year'])
-                    }]
-            else:
-                # Single aggregated time series
-                yearly_data = df_crop.groupby('harvest_year').agg({
-                    'production': 'sum',
-                    'area': 'sum'
-                }).reset_index()
-                
-                series_data = []
-                for _, row in yearly_data.iterrows():
-                    year = int(row['harvest_year']) if not pd.isna(row['harvest_year']) else None
-                    production = row['production'] if not pd.isna(row['production']) else 0
-                    area = row['area'] if not pd.isna(row['area']) else 0
-                    yield_value = production / area if area > 0 else 0
-                    
-                    if year is not None:
-                        series_data.append({
-                            'year': year,
-                            'production': production,
-                            'area': area,
-                            'yield': yield_value
-                        })
-                
-                time_series_data = [{
-                    'admin_unit': 'Total',
-                    'data': sorted(series_data, key=lambda x: x['year'])
-                }]
-            
-        elif timeseries_admin_level == 1 and 'admin_1' in df_crop.columns:
-            # Group by admin_1 units
-            for admin_1_name, admin_df in df_crop.groupby('admin_1'):
-                if pd.isna(admin_1_name):
-                    continue
-                    
-                yearly_data = admin_df.groupby('harvest_year').agg({
-                    'production': 'sum',
-                    'area': 'sum'
-                }).reset_index()
-                
-                series_data = []
-                for _, row in yearly_data.iterrows():
-                    year = int(row['harvest_year']) if not pd.isna(row['harvest_year']) else None
-                    production = row['production'] if not pd.isna(row['production']) else 0
-                    area = row['area'] if not pd.isna(row['area']) else 0
-                    yield_value = production / area if area > 0 else 0
-                    
-                    if year is not None:
-                        series_data.append({
-                            'year': year,
-                            'production': production,
-                            'area': area,
-                            'yield': yield_value
-                        })
-                
-                if series_data:  # Only add if there's data
-                    time_series_data.append({
-                        'admin_unit': str(admin_1_name),
-                        'data': sorted(series_data, key=lambda x: x['year'])
-                    })
-                    
-        elif timeseries_admin_level == 2 and 'admin_2' in df_crop.columns:
-            # Group by admin_2 units
-            for admin_2_name, admin_df in df_crop.groupby('admin_2'):
-                if pd.isna(admin_2_name):
-                    continue
-                    
-                yearly_data = admin_df.groupby('harvest_year').agg({
-                    'production': 'sum',
-                    'area': 'sum'
-                }).reset_index()
-                
-                series_data = []
-                for _, row in yearly_data.iterrows():
-                    year = int(row['harvest_year']) if not pd.isna(row['harvest_year']) else None
-                    production = row['production'] if not pd.isna(row['production']) else 0
-                    area = row['area'] if not pd.isna(row['area']) else 0
-                    yield_value = production / area if area > 0 else 0
-                    
-                    if year is not None:
-                        series_data.append({
-                            'year': year,
-                            'production': production,
-                            'area': area,
-                            'yield': yield_value
-                        })
-                
-                if series_data:  # Only add if there's data
-                    time_series_data.append({
-                        'admin_unit': str(admin_2_name),
-                        'data': sorted(series_data, key=lambda x: x['year'])
-                    })
-
-    seasons_data = []
-    if 'season_name' in df_crop.columns:
-        for season_name, df_season in df_crop.groupby('season_name'):
-            season_production = df_season['production'].sum()
-            season_area = df_season['area'].sum()
-            season_yield = season_production / season_area if season_area else 0
-            production_systems = df_season['crop_production_system'].unique().tolist() if 'crop_production_system' in df_season.columns else []
-
-            planting_months = []
-            if 'planting_month' in df_season.columns:
-                planting_months = sorted(df_season['planting_month'].dropna().unique().tolist())
-
-            harvest_months = []
-            if 'harvest_month' in df_season.columns:
-                harvest_months = sorted(df_season['harvest_month'].dropna().unique().tolist())
-
-            seasons_data.append({
-                'season_name': season_name,
-                'production_absolute': season_production,
-                'production_percentage_of_crop': (season_production / crop_production * 100) if crop_production else 0,
-                'area_harvested': season_area,
-                'yield': season_yield,
-                'production_systems': production_systems,
-                'planting_months': planting_months,
-                'harvest_months': harvest_months,
-            })
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_MB * 1024 * 1024)
+# Concurrent misses on the same response render it once
+response_flights = SingleFlight()
 
-    return {
-        'total_production': crop_production,
-        'total_area_harvested': crop_area,
-        'average_yield': crop_yield,
-        'time_series_data': time_series_data,
-        'season_specific_breakdown': seasons_data,
-    }
+
+def compress_body(body):
+    # Small bodies compress faster than they can be shipped to another process
+    if len(body) < OFFLOAD_MIN_BYTES:
+        return precompress(body)
+    return compute_pool.run(COMPUTE_TIMEOUT, precompress, body)
+
+
+cached = cached_route(response_cache, lambda: g.snapshot.version, CACHE_MAX_AGE,
+                      flights=response_flights, compress=compress_body, wait_timeout=COMPUTE_TIMEOUT)
+
+# Per-phase request timings, exported at /metrics
+metrics_registry = MetricsRegistry()
+metrics_registry.register(Gauge('hvstat_response_cache_hits_total', 'Responses served from the response cache.',
+                                lambda: [({}, response_cache.hits)], kind='counter'))
+metrics_registry.register(Gauge('hvstat_response_cache_misses_total', 'Responses the response cache did not have.',
+                                lambda: [({}, response_cache.misses)], kind='counter'))
+metrics_registry.register(Gauge('hvstat_response_cache_entries', 'Responses held in the response cache.',
+                                lambda: [({}, len(response_cache))]))
+metrics_registry.register(Gauge('hvstat_coalesced_responses_total', 'Cache misses served by a concurrent identical request.',
+                                lambda: [({}, response_flights.shared)], kind='counter'))
+metrics_registry.register(Gauge('hvstat_compute_in_flight', 'Tasks queued or running in the compute pool.',
+                                lambda: [({}, compute_pool.in_flight)]))
+metrics_registry.register(Gauge('hvstat_compute_rejected_total', 'Requests turned away because the compute pool was full.',
+                                lambda: [({}, compute_pool.rejected)], kind='counter'))
+metrics_registry.register(Gauge('hvstat_compute_timeouts_total', 'Compute pool tasks a request stopped waiting for.',
+                                lambda: [({}, compute_pool.timeouts)], kind='counter'))
+metrics_registry.register(Gauge('hvstat_dataset_rows', 'Rows in the live dataset.',
+                                lambda: [({'version': store.current().version[:12]}, len(store.current().data))]))
+profiler = SlowRequestProfiler(PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS / 1000, PROFILE_DIR) if PROFILE_SAMPLE_RATE > 0 else None
+instrument_app(app, metrics_registry, server_timing_header=SERVER_TIMING, profiler=profiler)
+
+
+@app.errorhandler(PoolBusy)
+def compute_pool_busy(e):
+    app.logger.warning(f"Rejected {request.full_path}: compute pool is full ({e}).")
+    response = jsonify({"error": "Server is busy, retry shortly"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@app.errorhandler(OffloadTimeout)
+def compute_timeout(e):
+    app.logger.error(f"Timed out serving {request.full_path}: {e}")
+    return jsonify({"error": "Request timed out, retry shortly"}), 504
+
+
+@app.before_request
+def pin_snapshot():
+    # Every read in a request goes through the same snapshot, even if a reload swaps it mid-request
+    g.snapshot = request.environ.get('hvstat.snapshot') or store.current()
+
+
+def warm_response_cache(snapshot):
+    """Render the most recently used responses against `snapshot` before it goes live."""
+    current = store.current()
+    if snapshot.version == current.version:
+        return
+    keys = [key for key in response_cache.keys() if key[-1] == current.version][:WARM_ENTRIES]
+    client = app.test_client()
+    for path, args, _ in keys:
+        query = [(name, value) for name, values in args for value in values]
+        client.get(path, query_string=query, environ_overrides={'hvstat.snapshot': snapshot})
+    logging.info(f"Warmed {len(keys)} cached responses for dataset version {snapshot.version[:12]}.")
+
+
+def drop_stale_responses(snapshot, previous):
+    if snapshot.version != previous.version:
+        response_cache.discard(lambda key: key[-1] == previous.version)
+
+
+store.before_swap.append(warm_response_cache)
+store.after_swap.append(drop_stale_responses)
+if WATCH_INTERVAL > 0 and not POOL_WORKER:
+    store.watch(WATCH_INTERVAL)
+
+def parse_series_options(params):
+    """Series selection from top_n, series_limit, series_cursor and fields.
+
+    `params` is the query string or a JSON body. Raises ValueError with a
+    message for the client.
+    """
+    def positive_int(name):
+        value = params.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a positive integer") from None
+        if number < 1:
+            raise ValueError(f"{name} must be a positive integer")
+        return number
+
+    cursor = params.get('series_cursor')
+    try:
+        offset = int(cursor) if cursor not in (None, '') else 0
+    except (TypeError, ValueError):
+        offset = -1
+    if offset < 0:
+        raise ValueError("series_cursor must be a next_series_cursor value from a previous response")
+
+    fields = params.get('fields')
+    if fields in (None, ''):
+        fields = POINT_FIELDS
+    else:
+        names = fields if isinstance(fields, list) else str(fields).split(',')
+        names = {str(name).strip() for name in names if str(name).strip()}
+        unknown = names - set(POINT_FIELDS)
+        if unknown or not names:
+            raise ValueError(f"fields must be a comma-separated subset of {', '.join(POINT_FIELDS)}")
+        fields = tuple(name for name in POINT_FIELDS if name in names)
+    return SeriesOptions(positive_int('top_n'), offset, positive_int('series_limit'), fields)
+
+def parse_row_filters(args):
+    """Record filters from year_from, year_to (harvest years) and repeated season_name and crop_production_system.
+
+    Raises ValueError with a message for the client.
+    """
+    years = {}
+    for name in ('year_from', 'year_to'):
+        value = args.get(name)
+        if value in (None, ''):
+            years[name] = None
+            continue
+        try:
+            years[name] = int(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer") from None
+    if years['year_from'] is not None and years['year_to'] is not None and years['year_from'] > years['year_to']:
+        raise ValueError("year_from must not be after year_to")
+    return RowFilters(years['year_from'], years['year_to'],
+                      tuple(sorted({name for name in args.getlist('season_name') if name})),
+                      tuple(sorted({name for name in args.getlist('crop_production_system') if name})))
 
 
+# Headline figures of a unit whose records the row filters all leave out
+EMPTY_SLICE_SUMMARY = {
+    'unique_crops_count': 0,
+    'total_production': 0.0,
+    'unique_children_count': 0,
+    'min_planting_year': None,
+    'max_planting_year': None,
+    'missing_planting_years': [],
+}
+
 @app.route('/api/countries')
+@cached
 def get_countries():
+    snapshot = g.snapshot
     app.logger.info(f"Request received for /api/countries from {request.remote_addr}")
-    if not data.empty and 'country' in data.columns:
-        unique_countries = sorted(data['country'].dropna().unique().tolist())
+    if not snapshot.data.empty and 'country' in snapshot.data.columns:
+        unique_countries = country_names(snapshot.index)
+        mark('filter')
         app.logger.info(f"Found {len(unique_countries)} countries. Returning list.")
         return jsonify(unique_countries)
     app.logger.warning("Country data is empty or 'country' column missing. Returning empty list.")
     return jsonify([])
 
 @app.route('/api/admin1')
+@cached
 def get_admin1_levels():
+    snapshot = g.snapshot
     app.logger.info(f"Request received for /api/admin1 from {request.remote_addr} with args: {request.args}")
     country = request.args.get('country')
     
@@ -272,26 +288,29 @@ def get_admin1_levels():
         app.logger.warning("Missing 'country' parameter in /api/admin1 request.")
         return jsonify({"error": "Country parameter is required"}), 400
     
-    if data.empty:
+    mark('validate')
+    if snapshot.data.empty:
         app.logger.error("Data not loaded, cannot serve /api/admin1 request.")
         return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
     
-    # Filter by country
-    country_data = data[data['country'] == country].copy()
-    if country_data.empty:
+    # Look up the country in the row index
+    if not has_rows(snapshot.index, country):
         app.logger.info(f"No data found for country: {country}")
         return jsonify({"error": f"No data found for country: {country}"}), 404
     
-    if 'admin_1' not in country_data.columns:
+    if 'admin_1' not in snapshot.data.columns:
         app.logger.warning("admin_1 column not found in data.")
         return jsonify([])
     
-    unique_admin1 = sorted(country_data['admin_1'].dropna().unique().tolist())
+    unique_admin1 = child_names(snapshot.index, country)
+    mark('filter')
     app.logger.info(f"Found {len(unique_admin1)} admin1 levels for {country}. Returning list.")
     return jsonify(unique_admin1)
 
 @app.route('/api/admin2')
+@cached
 def get_admin2_levels():
+    snapshot = g.snapshot
     app.logger.info(f"Request received for /api/admin2 from {request.remote_addr} with args: {request.args}")
     country = request.args.get('country')
     admin_1_name = request.args.get('admin_1_name')
@@ -304,29 +323,29 @@ def get_admin2_levels():
         app.logger.warning("Missing 'admin_1_name' parameter in /api/admin2 request.")
         return jsonify({"error": "admin_1_name parameter is required"}), 400
     
-    if data.empty:
+    mark('validate')
+    if snapshot.data.empty:
         app.logger.error("Data not loaded, cannot serve /api/admin2 request.")
         return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
     
-    # Filter by country and admin_1
-    filtered_data = data[
-        (data['country'] == country) & (data['admin_1'] == admin_1_name)
-    ].copy()
-    
-    if filtered_data.empty:
+    # Look up country and admin_1 in the row index
+    if not has_rows(snapshot.index, country, admin_1_name):
         app.logger.info(f"No data found for admin_1: {admin_1_name} in country: {country}")
         return jsonify({"error": f"No data found for admin_1: {admin_1_name} in country: {country}"}), 404
     
-    if 'admin_2' not in filtered_data.columns:
+    if 'admin_2' not in snapshot.data.columns:
         app.logger.warning("admin_2 column not found in data.")
         return jsonify([])
     
-    unique_admin2 = sorted(filtered_data['admin_2'].dropna().unique().tolist())
+    unique_admin2 = child_names(snapshot.index, country, admin_1_name)
+    mark('filter')
     app.logger.info(f"Found {len(unique_admin2)} admin2 levels for {admin_1_name} in {country}. Returning list.")
     return jsonify(unique_admin2)
 
 @app.route('/api/data')
+@cached
 def get_data():
+    snapshot = g.snapshot
     app.logger.info(f"Request received for /api/data from {request.remote_addr} with args: {request.args}")
     country = request.args.get('country')
     admin_level_str = request.args.get('admin_level')
@@ -362,16 +381,41 @@ def get_data():
         app.logger.warning(f"Invalid 'timeseries_admin_level' value: {timeseries_admin_level}. Must be 0, 1, or 2.")
         return jsonify({"error": "timeseries_admin_level must be 0, 1, or 2"}), 400
 
-    if data.empty:
+    try:
+        row_flags = parse_qc_flags(request.args.get('exclude_qc'))
+        crop_flags = parse_qc_flags(request.args.get('exclude_flagged_crops'))
+        series_options = parse_series_options(request.args)
+        row_filters = parse_row_filters(request.args)
+    except ValueError as e:
+        app.logger.warning(f"Invalid series, filter or QC option: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    mark('validate')
+    if snapshot.data.empty:
         app.logger.error("Data not loaded, cannot serve /api/data request.")
         return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
 
-    # Filter by country
-    country_data = data[data['country'] == country].copy()
-    if country_data.empty:
+    # Look up the country in the row index
+    if not has_rows(snapshot.index, country):
         app.logger.info(f"No data found for country: {country}")
         return jsonify({"error": f"No data found for country: {country}"}), 404
 
+    layout = time_series_layout(snapshot.data.columns, timeseries_admin_level, split_by_season)
+
+    def unit_rollups(scope):
+        # Rollups without the QC-flagged rows or crops the request excludes,
+        # narrowed to a slice of years, seasons or systems when one is given.
+        # Returns them with the unit's headline figures (None if it has no rows).
+        if row_filters == ALL_ROWS:
+            rollups = snapshot_rollups(snapshot, row_flags, crop_flags, run_in_pool)
+            return rollups, rollup_summary(rollups, admin_level, scope)
+        rollups = snapshot_slice_rollups(snapshot, admin_level, scope, row_filters, [layout], row_flags, crop_flags, compute=run_in_pool)
+        summary = rollup_summary(rollups, admin_level, scope)
+        if summary is None and has_rows(snapshot.index, *scope):
+            # The unit exists; the slice just matches none of its records
+            summary = EMPTY_SLICE_SUMMARY
+        return rollups, summary
+
     response_data = {
         "country": country,
         "admin_level": admin_level,
@@ -379,24 +423,14 @@ def get_data():
     app.logger.info(f"Processing data for Country: {country}, Admin Level: {admin_level}")
 
     if admin_level == 0: # National level
-        response_data['unique_crops_count'] = country_data['product'].nunique() if 'product' in country_data else 0
-        response_data['total_national_production'] = country_data['production'].sum() if 'production' in country_data else 0
-        response_data['unique_admin_1_units_count'] = country_data['admin_1'].nunique() if 'admin_1' in country_data else 0
-
-        planting_years = country_data['planting_year'].dropna() if 'planting_year' in country_data else pd.Series(dtype='float64')
-        response_data['min_planting_year'] = int(planting_years.min()) if not planting_years.empty else None
-        response_data['max_planting_year'] = int(planting_years.max()) if not planting_years.empty else None
-        response_data['missing_planting_years'] = get_missing_years(planting_years)
-
-        crops_summary = {}
-        if 'product' in country_data.columns:
-            # Check if total_national_production is NaN (e.g. if all productions are NaN)
-            total_prod_for_calc = response_data['total_national_production']
-            if pd.isna(total_prod_for_calc): total_prod_for_calc = 0
-
-            for crop_name, df_crop in country_data.groupby('product'):
-                crops_summary[crop_name] = calculate_crop_details(df_crop, total_prod_for_calc, timeseries_admin_level, split_by_season)
-        response_data['crops_summary'] = crops_summary
+        scope = scope_key(0, country)
+        rollups, summary = unit_rollups(scope)
+        if summary is None:
+            app.logger.info(f"No data left for country: {country} after QC filtering")
+            return jsonify({"error": f"No data found for country: {country}"}), 404
+        response_data['unique_crops_count'] = summary['unique_crops_count']
+        response_data['total_national_production'] = summary['total_production']
+        response_data['unique_admin_1_units_count'] = summary['unique_children_count']
 
     elif admin_level == 1: # Admin 1 level
         admin_1_name = request.args.get('admin_1_name')
@@ -404,29 +438,17 @@ def get_data():
             app.logger.warning("Missing 'admin_1_name' for admin_level 1.")
             return jsonify({"error": "admin_1_name parameter is required for admin_level 1"}), 400
 
-        admin_1_data = country_data[country_data['admin_1'] == admin_1_name].copy()
-        if admin_1_data.empty:
+        scope = scope_key(1, country, admin_1_name)
+        rollups, summary = unit_rollups(scope)
+        if summary is None:
             app.logger.info(f"No data for Admin 1: {admin_1_name} in {country}")
             return jsonify({"error": f"No data found for Admin 1: {admin_1_name} in {country}"}), 404
 
         app.logger.info(f"Processing Admin-1 level data for {admin_1_name}")
         response_data['admin_1_name'] = admin_1_name
-        response_data['unique_crops_count'] = admin_1_data['product'].nunique() if 'product' in admin_1_data else 0
-        response_data['total_admin_1_production'] = admin_1_data['production'].sum() if 'production' in admin_1_data else 0
-        response_data['unique_admin_2_units_count'] = admin_1_data['admin_2'].nunique() if 'admin_2' in admin_1_data else 0
-
-        planting_years = admin_1_data['planting_year'].dropna() if 'planting_year' in admin_1_data else pd.Series(dtype='float64')
-        response_data['min_planting_year'] = int(planting_years.min()) if not planting_years.empty else None
-        response_data['max_planting_year'] = int(planting_years.max()) if not planting_years.empty else None
-        response_data['missing_planting_years'] = get_missing_years(planting_years)
-
-        crops_summary = {}
-        if 'product' in admin_1_data.columns:
-            total_prod_for_calc = response_data['total_admin_1_production']
-            if pd.isna(total_prod_for_calc): total_prod_for_calc = 0
-            for crop_name, df_crop in admin_1_data.groupby('product'):
-                crops_summary[crop_name] = calculate_crop_details(df_crop, total_prod_for_calc, timeseries_admin_level, split_by_season)
-        response_data['crops_summary'] = crops_summary
+        response_data['unique_crops_count'] = summary['unique_crops_count']
+        response_data['total_admin_1_production'] = summary['total_production']
+        response_data['unique_admin_2_units_count'] = summary['unique_children_count']
 
     elif admin_level == 2: # Admin 2 level
         admin_1_name = request.args.get('admin_1_name')
@@ -438,38 +460,33 @@ def get_data():
             app.logger.warning("Missing 'admin_2_name' for admin_level 2.")
             return jsonify({"error": "admin_2_name parameter is required for admin_level 2"}), 400
 
-        admin_2_data = country_data[
-            (country_data['admin_1'] == admin_1_name) & (country_data['admin_2'] == admin_2_name)
-        ].copy()
-
-        if admin_2_data.empty:
+        scope = scope_key(2, country, admin_1_name, admin_2_name)
+        rollups, summary = unit_rollups(scope)
+        if summary is None:
             app.logger.info(f"No data for Admin 2: {admin_2_name} in Admin 1: {admin_1_name}, Country: {country}")
             return jsonify({"error": f"No data found for Admin 2: {admin_2_name} in Admin 1: {admin_1_name}, Country: {country}"}), 404
 
         app.logger.info(f"Processing Admin-2 level data for {admin_2_name} in {admin_1_name}")
         response_data['admin_1_name'] = admin_1_name
         response_data['admin_2_name'] = admin_2_name
-        response_data['unique_crops_count'] = admin_2_data['product'].nunique() if 'product' in admin_2_data else 0
-        response_data['total_admin_2_production'] = admin_2_data['production'].sum() if 'production' in admin_2_data else 0
-
-        planting_years = admin_2_data['planting_year'].dropna() if 'planting_year' in admin_2_data else pd.Series(dtype='float64')
-        response_data['min_planting_year'] = int(planting_years.min()) if not planting_years.empty else None
-        response_data['max_planting_year'] = int(planting_years.max()) if not planting_years.empty else None
-        response_data['missing_planting_years'] = get_missing_years(planting_years)
-
-        crops_summary = {}
-        if 'product' in admin_2_data.columns:
-            total_prod_for_calc = response_data['total_admin_2_production']
-            if pd.isna(total_prod_for_calc): total_prod_for_calc = 0
-            for crop_name, df_crop in admin_2_data.groupby('product'):
-                crops_summary[crop_name] = calculate_crop_details(df_crop, total_prod_for_calc, timeseries_admin_level, split_by_season)
-        response_data['crops_summary'] = crops_summary
+        response_data['unique_crops_count'] = summary['unique_crops_count']
+        response_data['total_admin_2_production'] = summary['total_production']
+
+    response_data['min_planting_year'] = summary['min_planting_year']
+    response_data['max_planting_year'] = summary['max_planting_year']
+    response_data['missing_planting_years'] = summary['missing_planting_years']
+    mark('filter')
+    crops_summary = rollup_crops_summary(rollups, admin_level, scope, timeseries_admin_level, split_by_season, series_options)
+    response_data['crops_summary'] = attach_qc_flags(crops_summary, snapshot.qc_flags, country)
+    mark('aggregate')
 
     app.logger.info(f"Successfully processed /api/data request. Returning data for {country}, Level {admin_level}.")
     return jsonify(response_data)
 
 @app.route('/api/crop-timeseries')
+@cached
 def get_crop_timeseries():
+    snapshot = g.snapshot
     app.logger.info(f"Request received for /api/crop-timeseries from {request.remote_addr} with args: {request.args}")
     country = request.args.get('country')
     admin_level_str = request.args.get('admin_level')
@@ -509,24 +526,34 @@ def get_crop_timeseries():
         app.logger.warning(f"Invalid 'timeseries_admin_level' value: {timeseries_admin_level}. Must be 0, 1, or 2.")
         return jsonify({"error": "timeseries_admin_level must be 0, 1, or 2"}), 400
 
-    if data.empty:
+    try:
+        row_flags = parse_qc_flags(request.args.get('exclude_qc'))
+        crop_flags = parse_qc_flags(request.args.get('exclude_flagged_crops'))
+        series_options = parse_series_options(request.args)
+        row_filters = parse_row_filters(request.args)
+    except ValueError as e:
+        app.logger.warning(f"Invalid series, filter or QC option: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    mark('validate')
+    if snapshot.data.empty:
         app.logger.error("Data not loaded, cannot serve /api/crop-timeseries request.")
         return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
 
-    # Filter by country
-    country_data = data[data['country'] == country].copy()
-    if country_data.empty:
+    # Look up the country in the row index
+    if not has_rows(snapshot.index, country):
         app.logger.info(f"No data found for country: {country}")
         return jsonify({"error": f"No data found for country: {country}"}), 404
 
     # Apply admin level filtering
+    admin_1_name = None
+    admin_2_name = None
     if admin_level == 1:
         admin_1_name = request.args.get('admin_1_name')
         if not admin_1_name:
             app.logger.warning("Missing 'admin_1_name' for admin_level 1.")
             return jsonify({"error": "admin_1_name parameter is required for admin_level 1"}), 400
-        country_data = country_data[country_data['admin_1'] == admin_1_name].copy()
-        if country_data.empty:
+        if not has_rows(snapshot.index, country, admin_1_name):
             app.logger.info(f"No data for Admin 1: {admin_1_name} in {country}")
             return jsonify({"error": f"No data found for Admin 1: {admin_1_name} in {country}"}), 404
 
@@ -536,27 +563,480 @@ def get_crop_timeseries():
         if not admin_1_name or not admin_2_name:
             app.logger.warning("Missing admin names for admin_level 2.")
             return jsonify({"error": "admin_1_name and admin_2_name parameters are required for admin_level 2"}), 400
-        country_data = country_data[
-            (country_data['admin_1'] == admin_1_name) & (country_data['admin_2'] == admin_2_name)
-        ].copy()
-        if country_data.empty:
+        if not has_rows(snapshot.index, country, admin_1_name, admin_2_name):
             app.logger.info(f"No data for Admin 2: {admin_2_name} in Admin 1: {admin_1_name}, Country: {country}")
             return jsonify({"error": f"No data found for Admin 2: {admin_2_name} in Admin 1: {admin_1_name}, Country: {country}"}), 404
 
-    # Filter by crop
-    crop_data = country_data[country_data['product'] == crop_name].copy()
-    if crop_data.empty:
+    mark('filter')
+    # Look up the crop's precomputed time series
+    scope = scope_key(admin_level, country, admin_1_name, admin_2_name)
+    if row_filters == ALL_ROWS:
+        rollups = snapshot_rollups(snapshot, row_flags, crop_flags, run_in_pool)
+    else:
+        # Only the crop's rows in the unit are read, into its time series alone
+        layout = time_series_layout(snapshot.data.columns, timeseries_admin_level, split_by_season)
+        rollups = snapshot_slice_rollups(snapshot, admin_level, scope, row_filters, [layout], row_flags, crop_flags, crop_name,
+                                         time_series_only=True, compute=run_in_pool)
+    page = rollup_crop_time_series(rollups, admin_level, scope, crop_name, timeseries_admin_level, split_by_season, series_options)
+    if page is None and row_filters != ALL_ROWS and has_rows(snapshot.index, *scope, product=crop_name):
+        # The unit grows the crop; the slice just matches none of its records
+        page = empty_time_series_page(layout)
+    mark('aggregate')
+    if page is None:
         app.logger.info(f"No data found for crop: {crop_name}")
         return jsonify({"error": f"No data found for crop: {crop_name}"}), 404
 
-    # Calculate crop details with specified timeseries admin level
-    crop_details = calculate_crop_details(crop_data, 0, timeseries_admin_level, split_by_season)
-    
+    time_series_data, series_count = page
     app.logger.info(f"Successfully processed /api/crop-timeseries request for {crop_name} in {country}.")
-    return jsonify({
+    response_data = {
         "crop_name": crop_name,
-        "time_series_data": crop_details.get('time_series_data', [])
-    })
+        "time_series_data": time_series_data
+    }
+    if series_options != SeriesOptions():
+        response_data['time_series_count'] = series_count
+        response_data['next_series_cursor'] = next_series_cursor(series_options, series_count)
+    return jsonify(response_data)
+
+@app.route('/api/crop-statistics')
+@cached
+def get_crop_statistics():
+    """Yield trend, coefficient of variation and detrended anomalies per series.
+
+    Takes the unit and time series parameters of /api/crop-timeseries;
+    without crop_name every crop of the unit is covered. Years whose
+    anomaly is more than outlier_z residual standard deviations from the
+    trend are listed as outlier_years.
+    """
+    snapshot = g.snapshot
+    app.logger.info(f"Request received for /api/crop-statistics from {request.remote_addr} with args: {request.args}")
+    country = request.args.get('country')
+    admin_level_str = request.args.get('admin_level', '0')
+    crop_name = request.args.get('crop_name')
+    timeseries_admin_level_str = request.args.get('timeseries_admin_level', '0')
+    split_by_season = request.args.get('split_by_season', 'false').lower() == 'true'
+
+    if not country:
+        app.logger.warning("Missing 'country' parameter in /api/crop-statistics request.")
+        return jsonify({"error": "Country parameter is required"}), 400
+
+    try:
+        admin_level = int(admin_level_str)
+        timeseries_admin_level = int(timeseries_admin_level_str)
+    except ValueError:
+        app.logger.warning(f"Invalid admin level parameters: {admin_level_str}, {timeseries_admin_level_str}.")
+        return jsonify({"error": "admin_level and timeseries_admin_level must be integers (0, 1, or 2)"}), 400
+    if admin_level not in [0, 1, 2] or timeseries_admin_level not in [0, 1, 2]:
+        return jsonify({"error": "admin_level and timeseries_admin_level must be 0, 1, or 2"}), 400
+
+    admin_1_name = request.args.get('admin_1_name') if admin_level >= 1 else None
+    admin_2_name = request.args.get('admin_2_name') if admin_level == 2 else None
+    if admin_level >= 1 and not admin_1_name:
+        return jsonify({"error": f"admin_1_name parameter is required for admin_level {admin_level}"}), 400
+    if admin_level == 2 and not admin_2_name:
+        return jsonify({"error": "admin_2_name parameter is required for admin_level 2"}), 400
+
+    try:
+        outlier_z = float(request.args.get('outlier_z', OUTLIER_Z))
+    except ValueError:
+        outlier_z = -1
+    if not outlier_z > 0:
+        return jsonify({"error": "outlier_z must be a positive number"}), 400
+
+    try:
+        row_flags = parse_qc_flags(request.args.get('exclude_qc'))
+        crop_flags = parse_qc_flags(request.args.get('exclude_flagged_crops'))
+        series_options = parse_series_options(request.args)
+    except ValueError as e:
+        app.logger.warning(f"Invalid series or QC option: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    mark('validate')
+    if snapshot.data.empty:
+        app.logger.error("Data not loaded, cannot serve /api/crop-statistics request.")
+        return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
+
+    if not has_rows(snapshot.index, country, admin_1_name, admin_2_name):
+        app.logger.info(f"No data for admin unit: {admin_2_name or admin_1_name or country}")
+        return jsonify({"error": f"No data found for admin unit: {admin_2_name or admin_1_name or country}"}), 404
+
+    mark('filter')
+    scope = scope_key(admin_level, country, admin_1_name, admin_2_name)
+    rollups = snapshot_rollups(snapshot, row_flags, crop_flags, run_in_pool)
+    statistics = rollup_crop_statistics(rollups, admin_level, scope, [crop_name] if crop_name else None,
+                                        timeseries_admin_level, split_by_season, series_options, outlier_z)
+    mark('aggregate')
+    if statistics is None or (crop_name and crop_name not in statistics):
+        app.logger.info(f"No yield data found for {crop_name or 'any crop'} in {admin_2_name or admin_1_name or country}")
+        return jsonify({"error": f"No data found for crop: {crop_name}" if crop_name else "No yield data found"}), 404
+
+    crops = {}
+    for name, (series_statistics, series_count) in statistics.items():
+        crops[name] = {"series": series_statistics}
+        if series_options != SeriesOptions():
+            crops[name]['series_count'] = series_count
+            crops[name]['next_series_cursor'] = next_series_cursor(series_options, series_count)
+    response_data = {"country": country, "admin_level": admin_level, "crops": crops}
+    if admin_1_name is not None:
+        response_data['admin_1_name'] = admin_1_name
+    if admin_2_name is not None:
+        response_data['admin_2_name'] = admin_2_name
+    app.logger.info(f"Successfully processed /api/crop-statistics request: {len(crops)} crops in {country}.")
+    return jsonify(response_data)
+
+@app.route('/api/continental')
+@cached
+def get_continental():
+    """A crop and/or season summed per country and over many or all countries.
+
+    `crop_name` and `season_name` select what is summed (at least one is
+    required); `country` may be repeated and defaults to every country.
+    Answered from each country's national rollups, without scanning rows.
+    """
+    snapshot = g.snapshot
+    app.logger.info(f"Request received for /api/continental from {request.remote_addr} with args: {request.args}")
+    crop_name = request.args.get('crop_name')
+    season_name = request.args.get('season_name')
+    countries = request.args.getlist('country')
+
+    if not crop_name and not season_name:
+        app.logger.warning("Missing 'crop_name' and 'season_name' parameters in /api/continental request.")
+        return jsonify({"error": "crop_name or season_name parameter is required"}), 400
+
+    try:
+        row_flags = parse_qc_flags(request.args.get('exclude_qc'))
+        crop_flags = parse_qc_flags(request.args.get('exclude_flagged_crops'))
+    except ValueError as e:
+        app.logger.warning(f"Invalid QC option: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    mark('validate')
+    if snapshot.data.empty:
+        app.logger.error("Data not loaded, cannot serve /api/continental request.")
+        return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
+
+    for country in countries:
+        if not has_rows(snapshot.index, country):
+            app.logger.info(f"No data found for country: {country}")
+            return jsonify({"error": f"No data found for country: {country}"}), 404
+
+    mark('filter')
+    rollups = snapshot_rollups(snapshot, row_flags, crop_flags, run_in_pool)
+    result = rollup_continental(rollups, countries or country_names(snapshot.index), crop_name, season_name)
+    mark('aggregate')
+    if result is None:
+        selection = ' / '.join(name for name in (crop_name, season_name) if name)
+        app.logger.info(f"No data found for {selection} in the selected countries")
+        return jsonify({"error": f"No data found for: {selection}"}), 404
+
+    app.logger.info(f"Successfully processed /api/continental request: {len(result['countries'])} countries.")
+    return jsonify({"crop_name": crop_name, "season_name": season_name, **result})
+
+@app.route('/api/coverage')
+@cached
+def get_coverage():
+    """Which harvest years have data, per series, for one or more countries.
+
+    `group_by` is a comma-separated subset of admin_1, admin_2, product and
+    season_name (default: all of them, one row per series; `country` alone
+    gives one row per country). `country` may be repeated and defaults to
+    every country; `crop_name` keeps one product. Rows carry their gap
+    years and line up with the rows of a 0/1 matrix over `years`.
+    """
+    snapshot = g.snapshot
+    app.logger.info(f"Request received for /api/coverage from {request.remote_addr} with args: {request.args}")
+    countries = request.args.getlist('country')
+    crop_name = request.args.get('crop_name')
+    group_by_str = request.args.get('group_by')
+
+    if group_by_str is None:
+        group_by = list(COVERAGE_COLUMNS)
+    else:
+        names = [name.strip() for name in group_by_str.split(',') if name.strip() and name.strip() != 'country']
+        unknown = [name for name in names if name not in COVERAGE_COLUMNS]
+        if unknown:
+            app.logger.warning(f"Invalid 'group_by' parameter: {group_by_str}.")
+            return jsonify({"error": f"group_by must be 'country' or a comma-separated subset of {', '.join(COVERAGE_COLUMNS)}"}), 400
+        group_by = [col for col in COVERAGE_COLUMNS if col in names]
+
+    try:
+        row_flags = parse_qc_flags(request.args.get('exclude_qc'))
+        crop_flags = parse_qc_flags(request.args.get('exclude_flagged_crops'))
+    except ValueError as e:
+        app.logger.warning(f"Invalid QC option: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    mark('validate')
+    if snapshot.data.empty:
+        app.logger.error("Data not loaded, cannot serve /api/coverage request.")
+        return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
+
+    for country in countries:
+        if not has_rows(snapshot.index, country):
+            app.logger.info(f"No data found for country: {country}")
+            return jsonify({"error": f"No data found for country: {country}"}), 404
+
+    mark('filter')
+    rollups = snapshot_rollups(snapshot, row_flags, crop_flags, run_in_pool)
+    groups = rollup_coverage(rollups, countries or country_names(snapshot.index), group_by, crop_name)
+    response_data = {"group_by": group_by, "crop_name": crop_name, **emit_coverage(groups, group_by)}
+    mark('aggregate')
+    app.logger.info(f"Successfully processed /api/coverage request: {len(groups)} countries over {len(response_data['years'])} years.")
+    return jsonify(response_data)
+
+def parse_batch_flag(value):
+    # JSON booleans or the 'true'/'false' strings the GET endpoints take
+    return value if isinstance(value, bool) else str(value).lower() == 'true'
+
+@app.route('/api/crop-timeseries/batch', methods=['POST'])
+def get_crop_timeseries_batch():
+    """Several crop time series for one or more admin units of a country.
+
+    Body: {"country": ..., "specs": [{"crop_name", "timeseries_admin_level",
+    "split_by_season"}, ...], "units": [{"admin_level", "admin_1_name",
+    "admin_2_name"}, ...]}. Without "units", the unit is read from top-level
+    admin_level/admin_1_name/admin_2_name as in /api/crop-timeseries.
+    "exclude_qc" and "exclude_flagged_crops" filter and "top_n", "series_limit",
+    "series_cursor" and "fields" select series as on /api/data.
+    Unknown units or crops are reported per item instead of failing the batch.
+    """
+    snapshot = g.snapshot
+    app.logger.info(f"Request received for /api/crop-timeseries/batch from {request.remote_addr}")
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        app.logger.warning("Missing or invalid JSON body in /api/crop-timeseries/batch request.")
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+
+    country = body.get('country')
+    specs = body.get('specs')
+    units = body.get('units')
+    if units is None:
+        units = [{key: body[key] for key in ('admin_level', 'admin_1_name', 'admin_2_name') if key in body}]
+
+    if not country:
+        app.logger.warning("Missing 'country' in /api/crop-timeseries/batch request.")
+        return jsonify({"error": "Country parameter is required"}), 400
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"error": "specs must be a non-empty list"}), 400
+    if not isinstance(units, list) or not units:
+        return jsonify({"error": "units must be a non-empty list"}), 400
+    if len(specs) * len(units) > MAX_BATCH_ITEMS:
+        app.logger.warning(f"Rejected batch of {len(specs) * len(units)} time series (max {MAX_BATCH_ITEMS}).")
+        return jsonify({"error": f"A batch may request at most {MAX_BATCH_ITEMS} time series"}), 400
+
+    try:
+        row_flags = parse_qc_flags(body.get('exclude_qc'))
+        crop_flags = parse_qc_flags(body.get('exclude_flagged_crops'))
+        series_options = parse_series_options(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    parsed_specs = []
+    for spec in specs:
+        if not isinstance(spec, dict) or not spec.get('crop_name'):
+            return jsonify({"error": "Each spec requires a crop_name"}), 400
+        try:
+            timeseries_admin_level = int(spec.get('timeseries_admin_level', 0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "timeseries_admin_level must be an integer (0, 1, or 2)"}), 400
+        if timeseries_admin_level not in [0, 1, 2]:
+            return jsonify({"error": "timeseries_admin_level must be 0, 1, or 2"}), 400
+        parsed_specs.append((spec['crop_name'], timeseries_admin_level, parse_batch_flag(spec.get('split_by_season', False))))
+
+    parsed_units = []
+    for unit in units:
+        if not isinstance(unit, dict) or unit.get('admin_level') is None:
+            return jsonify({"error": "admin_level parameter is required"}), 400
+        try:
+            admin_level = int(unit['admin_level'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "admin_level must be an integer (0, 1, or 2)"}), 400
+        if admin_level not in [0, 1, 2]:
+            return jsonify({"error": "admin_level must be 0, 1, or 2"}), 400
+        admin_1_name = unit.get('admin_1_name') if admin_level >= 1 else None
+        admin_2_name = unit.get('admin_2_name') if admin_level == 2 else None
+        if admin_level >= 1 and not admin_1_name:
+            return jsonify({"error": f"admin_1_name parameter is required for admin_level {admin_level}"}), 400
+        if admin_level == 2 and not admin_2_name:
+            return jsonify({"error": "admin_2_name parameter is required for admin_level 2"}), 400
+        parsed_units.append((admin_level, admin_1_name, admin_2_name))
+
+    mark('validate')
+    if snapshot.data.empty:
+        app.logger.error("Data not loaded, cannot serve /api/crop-timeseries/batch request.")
+        return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
+
+    if not has_rows(snapshot.index, country):
+        app.logger.info(f"No data found for country: {country}")
+        return jsonify({"error": f"No data found for country: {country}"}), 404
+
+    rollups = snapshot_rollups(snapshot, row_flags, crop_flags, run_in_pool)
+    unit_results = []
+    for admin_level, admin_1_name, admin_2_name in parsed_units:
+        unit_result = {"admin_level": admin_level}
+        if admin_1_name is not None:
+            unit_result['admin_1_name'] = admin_1_name
+        if admin_2_name is not None:
+            unit_result['admin_2_name'] = admin_2_name
+        unit_results.append(unit_result)
+
+        if not has_rows(snapshot.index, country, admin_1_name, admin_2_name):
+            unit_result['error'] = f"No data found for admin unit: {admin_2_name or admin_1_name} in {country}"
+            continue
+
+        scope = scope_key(admin_level, country, admin_1_name, admin_2_name)
+        crop_results = []
+        pages = rollup_crop_time_series_pages(rollups, admin_level, scope, parsed_specs, series_options)
+        for (crop_name, timeseries_admin_level, split_by_season), page in zip(parsed_specs, pages):
+            crop_result = {
+                "crop_name": crop_name,
+                "timeseries_admin_level": timeseries_admin_level,
+                "split_by_season": split_by_season,
+            }
+            if page is None:
+                crop_result['error'] = f"No data found for crop: {crop_name}"
+            else:
+                crop_result['time_series_data'] = page[0]
+                if series_options != SeriesOptions():
+                    crop_result['time_series_count'] = page[1]
+                    crop_result['next_series_cursor'] = next_series_cursor(series_options, page[1])
+            crop_results.append(crop_result)
+        unit_result['crops'] = crop_results
+
+    mark('aggregate')
+    app.logger.info(f"Successfully processed /api/crop-timeseries/batch request: {len(parsed_specs)} crops x {len(parsed_units)} units in {country}.")
+    return jsonify({"country": country, "units": unit_results})
+
+@app.route('/api/export')
+def export_records():
+    """Stream the raw rows matching the filters as CSV, NDJSON or Arrow IPC.
+
+    `country`, `crop_name`, `season_name` and `crop_production_system` may
+    be repeated; without a country every country is exported. Rows are
+    serialized chunk by chunk, so the response starts immediately and
+    memory stays bounded.
+    """
+    snapshot = g.snapshot
+    app.logger.info(f"Request received for /api/export from {request.remote_addr} with args: {request.args}")
+    fmt = request.args.get('format', 'csv').lower()
+    countries = request.args.getlist('country')
+    admin_1_name = request.args.get('admin_1_name')
+    admin_2_name = request.args.get('admin_2_name')
+    crop_names = request.args.getlist('crop_name')
+
+    if fmt not in EXPORT_MIMETYPES:
+        app.logger.warning(f"Invalid 'format' parameter: {fmt}.")
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_MIMETYPES)}"}), 400
+    if fmt not in export_formats():
+        return jsonify({"error": f"{fmt} export is not available on this server (pyarrow is not installed)"}), 400
+
+    try:
+        row_filters = parse_row_filters(request.args)
+    except ValueError as e:
+        app.logger.warning(f"Invalid filter option: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    if (admin_1_name or admin_2_name) and len(countries) != 1:
+        return jsonify({"error": "admin_1_name and admin_2_name require exactly one country"}), 400
+    if admin_2_name and not admin_1_name:
+        return jsonify({"error": "admin_1_name parameter is required with admin_2_name"}), 400
+
+    mark('validate')
+    if snapshot.data.empty:
+        app.logger.error("Data not loaded, cannot serve /api/export request.")
+        return jsonify({"error": "Data not loaded or CSV processing failed on server."}), 500
+
+    for country in countries:
+        if not has_rows(snapshot.index, country):
+            app.logger.info(f"No data found for country: {country}")
+            return jsonify({"error": f"No data found for country: {country}"}), 404
+    if admin_1_name and not has_rows(snapshot.index, countries[0], admin_1_name, admin_2_name):
+        app.logger.info(f"No data for admin unit: {admin_2_name or admin_1_name} in {countries[0]}")
+        return jsonify({"error": f"No data found for admin unit: {admin_2_name or admin_1_name} in {countries[0]}"}), 404
+
+    mark('filter')
+    chunks = export_chunks(
+        snapshot.data, snapshot.index, countries or country_names(snapshot.index),
+        admin_1_name, admin_2_name, crop_names, row_filters,
+    )
+    response = Response(stream_with_context(stream_export(fmt, chunks, snapshot.data)), mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f"attachment; filename=hvstat_export.{EXPORT_EXTENSIONS[fmt]}"
+    app.logger.info(f"Streaming {fmt} export for {', '.join(countries) or 'all countries'}.")
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def admin_error():
+    """Error response if the request may not use the admin endpoints, else None."""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled (set HVSTAT_ADMIN_TOKEN)"}), 403
+    if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        app.logger.warning(f"Rejected admin request from {request.remote_addr}: bad token.")
+        return jsonify({"error": "Invalid admin token"}), 403
+    return None
+
+def dataset_status():
+    snapshot = g.snapshot
+    return {
+        "path": snapshot.path,
+        "version": snapshot.version,
+        "rows": len(snapshot.data),
+        "loaded_at": snapshot.loaded_at,
+        "deltas": len(snapshot.deltas),
+        "load_report": snapshot.load_report,
+        "reload": store.status,
+    }
+
+@app.route('/api/admin/dataset')
+def get_dataset_status():
+    error = admin_error()
+    if error is not None:
+        return error
+    return jsonify(dataset_status())
+
+@app.route('/api/admin/reload', methods=['POST'])
+def reload_dataset():
+    app.logger.info(f"Request received for /api/admin/reload from {request.remote_addr} with args: {request.args}")
+    error = admin_error()
+    if error is not None:
+        return error
+
+    # Optionally switch to another release file next to the current one
+    file_name = request.args.get('file')
+    csv_path = None
+    if file_name:
+        if os.path.basename(file_name) != file_name or not file_name.endswith('.csv'):
+            return jsonify({"error": "file must be the name of a .csv file in the data directory"}), 400
+        csv_path = os.path.join(DATA_DIR, file_name)
+        if not os.path.isfile(csv_path):
+            return jsonify({"error": f"Data file not found: {file_name}"}), 404
+
+    if not store.reload_in_background(csv_path):
+        return jsonify({"error": "A reload is already in progress", **dataset_status()}), 409
+    app.logger.info(f"Started background reload of {csv_path or store.csv_path}.")
+    return jsonify(dataset_status()), 202
+
+@app.route('/api/admin/ingest', methods=['POST'])
+def ingest_delta():
+    """Upsert the records of the CSV request body into the live dataset.
+
+    Rows replace the records with the same key (see `ingest.RECORD_KEY`) or
+    are added. Only the affected countries are re-aggregated.
+    """
+    app.logger.info(f"Request received for /api/admin/ingest from {request.remote_addr}")
+    error = admin_error()
+    if error is not None:
+        return error
+    content = request.get_data()
+    if not content:
+        return jsonify({"error": "Request body must be a CSV of records"}), 400
+    try:
+        report = store.ingest(content)
+    except DeltaError as e:
+        app.logger.warning(f"Rejected delta: {e}")
+        return jsonify({"error": "Invalid delta", "details": e.errors}), 400
+    return jsonify(report)
 
 if __name__ == '__main__':
     # Make sure to set debug=False for production environments
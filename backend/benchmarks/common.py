@@ -0,0 +1,134 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import write_csv
+
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), 'hvstat-bench')
+
+
+def synthetic_csv(rows, seed=0, work_dir=DEFAULT_WORK_DIR):
+    """Path of a synthetic dataset with `rows` rows, generated on first use."""
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, f"hvstat_synthetic_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        print(f"Generating {rows} synthetic rows -> {path}")
+        write_csv(path + '.tmp', rows, seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def load_app(csv_path, snapshot_dir=None):
+    """Import the Flask app serving `csv_path`; returns (module, startup seconds).
+
+    Request logging is silenced so it does not dominate the timings.
+    """
+    os.environ['HVSTAT_DATA_PATH'] = os.path.abspath(csv_path)
+    os.environ['HVSTAT_SNAPSHOT_DIR'] = snapshot_dir or os.path.join(DEFAULT_WORK_DIR, 'snapshots')
+    started = time.perf_counter()
+    import app
+    elapsed = time.perf_counter() - started
+    if app.store.current().data.empty:
+        raise SystemExit(f"The app failed to load {csv_path}")
+    logging.disable(logging.INFO)
+    app.app.logger.disabled = True
+    return app, elapsed
+
+
+def rss_mb():
+    """Current resident set size in MiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 2 ** 20 if peak > 2 ** 32 else peak / 1024
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def latency_stats(samples):
+    """p50/p95/p99/mean/max of a list of durations in seconds, in milliseconds."""
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(ms):
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'count': len(ms),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+
+def print_stats_table(stats):
+    """Print {name: latency_stats} as an aligned table."""
+    width = max([len(name) for name in stats] + [4])
+    columns = ['count', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'max_ms']
+    print(f"{'name':<{width}}  " + '  '.join(f"{col:>10}" for col in columns))
+    for name, row in stats.items():
+        print(f"{name:<{width}}  " + '  '.join(f"{row.get(col, ''):>10}" for col in columns))
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote report to {path}")
+
+
+def compare_reports(baseline_path, stats, metric='p95_ms', tolerance=0.2, min_ms=1.0):
+    """Names whose `metric` regressed by more than `tolerance` vs a saved report.
+
+    Differences under `min_ms` are ignored, since sub-millisecond timings are noise.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)['stats']
+    regressions = []
+    for name, row in stats.items():
+        before = baseline.get(name, {}).get(metric)
+        after = row.get(metric)
+        if before is None or after is None:
+            continue
+        if after > before * (1 + tolerance) and after - before > min_ms:
+            regressions.append((name, before, after))
+    return regressions
+
+
+def add_common_arguments(parser):
+    parser.add_argument('--rows', type=int, default=100_000, help='synthetic dataset size (10k-10M)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help='benchmark this CSV instead of synthetic data')
+    parser.add_argument('--json', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='fail if p95 latencies regressed vs this JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown for --compare (0.2 = 20%%)')
+
+
+def finish(args, report):
+    """Write and/or compare the report per the CLI flags; returns the exit code."""
+    if args.json:
+        write_report(args.json, report)
+    if args.compare:
+        regressions = compare_reports(args.compare, report['stats'], tolerance=args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p95 {before:.3f}ms -> {after:.3f}ms")
+        if regressions:
+            return 1
+        print(f"No p95 regressions beyond {args.tolerance:.0%} vs {args.compare}")
+    return 0
@@ -0,0 +1,127 @@
+"""Microbenchmarks of the aggregation functions, startup builds and every route.
+
+Routes are timed cold (response cache cleared before each call) and warm.
+
+    cd backend
+    python -m benchmarks.micro --rows 1000000 --json micro.json
+    python -m benchmarks.micro --rows 1000000 --compare micro.json
+"""
+import argparse
+import sys
+
+from benchmarks.common import (add_common_arguments, finish, latency_stats, load_app, peak_rss_mb,
+                               print_stats_table, rss_mb, synthetic_csv, timed)
+
+
+def sample_calls(fn, repeat):
+    fn()  # warm-up
+    return [timed(fn)[0] for _ in range(repeat)]
+
+
+def largest_unit(app):
+    """The country, admin_1, admin_2 and crop with the most rows: the worst case per request."""
+    data = app.store.current().data
+    country = data['country'].value_counts().idxmax()
+    rows = data[data['country'] == country]
+    admin_1 = rows['admin_1'].value_counts().idxmax()
+    admin_2_rows = rows[rows['admin_1'] == admin_1]['admin_2'].dropna()
+    admin_2 = admin_2_rows.value_counts().idxmax() if len(admin_2_rows) else None
+    crop = rows['product'].value_counts().idxmax()
+    return country, admin_1, admin_2, crop
+
+
+def function_benchmarks(app, repeat):
+    from aggregation import calculate_crop_details, calculate_crops_summary, missing_years
+    from dataset import build_index, select_rows
+    from rollups import build_rollups
+
+    snapshot = app.store.current()
+    country, admin_1, _, crop = largest_unit(app)
+    country_rows = select_rows(snapshot.data, snapshot.index, country)
+    crop_rows = select_rows(snapshot.data, snapshot.index, country, product=crop)
+    total = crop_rows['production'].sum()
+    years = sorted(set(country_rows['planting_year'].dropna().astype(int).tolist()))
+
+    benchmarks = {}
+    for ts_level in (0, 1, 2):
+        for split in (False, True) if ts_level == 0 else (False,):
+            name = f"calculate_crop_details ts={ts_level}{' split' if split else ''}"
+            benchmarks[name] = lambda ts_level=ts_level, split=split: calculate_crop_details(crop_rows, total, ts_level, split)
+    benchmarks['calculate_crops_summary country'] = lambda: calculate_crops_summary(country_rows)
+    benchmarks['missing_years'] = lambda: missing_years(years)
+    benchmarks['select_rows admin_1+crop'] = lambda: select_rows(snapshot.data, snapshot.index, country, admin_1, product=crop)
+
+    stats = {name: latency_stats(sample_calls(fn, repeat)) for name, fn in benchmarks.items()}
+    # Startup builds are slow at scale, so they run once
+    elapsed, index = timed(build_index, snapshot.data)
+    stats['build_index'] = latency_stats([elapsed])
+    stats['build_rollups'] = latency_stats([timed(build_rollups, snapshot.data, index)[0]])
+    return stats
+
+
+def route_requests(app):
+    country, admin_1, admin_2, crop = largest_unit(app)
+    unit = {'country': country, 'admin_level': '1', 'admin_1_name': admin_1}
+    # The last decade only, as the frontend's narrowed views ask for it
+    recent = {'year_from': str(int(app.store.current().data['harvest_year'].max()) - 9)}
+    requests = {
+        'countries': ('/api/countries', {}),
+        'admin1': ('/api/admin1', {'country': country}),
+        'admin2': ('/api/admin2', {'country': country, 'admin_1_name': admin_1}),
+        'data L0': ('/api/data', {'country': country, 'admin_level': '0'}),
+        'data L0 ts=2': ('/api/data', {'country': country, 'admin_level': '0', 'timeseries_admin_level': '2'}),
+        'data L0 split': ('/api/data', {'country': country, 'admin_level': '0', 'split_by_season': 'true'}),
+        'data L1': ('/api/data', unit),
+        'data L0 ts=2 10y': ('/api/data', {'country': country, 'admin_level': '0', 'timeseries_admin_level': '2', **recent}),
+        'crop-timeseries L0': ('/api/crop-timeseries', {'country': country, 'admin_level': '0', 'crop_name': crop}),
+        'crop-timeseries L1 ts=2': ('/api/crop-timeseries', {**unit, 'crop_name': crop, 'timeseries_admin_level': '2'}),
+        'crop-timeseries L1 ts=2 10y': ('/api/crop-timeseries', {**unit, 'crop_name': crop, 'timeseries_admin_level': '2', **recent}),
+        'continental crop': ('/api/continental', {'crop_name': crop}),
+        'coverage all': ('/api/coverage', {}),
+        'coverage by crop': ('/api/coverage', {'group_by': 'product'}),
+        'crop-statistics L0 ts=2': ('/api/crop-statistics', {'country': country, 'admin_level': '0', 'timeseries_admin_level': '2'}),
+    }
+    if admin_2 is not None:
+        requests['data L2'] = ('/api/data', {**unit, 'admin_level': '2', 'admin_2_name': admin_2})
+    return requests
+
+
+def route_benchmarks(app, repeat):
+    client = app.app.test_client()
+    stats = {}
+    for name, (path, params) in route_requests(app).items():
+        def call():
+            response = client.get(path, query_string=params)
+            assert response.status_code == 200, (path, params, response.status_code)
+
+        def cold_call():
+            app.response_cache.clear()
+            call()
+
+        stats[f"GET {name} (cold)"] = latency_stats(sample_calls(cold_call, repeat))
+        stats[f"GET {name} (warm)"] = latency_stats(sample_calls(call, repeat))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_common_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per benchmark')
+    args = parser.parse_args()
+
+    csv_path = args.csv or synthetic_csv(args.rows, args.seed)
+    app, startup = load_app(csv_path)
+    rows = len(app.store.current().data)
+    print(f"Loaded {rows} rows in {startup:.2f}s, RSS {rss_mb():.0f} MiB")
+
+    stats = function_benchmarks(app, args.repeat)
+    stats.update(route_benchmarks(app, args.repeat))
+    print_stats_table(stats)
+    print(f"Peak RSS {peak_rss_mb():.0f} MiB")
+
+    report = {'rows': rows, 'csv': csv_path, 'startup_s': round(startup, 3), 'peak_rss_mb': round(peak_rss_mb(), 1), 'stats': stats}
+    return finish(args, report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
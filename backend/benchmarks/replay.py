@@ -0,0 +1,111 @@
+"""End-to-end replay of the frontend's request sequence.
+
+Each simulated session does what a user clicking through the UI triggers:
+countries -> admin1 -> admin2 -> data (at a random admin level and time
+series option) -> crop-timeseries for a few crops while toggling the time
+series level and season split. Latency percentiles are reported per route
+and overall, with memory before and after.
+
+    cd backend
+    python -m benchmarks.replay --rows 1000000 --sessions 200 --json replay.json
+"""
+import argparse
+import random
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.common import (add_common_arguments, finish, latency_stats, load_app, peak_rss_mb,
+                               print_stats_table, rss_mb, synthetic_csv)
+
+
+def session_requests(client, rng, countries):
+    """Yield (route, path, params) for one UI session, choosing like a user would."""
+    yield 'countries', '/api/countries', {}
+    country = rng.choice(countries)
+    admin_level = rng.choice(['0', '1', '2'])
+    unit = {'country': country, 'admin_level': admin_level}
+    if admin_level != '0':
+        params = {'country': country}
+        yield 'admin1', '/api/admin1', params
+        admin1_options = client.get('/api/admin1', query_string=params).get_json() or []
+        if not admin1_options:
+            return
+        unit['admin_1_name'] = rng.choice(admin1_options)
+    if admin_level == '2':
+        params = {'country': country, 'admin_1_name': unit['admin_1_name']}
+        yield 'admin2', '/api/admin2', params
+        admin2_options = client.get('/api/admin2', query_string=params).get_json() or []
+        if not admin2_options:
+            # Countries reported at admin-1 only; fall back like the UI does
+            unit['admin_level'] = '1'
+        else:
+            unit['admin_2_name'] = rng.choice(admin2_options)
+
+    timeseries_admin_level = rng.choice(['0', '0', '1', '2'])
+    params = {**unit, 'timeseries_admin_level': timeseries_admin_level,
+              'split_by_season': 'true' if timeseries_admin_level == '0' and rng.random() < 0.3 else 'false'}
+    yield 'data', '/api/data', params
+    crops = sorted((client.get('/api/data', query_string=params).get_json() or {}).get('crops_summary', {}))
+    for crop in rng.sample(crops, min(3, len(crops))):
+        for crop_level, split in [('1', 'false'), ('2', 'false'), ('0', 'true')]:
+            yield 'crop-timeseries', '/api/crop-timeseries', {
+                **unit, 'crop_name': crop, 'timeseries_admin_level': crop_level, 'split_by_season': split,
+            }
+
+
+def replay(app, sessions, seed, cold):
+    client = app.app.test_client()
+    rng = random.Random(seed)
+    countries = client.get('/api/countries').get_json()
+    samples = defaultdict(list)
+    errors = 0
+    for _ in range(sessions):
+        # Building the session issues its own option lookups; only the yielded requests are timed
+        requests = list(session_requests(client, rng, countries))
+        if cold:
+            app.response_cache.clear()
+        for route, path, params in requests:
+            started = time.perf_counter()
+            response = client.get(path, query_string=params)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            samples[route].append(elapsed)
+            errors += response.status_code != 200
+    samples['all'] = [elapsed for values in samples.values() for elapsed in values]
+    return samples, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_common_arguments(parser)
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--warm', action='store_true', help='keep the response cache across sessions (default: clear it per session)')
+    args = parser.parse_args()
+
+    csv_path = args.csv or synthetic_csv(args.rows, args.seed)
+    app, startup = load_app(csv_path)
+    rows = len(app.store.current().data)
+    rss_before = rss_mb()
+    print(f"Loaded {rows} rows in {startup:.2f}s, RSS {rss_before:.0f} MiB")
+
+    started = time.perf_counter()
+    samples, errors = replay(app, args.sessions, args.seed, cold=not args.warm)
+    elapsed = time.perf_counter() - started
+    stats = {route: latency_stats(values) for route, values in samples.items()}
+    print_stats_table(stats)
+    rss_after = rss_mb()
+    print(f"{args.sessions} sessions, {len(samples['all'])} requests in {elapsed:.2f}s, {errors} non-200 responses")
+    print(f"RSS {rss_before:.0f} -> {rss_after:.0f} MiB, peak {peak_rss_mb():.0f} MiB, response cache {len(app.response_cache)} entries")
+
+    report = {
+        'rows': rows, 'csv': csv_path, 'sessions': args.sessions, 'warm': args.warm,
+        'startup_s': round(startup, 3), 'errors': errors,
+        'rss_before_mb': round(rss_before, 1), 'rss_after_mb': round(rss_after, 1), 'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stats': stats,
+    }
+    return finish(args, report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
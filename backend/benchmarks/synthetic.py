@@ -0,0 +1,172 @@
+"""Synthetic HarvestStat-Africa data with the real schema and cardinalities.
+
+Rows are generated as yearly series of (admin unit, product, season,
+production system) like the published dataset, for the 33 countries it
+covers at their admin-1 or admin-2 resolution. Generation is vectorized and
+chunked, so 10M-row files take seconds per million rows and bounded memory.
+
+    python -m benchmarks.synthetic --rows 1000000 --out /tmp/hvstat_1m.csv
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    'fnid', 'country', 'country_code', 'admin_1', 'admin_2', 'product', 'season_name',
+    'planting_year', 'planting_month', 'harvest_year', 'harvest_month',
+    'crop_production_system', 'qc_flag', 'area', 'production', 'yield',
+]
+
+# (country, ISO code, finest admin level) as listed in the README
+COUNTRIES = [
+    ('Angola', 'AO', 1), ('Burundi', 'BI', 1), ('Central African Republic', 'CF', 1), ('Chad', 'TD', 1),
+    ('Democratic Republic of Congo', 'CD', 1), ('Ghana', 'GH', 1), ('Kenya', 'KE', 1), ('Lesotho', 'LS', 1),
+    ('Liberia', 'LR', 1), ('Mali', 'ML', 1), ('Mauritania', 'MR', 1), ('Mozambique', 'MZ', 1),
+    ('Nigeria', 'NG', 1), ('South Africa', 'ZA', 1), ('South Sudan', 'SS', 1), ('Sudan', 'SD', 1),
+    ('Tanzania', 'TZ', 1), ('Zimbabwe', 'ZW', 1), ('Benin', 'BJ', 2), ('Burkina Faso', 'BF', 2),
+    ('Cameroon', 'CM', 2), ('Ethiopia', 'ET', 2), ('Guinea', 'GN', 2), ('Madagascar', 'MG', 2),
+    ('Malawi', 'MW', 2), ('Niger', 'NE', 2), ('Rwanda', 'RW', 2), ('Senegal', 'SN', 2),
+    ('Sierra Leone', 'SL', 2), ('Somalia', 'SO', 2), ('Togo', 'TG', 2), ('Uganda', 'UG', 2), ('Zambia', 'ZM', 2),
+]
+
+PRODUCTS = [
+    'Maize', 'Sorghum', 'Millet', 'Rice', 'Wheat', 'Barley', 'Teff', 'Fonio', 'Cassava', 'Sweet Potatoes',
+    'Potato', 'Yams', 'Taro', 'Plantain', 'Beans (mixed)', 'Cowpeas (Mixed)', 'Pigeon Peas', 'Chick Peas',
+    'Groundnuts (In Shell)', 'Bambara groundnut', 'Soybean', 'Sesame Seed', 'Cotton (Seed)', 'Sugarcane',
+    'Tobacco', 'Sunflower Seed', 'Lentils', 'Field Peas',
+]
+SEASONS = ['Main', 'Second', 'Short', 'Long', 'Meher', 'Belg', 'Gu', 'Deyr', 'Annual', 'Off-season']
+PRODUCTION_SYSTEMS = ['none', 'All (PS)', 'rainfed', 'irrigated', 'Plaine/Decrue', 'dieri', 'walo', 'Lowland', 'Upland']
+
+FIRST_YEAR = 1980
+LAST_YEAR = 2023
+# Mean years per series; the published data averages roughly this
+MEAN_SERIES_YEARS = 18
+
+
+def unit_catalogue(rng):
+    """Admin units of every country plus the crop, season and system pools each country draws from."""
+    units = []
+    pools = []
+    for country_id, (country, code, level) in enumerate(COUNTRIES):
+        for a1 in range(int(rng.integers(6, 27))):
+            admin_1 = f"{country} Region {a1 + 1}"
+            if level == 1:
+                units.append((country_id, country, code, admin_1, None, f"{code}2001A1{a1:02d}"))
+                continue
+            for a2 in range(int(rng.integers(3, 13))):
+                units.append((country_id, country, code, admin_1, f"{admin_1} District {a2 + 1}", f"{code}2001A2{a1:02d}{a2:02d}"))
+        pools.append((
+            rng.choice(len(PRODUCTS), size=int(rng.integers(6, 21)), replace=False),
+            rng.choice(len(SEASONS), size=int(rng.integers(1, 4)), replace=False),
+            rng.choice(len(PRODUCTION_SYSTEMS), size=int(rng.integers(1, 4)), replace=False),
+        ))
+    units = pd.DataFrame(units, columns=['country_id', 'country', 'country_code', 'admin_1', 'admin_2', 'fnid'])
+    return units, pools
+
+
+def _pick(rng, pools, country_ids, which):
+    # Vectorized draw from each row's country pool
+    sizes = np.array([len(pool[which]) for pool in pools])
+    padded = np.full((len(pools), sizes.max()), -1)
+    for i, pool in enumerate(pools):
+        padded[i, :sizes[i]] = pool[which]
+    choice = (rng.random(len(country_ids)) * sizes[country_ids]).astype(np.int64)
+    return padded[country_ids, choice]
+
+
+def _with_missing(rng, values, rate):
+    values = values.astype(np.float64)
+    values[rng.random(len(values)) < rate] = np.nan
+    return values
+
+
+def generate_chunk(rng, units, pools, rows):
+    """About `rows` rows (whole series) drawn from the catalogue."""
+    n_series = max(1, rows // MEAN_SERIES_YEARS)
+    unit_ids = rng.integers(len(units), size=n_series)
+    country_ids = units['country_id'].to_numpy()[unit_ids]
+    products = _pick(rng, pools, country_ids, 0)
+    seasons = _pick(rng, pools, country_ids, 1)
+    systems = _pick(rng, pools, country_ids, 2)
+    lengths = rng.integers(3, 2 * MEAN_SERIES_YEARS - 2, size=n_series)
+    starts = FIRST_YEAR + (rng.random(n_series) * (LAST_YEAR - FIRST_YEAR + 2 - lengths)).astype(np.int64)
+
+    series = np.repeat(np.arange(n_series), lengths)
+    offsets = np.arange(len(series)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    # Drop a few years so series have gaps
+    keep = rng.random(len(series)) >= 0.05
+    series, offsets = series[keep], offsets[keep]
+    n = len(series)
+
+    unit_rows = unit_ids[series]
+    harvest_year = starts[series] + offsets
+    planting_month = rng.integers(1, 13, size=n)
+    harvest_month = (planting_month + rng.integers(2, 7, size=n) - 1) % 12 + 1
+    # Cross-year seasons are planted the year before harvest
+    planting_year = np.where(harvest_month < planting_month, harvest_year - 1, harvest_year)
+
+    product_ids = products[series]
+    area = _with_missing(rng, np.round(rng.gamma(1.5, 4000.0, size=n), 2), 0.03)
+    base_yield = 0.5 + (product_ids % 7) * 0.6
+    production = _with_missing(rng, np.round(area * rng.lognormal(np.log(base_yield), 0.35), 3), 0.03)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crop_yield = np.where(area > 0, production / area, np.nan)
+
+    return pd.DataFrame({
+        'fnid': units['fnid'].to_numpy()[unit_rows],
+        'country': units['country'].to_numpy()[unit_rows],
+        'country_code': units['country_code'].to_numpy()[unit_rows],
+        'admin_1': units['admin_1'].to_numpy()[unit_rows],
+        'admin_2': units['admin_2'].to_numpy()[unit_rows],
+        'product': np.array(PRODUCTS, dtype=object)[product_ids],
+        'season_name': np.array(SEASONS, dtype=object)[seasons[series]],
+        'planting_year': _with_missing(rng, planting_year, 0.02),
+        'planting_month': _with_missing(rng, planting_month, 0.05),
+        'harvest_year': harvest_year,
+        'harvest_month': harvest_month,
+        'crop_production_system': np.array(PRODUCTION_SYSTEMS, dtype=object)[systems[series]],
+        'qc_flag': rng.choice([0, 1, 2], size=n, p=[0.96, 0.03, 0.01]),
+        'area': area,
+        'production': production,
+        'yield': crop_yield,
+    }, columns=COLUMNS)
+
+
+def generate_frames(rows, seed=0, chunk_rows=1_000_000):
+    """Yield frames totalling exactly `rows` rows."""
+    rng = np.random.default_rng(seed)
+    units, pools = unit_catalogue(rng)
+    remaining = rows
+    while remaining > 0:
+        frame = generate_chunk(rng, units, pools, min(chunk_rows, remaining) + MEAN_SERIES_YEARS * 2)
+        frame = frame.iloc[:remaining]
+        remaining -= len(frame)
+        yield frame
+
+
+def generate(rows, seed=0):
+    return pd.concat(list(generate_frames(rows, seed)), ignore_index=True)
+
+
+def write_csv(path, rows, seed=0):
+    for i, frame in enumerate(generate_frames(rows, seed)):
+        frame.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True, help='CSV file to write')
+    args = parser.parse_args()
+    started = time.perf_counter()
+    write_csv(args.out, args.rows, args.seed)
+    print(f"Wrote {args.rows} rows to {args.out} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app, make_response, request
+
+from metrics import annotate, mark, phase
+from serialization import negotiate_encoding, precompress
+
+
+class ResponseCache:
+    """Thread-safe LRU of response bodies, bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = entry['size']
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old['size']
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted['size']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def keys(self):
+        """Cached keys, most recently used first."""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def discard(self, predicate):
+        """Drop every entry whose key matches `predicate`."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._bytes -= self._entries.pop(key)['size']
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def normalized_args(args):
+    """Order-independent key for a request's query string."""
+    return tuple(sorted((name, tuple(values)) for name, values in args.lists()))
+
+
+def body_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def cached_route(cache, version, max_age=300, flights=None, compress=precompress, wait_timeout=None):
+    """Serve a GET view from `cache`, with a strong ETag and 304 revalidation.
+
+    Entries are keyed by path, normalized query args and ``version()`` (the
+    dataset fingerprint), so a new dataset never serves stale bodies. Bodies
+    are stored with their encodings from ``compress(body)``, and each request
+    gets the one its Accept-Encoding prefers. Only 200 responses are cached;
+    errors always run the view.
+
+    With a `SingleFlight` as `flights`, concurrent misses on the same key
+    render once and share the entry; followers wait up to `wait_timeout`
+    seconds for it.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.path, normalized_args(request.args), version())
+            with phase('cache'):
+                entry = cache.get(key)
+            annotate('cache', 'miss' if entry is None else 'hit')
+
+            def render():
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                with phase('compress'):
+                    encoded = compress(body)
+                entry = {
+                    'body': body,
+                    'encoded': encoded,
+                    'size': len(body) + sum(len(variant) for variant in encoded.values()),
+                    'mimetype': response.mimetype,
+                    'etag': body_etag(body),
+                }
+                cache.put(key, entry)
+                return entry
+
+            if entry is None:
+                if flights is None:
+                    entry = render()
+                else:
+                    entry, shared = flights.do(key, render, wait_timeout)
+                    if shared:
+                        mark('coalesce')
+                        annotate('cache', 'coalesced')
+                        current_app.logger.info(f"Served {request.full_path} from a concurrent identical request.")
+                        if not isinstance(entry, dict):
+                            # The leader's error response belongs to its request
+                            return view(*args, **kwargs)
+                if not isinstance(entry, dict):
+                    return entry
+            else:
+                current_app.logger.info(f"Serving {request.full_path} from response cache.")
+
+            encoding = negotiate_encoding(request.accept_encodings, entry['encoded'])
+            if encoding is None:
+                response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+                response.set_etag(entry['etag'])
+            else:
+                response = current_app.response_class(entry['encoded'][encoding], mimetype=entry['mimetype'])
+                response.headers['Content-Encoding'] = encoding
+                # Each representation needs its own strong validator
+                response.set_etag(f"{entry['etag']}-{encoding}")
+            response.vary.add('Accept-Encoding')
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
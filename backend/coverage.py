@@ -0,0 +1,124 @@
+import logging
+
+import numpy as np
+
+# Columns a coverage series is keyed by within its country
+COVERAGE_COLUMNS = ['admin_1', 'admin_2', 'product', 'season_name']
+
+# Bit i of a mask is harvest year COVERAGE_BASE_YEAR + i. Masks have a fixed
+# width so any two can be OR-ed together, whatever country they come from.
+COVERAGE_BASE_YEAR = 1950
+COVERAGE_WORDS = 2
+COVERAGE_YEARS = COVERAGE_WORDS * 64
+
+
+def build_country_coverage(country_data):
+    """Year bitmasks of every `COVERAGE_COLUMNS` series of one country.
+
+    A harvest year is covered when the series has a record with production
+    or area for it. Returns ``{'columns', 'keys', 'masks'}`` with the key
+    tuples (missing names as None) in sorted order and one
+    ``COVERAGE_WORDS``-word uint64 mask per key.
+    """
+    columns = [col for col in COVERAGE_COLUMNS if col in country_data.columns]
+    empty = {'columns': columns, 'keys': [], 'masks': np.zeros((0, COVERAGE_WORDS), dtype=np.uint64)}
+    if 'harvest_year' not in country_data.columns or not len(country_data):
+        return empty
+    covered = country_data['harvest_year'].notna().to_numpy()
+    values = [country_data[col].notna().to_numpy() for col in ('production', 'area') if col in country_data.columns]
+    if values:
+        covered = covered & np.logical_or.reduce(values)
+    offsets = country_data['harvest_year'].to_numpy(dtype=np.float64, na_value=np.nan) - COVERAGE_BASE_YEAR
+    in_range = covered & (offsets >= 0) & (offsets < COVERAGE_YEARS)
+    if (covered & ~in_range).any():
+        logging.warning(f"Coverage ignores {int((covered & ~in_range).sum())} records with harvest years outside "
+                        f"{COVERAGE_BASE_YEAR}-{COVERAGE_BASE_YEAR + COVERAGE_YEARS - 1}.")
+    if not in_range.any():
+        return empty
+
+    rows = country_data.loc[in_range, columns]
+    grouped = rows.groupby(columns, sort=True, observed=True, dropna=False) if columns else None
+    group_ids = grouped.ngroup().to_numpy() if columns else np.zeros(len(rows), dtype=np.int64)
+    keys = [tuple(None if value != value else value for value in (key if isinstance(key, tuple) else (key,)))
+            for key in grouped.size().index] if columns else [()]
+    offsets = offsets[in_range].astype(np.int64)
+    masks = np.zeros((len(keys), COVERAGE_WORDS), dtype=np.uint64)
+    np.bitwise_or.at(masks, (group_ids, offsets >> 6), np.left_shift(np.uint64(1), (offsets & 63).astype(np.uint64)))
+    return {'columns': columns, 'keys': keys, 'masks': masks}
+
+
+def group_coverage(coverage, group_by, product=None):
+    """OR the masks of `coverage` together per `group_by` columns (a subset of its columns).
+
+    Keeps only `product`'s series when given. Returns ``(keys, masks)``
+    with keys sorted (missing names last).
+    """
+    if list(group_by) == coverage['columns'] and product is None:
+        # Already one mask per key, in order
+        return coverage['keys'], coverage['masks']
+    positions = [coverage['columns'].index(col) for col in group_by]
+    product_position = coverage['columns'].index('product') if product is not None and 'product' in coverage['columns'] else None
+    group_ids = {}
+    ids = []
+    rows = []
+    for row, key in enumerate(coverage['keys']):
+        if product_position is not None and key[product_position] != product:
+            continue
+        rows.append(row)
+        ids.append(group_ids.setdefault(tuple(key[i] for i in positions), len(group_ids)))
+    masks = np.zeros((len(group_ids), COVERAGE_WORDS), dtype=np.uint64)
+    if rows:
+        np.bitwise_or.at(masks, np.asarray(ids), coverage['masks'][rows])
+    keys = list(group_ids)
+    order = sorted(range(len(keys)), key=lambda i: [(value is None, str(value)) for value in keys[i]])
+    return [keys[i] for i in order], masks[order]
+
+
+def coverage_bits(masks):
+    """Masks as a boolean (series x COVERAGE_YEARS) matrix; column i is year COVERAGE_BASE_YEAR + i."""
+    as_bytes = np.ascontiguousarray(masks.astype('<u8')).view(np.uint8).reshape(len(masks), COVERAGE_WORDS * 8)
+    return np.unpackbits(as_bytes, axis=1, bitorder='little').astype(bool)
+
+
+def emit_coverage(groups, group_by):
+    """Coverage matrices and gap lists of several countries on one shared year axis.
+
+    `groups` maps each country to its ``(keys, masks)`` from
+    `group_coverage`. Returns the response's ``years`` and per-country
+    ``rows`` (key values, covered years count, first/last year and the
+    missing years between them) with a 0/1 ``matrix`` aligned to ``years``.
+    """
+    union = np.zeros(COVERAGE_WORDS, dtype=np.uint64)
+    for _, masks in groups.values():
+        if len(masks):
+            union |= np.bitwise_or.reduce(masks, axis=0)
+    covered_years = np.flatnonzero(coverage_bits(union[None, :])[0])
+    if not len(covered_years):
+        return {'years': [], 'countries': {country: {'rows': [], 'matrix': []} for country in groups}}
+    first, last = int(covered_years[0]), int(covered_years[-1]) + 1
+
+    countries = {}
+    for country, (keys, masks) in groups.items():
+        bits = coverage_bits(masks)
+        counts = bits.sum(axis=1)
+        has_years = counts > 0
+        first_bits = np.where(has_years, bits.argmax(axis=1), 0)
+        last_bits = np.where(has_years, COVERAGE_YEARS - 1 - bits[:, ::-1].argmax(axis=1), -1)
+        positions = np.arange(COVERAGE_YEARS)
+        gaps = ~bits & (positions >= first_bits[:, None]) & (positions <= last_bits[:, None])
+        # Each row's gap years are a slice of one flat list
+        gap_rows, gap_bits = np.nonzero(gaps)
+        gap_years = (gap_bits + COVERAGE_BASE_YEAR).tolist()
+        offsets = np.searchsorted(gap_rows, np.arange(len(keys) + 1)).tolist()
+        rows = []
+        for row, (key, count, first_bit, last_bit, has) in enumerate(zip(keys, counts.tolist(), first_bits.tolist(),
+                                                                        last_bits.tolist(), has_years.tolist())):
+            rows.append({
+                **dict(zip(group_by, key)),
+                'years_count': count,
+                'first_year': COVERAGE_BASE_YEAR + first_bit if has else None,
+                'last_year': COVERAGE_BASE_YEAR + last_bit if has else None,
+                'missing_years': gap_years[offsets[row]:offsets[row + 1]],
+            })
+        countries[country] = {'rows': rows, 'matrix': bits[:, first:last].astype(np.uint8)}
+    return {'years': list(range(COVERAGE_BASE_YEAR + first, COVERAGE_BASE_YEAR + last)), 'countries': countries}
@@ -0,0 +1,654 @@
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no cross-process snapshot lock on Windows
+    fcntl = None
+
+NUMERIC_COLUMNS = ['planting_year', 'harvest_year', 'area', 'production', 'yield']
+
+# Load-time schema. String dimensions become categoricals (small integer
+# codes plus one copy of each distinct value) and years, months and flags
+# nullable small integers. The measures stay float64: area and production
+# are summed into reported totals and all three are exported verbatim, so
+# float32 would change published numbers.
+CATEGORY_COLUMNS = ['fnid', 'country', 'country_code', 'admin_1', 'admin_2', 'product', 'season_name', 'crop_production_system']
+COMPACT_DTYPES = {
+    'planting_year': 'Int16',
+    'harvest_year': 'Int16',
+    'planting_month': 'Int8',
+    'harvest_month': 'Int8',
+    'qc_flag': 'Int8',
+}
+
+# Declared CSV schema: columns a dataset must have to be served, and the
+# numeric ones, whose cells are reported as invalid when they do not parse
+REQUIRED_COLUMNS = ['country', 'admin_1', 'product', 'harvest_year', 'area', 'production']
+NUMERIC_SCHEMA = NUMERIC_COLUMNS + [col for col in COMPACT_DTYPES if col not in NUMERIC_COLUMNS]
+
+# Columns identifying one record: a crop's season and production system in
+# one admin unit and harvest year
+RECORD_KEY = ['country', 'admin_1', 'admin_2', 'product', 'season_name', 'crop_production_system', 'harvest_year']
+
+# A dataset is refused when more than this share of a numeric column's
+# non-empty cells do not parse
+MAX_INVALID_FRACTION = 0.05
+
+# Files at least this large are parsed in chunks across processes
+PARALLEL_MIN_BYTES = 32 * 2 ** 20
+CHUNK_MIN_BYTES = 8 * 2 ** 20
+
+# Invalid values quoted per column in the load report
+REPORT_EXAMPLES = 5
+
+# Key hierarchies the API filters on. Every level starts with the country so
+# the country-sorted frame gives each lookup a bounded search space.
+INDEX_LEVELS = [
+    ('country',),
+    ('country', 'admin_1'),
+    ('country', 'admin_1', 'admin_2'),
+    ('country', 'product'),
+    ('country', 'admin_1', 'product'),
+    ('country', 'admin_1', 'admin_2', 'product'),
+]
+
+# Bump whenever the on-disk layout or the load-time schema changes so stale
+# snapshots are rebuilt instead of being memory-mapped with the wrong meaning.
+SNAPSHOT_FORMAT_VERSION = 3
+
+# Nullable arrays, stored in snapshots as their values plus a missing-value mask
+MASKED_ARRAYS = (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.snapshots')
+
+
+def compact_dtypes(data):
+    """Convert `data` to the load-time schema (see `COMPACT_DTYPES`).
+
+    A column whose values do not fit its compact type (fractional years,
+    out-of-range flags) keeps the type it was parsed with.
+    """
+    for col in data.columns:
+        if col in CATEGORY_COLUMNS or (col not in COMPACT_DTYPES and not pd.api.types.is_numeric_dtype(data[col])):
+            data[col] = data[col].astype('category')
+            continue
+        dtype = COMPACT_DTYPES.get(col)
+        if dtype is None:
+            continue
+        try:
+            data[col] = pd.to_numeric(data[col], errors='coerce').astype(dtype)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Keeping column {col} as {data[col].dtype}: {e}")
+    return data
+
+
+class DatasetValidationError(ValueError):
+    """The CSV does not meet the declared schema; `report` says where."""
+
+    def __init__(self, report):
+        super().__init__('; '.join(report['errors']))
+        self.report = report
+
+
+def _coerce_numeric(frame):
+    """Coerce the numeric schema columns of `frame` in place and describe every column.
+
+    Cells that are present but do not parse become NaN and are counted as
+    invalid, with the first few quoted by their position in `frame`.
+    """
+    columns = {}
+    for col in frame.columns:
+        entry = {'missing': int(frame[col].isna().sum()), 'invalid': 0, 'examples': []}
+        if col in NUMERIC_SCHEMA and not pd.api.types.is_numeric_dtype(frame[col]):
+            values = pd.to_numeric(frame[col], errors='coerce')
+            invalid = values.isna() & frame[col].notna()
+            positions = np.flatnonzero(invalid.to_numpy())
+            entry['invalid'] = len(positions)
+            entry['missing'] = int(values.isna().sum()) - len(positions)
+            entry['examples'] = [{'row': int(i), 'value': str(frame[col].iat[i])} for i in positions[:REPORT_EXAMPLES]]
+            frame[col] = values
+        columns[col] = entry
+    return columns
+
+
+def _parse_chunk(csv_path, start, stop, names, drop_columns):
+    """Parse bytes [start, stop) of the CSV (whole lines, no header) into the load-time schema."""
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        raw = f.read(stop - start)
+    frame = pd.read_csv(
+        io.BytesIO(raw), header=None, names=names, usecols=lambda col: col not in drop_columns,
+        dtype={col: object for col in CATEGORY_COLUMNS if col in names},
+        low_memory=False,
+    )
+    columns = _coerce_numeric(frame)
+    return compact_dtypes(frame), columns
+
+
+def _record_end(mm, position, quotes):
+    """End of the record around `position` (just past the first line break outside quotes) and the quotes before it.
+
+    `quotes` counts the double quotes before `position`. Quoted fields may
+    hold line breaks; an even count (escaped quotes are doubled) means a
+    line break is outside any field.
+    """
+    while True:
+        end = mm.find(b'\n', position)
+        end = len(mm) if end < 0 else end + 1
+        quotes += mm[position:end].count(b'"')
+        if quotes % 2 == 0 or end >= len(mm):
+            return end, quotes
+        position = end
+
+
+def _chunk_ranges(csv_path, size, chunks):
+    """Byte ranges of about ``size / chunks`` bytes, split between records, past the header."""
+    with open(csv_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position, quotes = _record_end(mm, 0, 0)
+        bounds = [position]
+        for i in range(1, chunks):
+            target = max(position, size * i // chunks)
+            # Count the quotes up to the target so the scan starts knowing whether it is inside a field
+            quotes += mm[position:target].count(b'"')
+            position, quotes = _record_end(mm, target, quotes)
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _merge_chunks(parts):
+    """Concatenate chunk frames, unifying each categorical's categories (sorted)."""
+    frames = [frame for frame, _ in parts]
+    if len(frames) == 1:
+        return frames[0]
+    columns = {}
+    for col in frames[0].columns:
+        pieces = [frame[col] for frame in frames]
+        if all(isinstance(piece.dtype, pd.CategoricalDtype) for piece in pieces):
+            columns[col] = pd.Series(pd.api.types.union_categoricals(pieces, sort_categories=True))
+        else:
+            columns[col] = pd.concat(pieces, ignore_index=True)
+    # A chunk whose values did not fit a compact type leaves its column wider
+    return compact_dtypes(pd.DataFrame(columns))
+
+
+def _merge_reports(parts, row_offsets):
+    columns = {}
+    for (_, chunk_columns), offset in zip(parts, row_offsets):
+        for col, entry in chunk_columns.items():
+            merged = columns.setdefault(col, {'missing': 0, 'invalid': 0, 'examples': []})
+            merged['missing'] += entry['missing']
+            merged['invalid'] += entry['invalid']
+            for example in entry['examples']:
+                if len(merged['examples']) < REPORT_EXAMPLES:
+                    # Line 1 is the header
+                    merged['examples'].append({'line': example['row'] + offset + 2, 'value': example['value']})
+    return columns
+
+
+def validate_dataset(data, report, max_invalid_fraction=MAX_INVALID_FRACTION):
+    """Add duplicate key counts and the reasons to refuse `data` to `report`."""
+    errors = []
+    missing = [col for col in REQUIRED_COLUMNS if col not in data.columns]
+    if missing:
+        errors.append(f"Missing required columns: {', '.join(missing)}")
+    if not len(data):
+        errors.append("The file has no data rows")
+    for col, entry in report['columns'].items():
+        present = len(data) - entry['missing']
+        if entry['invalid'] and entry['invalid'] > max_invalid_fraction * present:
+            errors.append(f"{entry['invalid']} of {present} {col} values are not numbers")
+    key = [col for col in RECORD_KEY if col in data.columns]
+    report['duplicate_keys'] = int(data.duplicated(subset=key).sum()) if key and len(data) else 0
+    report['errors'] = errors
+    return report
+
+
+def read_csv_dataset(csv_path, drop_columns=(), processes=None, max_invalid_fraction=MAX_INVALID_FRACTION):
+    """Parse the HarvestStat CSV into the compact load-time schema.
+
+    Files of at least `PARALLEL_MIN_BYTES` are split between records and the
+    pieces parsed by `processes` worker processes (default: one per core).
+    Returns ``(data, report)``. The report counts rows, missing and
+    invalid (unparseable numeric) cells per column and duplicated record
+    keys. Raises `DatasetValidationError` with the report when the file
+    lacks required columns or has too many invalid values.
+    """
+    started = time.perf_counter()
+    size = os.path.getsize(csv_path)
+    processes = processes or os.cpu_count() or 1
+    names = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    chunks = min(processes * 2, max(1, size // CHUNK_MIN_BYTES))
+    if size < PARALLEL_MIN_BYTES or processes == 1 or chunks == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        ranges = [(None, None)]
+        frame = pd.read_csv(csv_path, usecols=lambda col: col not in drop_columns,
+                            dtype={col: object for col in CATEGORY_COLUMNS if col in names}, low_memory=False)
+        columns = _coerce_numeric(frame)
+        parts = [(compact_dtypes(frame), columns)]
+    else:
+        ranges = _chunk_ranges(csv_path, size, chunks)
+        # Forked workers need nothing but this module, whatever the main script is
+        with ProcessPoolExecutor(min(processes, len(ranges)), mp_context=multiprocessing.get_context('fork')) as pool:
+            parts = list(pool.map(_parse_chunk, *zip(*[(csv_path, start, stop, names, drop_columns) for start, stop in ranges])))
+
+    row_offsets = np.cumsum([0] + [len(frame) for frame, _ in parts[:-1]]).tolist()
+    data = _merge_chunks(parts)
+    report = {
+        'rows': len(data),
+        'chunks': len(ranges),
+        'columns': _merge_reports(parts, row_offsets),
+    }
+    validate_dataset(data, report, max_invalid_fraction)
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    if report['errors']:
+        raise DatasetValidationError(report)
+    invalid = {col: entry['invalid'] for col, entry in report['columns'].items() if entry['invalid']}
+    logging.info(f"Parsed {csv_path}: {len(data)} rows in {len(ranges)} chunk(s), {report['seconds']}s, "
+                 f"{report['duplicate_keys']} duplicate record keys.")
+    if invalid:
+        logging.warning(f"Invalid values coerced to missing in {csv_path}: "
+                        + ', '.join(f"{col} {count}" for col, count in invalid.items()))
+
+    # Group each country's rows together while keeping file order inside a
+    # country, so per-country results are the same as filtering the raw file.
+    if 'country' in data.columns:
+        data = data.sort_values('country', kind='stable', na_position='last').reset_index(drop=True)
+    return data, report
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(snapshot_dir, csv_path):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(snapshot_dir, f"{stem}.manifest.json")
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path, payload):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(data, snapshot_path):
+    """Write `data` as .npy files per column plus a JSON schema.
+
+    NumPy columns are stored as-is, nullable integers as values plus a
+    mask, and categoricals (or any other strings) as codes next to their
+    categories, so every column can be memory-mapped. The directory is built
+    under a temporary name and renamed into place, so concurrent workers
+    never observe a half-written snapshot.
+    """
+    parent = os.path.dirname(snapshot_path)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.building-')
+    try:
+        columns = []
+        for i, col in enumerate(data.columns):
+            series = data[col]
+            entry = {'name': col, 'file': f"c{i}.npy", 'dtype': str(series.dtype)}
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                np.save(os.path.join(tmp_path, entry['file']), series.cat.codes.to_numpy())
+                entry['kind'] = 'categorical'
+                entry['categories'] = [str(v) for v in series.cat.categories]
+            elif isinstance(series.array, MASKED_ARRAYS):
+                entry['mask_file'] = f"c{i}.mask.npy"
+                np.save(os.path.join(tmp_path, entry['file']), series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0))
+                np.save(os.path.join(tmp_path, entry['mask_file']), series.isna().to_numpy())
+                entry['kind'] = 'masked'
+            elif series.dtype.kind in 'biuf':
+                np.save(os.path.join(tmp_path, entry['file']), series.to_numpy())
+                entry['kind'] = 'numeric'
+            else:
+                categorical = series.astype('category')
+                np.save(os.path.join(tmp_path, entry['file']), categorical.cat.codes.to_numpy())
+                entry['kind'] = 'categorical'
+                entry['categories'] = [str(v) for v in categorical.cat.categories]
+            columns.append(entry)
+        with open(os.path.join(tmp_path, 'schema.json'), 'w') as f:
+            json.dump({'format_version': SNAPSHOT_FORMAT_VERSION, 'rows': len(data), 'columns': columns}, f)
+        if os.path.isdir(snapshot_path):
+            shutil.rmtree(snapshot_path)
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def read_snapshot(snapshot_path, drop_columns=()):
+    """Memory-map a snapshot written by `write_snapshot` back into a DataFrame.
+
+    Every column is a read-only view of the mapped files, so processes that
+    map the same snapshot share its pages. Dropped columns are never mapped,
+    so they cost no memory.
+    """
+    with open(os.path.join(snapshot_path, 'schema.json')) as f:
+        schema = json.load(f)
+    if schema.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format: {schema.get('format_version')}")
+
+    columns = {}
+    for entry in schema['columns']:
+        if entry['name'] in drop_columns:
+            continue
+        values = np.load(os.path.join(snapshot_path, entry['file']), mmap_mode='r')
+        if entry['kind'] == 'categorical':
+            dtype = pd.CategoricalDtype(entry['categories'])
+            # Codes come from our own writer; validating them would copy the mapped array
+            columns[entry['name']] = pd.Series(pd.Categorical.from_codes(values, dtype=dtype, validate=False), copy=False)
+        elif entry['kind'] == 'masked':
+            mask = np.load(os.path.join(snapshot_path, entry['mask_file']), mmap_mode='r')
+            array_type = pd.api.types.pandas_dtype(entry['dtype']).construct_array_type()
+            columns[entry['name']] = pd.Series(array_type(values, mask), copy=False)
+        else:
+            columns[entry['name']] = pd.Series(values, copy=False)
+    return pd.DataFrame(columns, copy=False)
+
+
+def memory_footprint(data):
+    """Bytes held by each column of `data` (strings counted in full), largest first."""
+    return data.memory_usage(index=False, deep=True).sort_values(ascending=False)
+
+
+def log_footprint(data):
+    usage = memory_footprint(data)
+    total = int(usage.sum())
+    per_row = total / len(data) if len(data) else 0
+    columns = ', '.join(f"{col} ({data[col].dtype}) {size / 2 ** 20:.2f}" for col, size in usage.items())
+    logging.info(f"Dataset footprint: {total / 2 ** 20:.1f} MiB for {len(data)} rows ({per_row:.0f} B/row). MiB per column: {columns}")
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """Hold an exclusive cross-process lock on `lock_path`.
+
+    Without ``fcntl`` or a writable directory this does not lock.
+    """
+    handle = None
+    if fcntl is not None:
+        try:
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            handle = open(lock_path, 'a')
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        except OSError as e:
+            logging.warning(f"Continuing without a lock on {lock_path}: {e}")
+            if handle is not None:
+                handle.close()
+                handle = None
+    try:
+        yield
+    finally:
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+
+def _snapshot_lock(snapshot_dir, csv_path):
+    """Lock building `csv_path`'s snapshot.
+
+    Serializes the parse-and-write step across processes, so when several
+    workers start (or reload) at once only one parses the CSV and the others
+    map what it published.
+    """
+    return file_lock(_manifest_path(snapshot_dir, csv_path) + '.lock')
+
+
+def _read_fresh_snapshot(csv_path, snapshot_dir, stat, drop_columns):
+    """Map the snapshot of `csv_path` if the manifest says it is current.
+
+    Returns ``(data, sha256, report)``; ``data`` is None when there is no
+    usable snapshot, and ``sha256`` is None unless the CSV had to be hashed.
+    ``report`` is the load report of the parse the snapshot was written from.
+    """
+    manifest_path = _manifest_path(snapshot_dir, csv_path)
+    manifest = _read_manifest(manifest_path)
+    if not (manifest and manifest.get('format_version') == SNAPSHOT_FORMAT_VERSION and manifest.get('size') == stat.st_size):
+        return None, None, None
+
+    sha256 = None
+    snapshot_path = os.path.join(snapshot_dir, manifest['snapshot'])
+    fresh = manifest.get('mtime_ns') == stat.st_mtime_ns
+    if not fresh:
+        sha256 = file_sha256(csv_path)
+        fresh = manifest.get('sha256') == sha256
+    if fresh and os.path.isdir(snapshot_path):
+        try:
+            data = read_snapshot(snapshot_path, drop_columns)
+            if manifest.get('mtime_ns') != stat.st_mtime_ns:
+                _write_json_atomic(manifest_path, {**manifest, 'mtime_ns': stat.st_mtime_ns})
+            logging.info(f"Loaded dataset snapshot {snapshot_path} ({len(data)} rows).")
+            return data, manifest['sha256'], manifest.get('report')
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable snapshot {snapshot_path}: {e}")
+    return None, sha256, None
+
+
+def load_dataset(csv_path, snapshot_dir=DEFAULT_SNAPSHOT_DIR, drop_columns=(), processes=None,
+                 max_invalid_fraction=MAX_INVALID_FRACTION):
+    """Load the dataset, reusing a columnar snapshot when the CSV is unchanged.
+
+    Snapshots are keyed by the CSV's size, mtime and SHA-256. The size/mtime
+    pair is the fast path; when only the mtime moved (a re-copy or a touch)
+    the hash decides whether the existing snapshot is still valid. Pass
+    ``snapshot_dir=None`` to always parse the CSV. Snapshots keep every
+    column; `drop_columns` are left out of the returned frame.
+
+    A freshly written snapshot is mapped back in place of the parsed frame,
+    so the data always lives in the shared page cache rather than in this
+    process's heap.
+
+    The CSV is parsed by `read_csv_dataset` (see there for `processes` and
+    `max_invalid_fraction`); a file it refuses raises
+    `DatasetValidationError` and never gets a snapshot.
+
+    Returns ``(data, version, report)`` where ``version`` is the CSV's
+    SHA-256 and ``report`` the load report of its parse.
+    """
+    stat = os.stat(csv_path)
+    if not snapshot_dir:
+        data, report = read_csv_dataset(csv_path, drop_columns, processes, max_invalid_fraction)
+        return data, file_sha256(csv_path), report
+
+    data, sha256, report = _read_fresh_snapshot(csv_path, snapshot_dir, stat, drop_columns)
+    if data is not None:
+        return data, sha256, report
+
+    with _snapshot_lock(snapshot_dir, csv_path):
+        # Another process may have published the snapshot while we waited
+        data, locked_sha256, report = _read_fresh_snapshot(csv_path, snapshot_dir, stat, drop_columns)
+        if data is not None:
+            return data, locked_sha256, report
+        sha256 = sha256 or locked_sha256
+
+        manifest_path = _manifest_path(snapshot_dir, csv_path)
+        manifest = _read_manifest(manifest_path)
+        data, report = read_csv_dataset(csv_path, processes=processes, max_invalid_fraction=max_invalid_fraction)
+        if sha256 is None:
+            sha256 = file_sha256(csv_path)
+        snapshot_name = f"{os.path.splitext(os.path.basename(csv_path))[0]}-{sha256[:16]}"
+        snapshot_path = os.path.join(snapshot_dir, snapshot_name)
+        try:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            write_snapshot(data, snapshot_path)
+            _write_json_atomic(manifest_path, {
+                'format_version': SNAPSHOT_FORMAT_VERSION,
+                'csv': os.path.abspath(csv_path),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': sha256,
+                'snapshot': snapshot_name,
+                'report': report,
+            })
+            logging.info(f"Wrote dataset snapshot {snapshot_name} for {csv_path}.")
+            if manifest and manifest.get('snapshot') not in (None, snapshot_name):
+                shutil.rmtree(os.path.join(snapshot_dir, manifest['snapshot']), ignore_errors=True)
+            return read_snapshot(snapshot_path, drop_columns), sha256, report
+        except OSError as e:
+            # A read-only deployment can still serve from the parsed CSV.
+            logging.warning(f"Could not write dataset snapshot to {snapshot_dir}: {e}")
+    return data.drop(columns=[col for col in drop_columns if col in data.columns]), sha256, report
+
+
+def build_index(data):
+    """Map every key in `INDEX_LEVELS` to the rows it selects.
+
+    `data` must be sorted by country (as `read_csv_dataset` leaves it), so a
+    country maps to a contiguous ``slice``. Deeper keys map to ascending row
+    positions, which keeps rows in file order and therefore keeps the
+    summation order of every aggregate unchanged. ``children`` lists the
+    sorted admin_1 names of each country and admin_2 names of each admin_1.
+    """
+    index = {'rows': {}, 'children': {}}
+    if data.empty or 'country' not in data.columns:
+        return index
+
+    for level in INDEX_LEVELS:
+        if not all(col in data.columns for col in level):
+            continue
+        groups = data.groupby(list(level), sort=False, observed=True).indices
+        level_rows = {}
+        for key, positions in groups.items():
+            key = key if isinstance(key, tuple) else (key,)
+            if level == ('country',):
+                level_rows[key] = slice(int(positions[0]), int(positions[-1]) + 1)
+            else:
+                level_rows[key] = positions
+        index['rows'][level] = level_rows
+
+    for level in [('country', 'admin_1'), ('country', 'admin_1', 'admin_2')]:
+        for key in index['rows'].get(level, {}):
+            index['children'].setdefault(key[:-1], []).append(key[-1])
+    for names in index['children'].values():
+        names.sort()
+    return index
+
+
+def country_bounds(data):
+    """Map each country of country-sorted `data` to its ``slice`` of rows."""
+    if data.empty or 'country' not in data.columns:
+        return {}
+    groups = data.groupby('country', sort=False, observed=True).indices
+    return {country: slice(int(rows[0]), int(rows[-1]) + 1) for country, rows in groups.items()}
+
+
+def update_index(index, data, countries):
+    """The index of `data` given `index` of a version differing only in `countries`.
+
+    Only the changed countries are regrouped. Every other country's entries
+    are carried over, shifted to where its rows now start.
+    """
+    bounds = country_bounds(data)
+    old_countries = index['rows'].get(('country',), {})
+    countries = set(countries)
+    shifts = {}
+    for country, rows in bounds.items():
+        old = old_countries.get((country,))
+        if country not in countries and old is not None:
+            shifts[country] = rows.start - old.start
+
+    new_index = {'rows': {}, 'children': {}}
+    for level, level_rows in index['rows'].items():
+        new_rows = {}
+        for key, rows in level_rows.items():
+            shift = shifts.get(key[0])
+            if shift is None:
+                continue
+            if isinstance(rows, slice):
+                new_rows[key] = slice(rows.start + shift, rows.stop + shift)
+            else:
+                new_rows[key] = rows + shift if shift else rows
+        new_index['rows'][level] = new_rows
+    for key, names in index['children'].items():
+        if key[0] in shifts:
+            new_index['children'][key] = names
+
+    for country in countries:
+        rows = bounds.get(country)
+        if rows is None:
+            continue
+        partial = build_index(data.iloc[rows])
+        for level, level_rows in partial['rows'].items():
+            target = new_index['rows'].setdefault(level, {})
+            for key, positions in level_rows.items():
+                if isinstance(positions, slice):
+                    target[key] = slice(positions.start + rows.start, positions.stop + rows.start)
+                else:
+                    target[key] = positions + rows.start
+        new_index['children'].update(partial['children'])
+    return new_index
+
+
+def _lookup(index, country, admin_1=None, admin_2=None, product=None):
+    level = ['country']
+    key = [country]
+    if admin_1 is not None:
+        level.append('admin_1')
+        key.append(admin_1)
+        if admin_2 is not None:
+            level.append('admin_2')
+            key.append(admin_2)
+    if product is not None:
+        level.append('product')
+        key.append(product)
+    return index['rows'].get(tuple(level), {}).get(tuple(key))
+
+
+def has_rows(index, country, admin_1=None, admin_2=None, product=None):
+    return _lookup(index, country, admin_1, admin_2, product) is not None
+
+
+def row_positions(index, country, admin_1=None, admin_2=None, product=None):
+    """The rows matching the given keys (a slice or ascending positions), or None."""
+    return _lookup(index, country, admin_1, admin_2, product)
+
+
+def select_rows(data, index, country, admin_1=None, admin_2=None, product=None):
+    """Return the rows matching the given keys without scanning the table.
+
+    Country-only lookups return a view; deeper lookups gather just the
+    matching rows. Unknown keys give an empty frame.
+    """
+    rows = _lookup(index, country, admin_1, admin_2, product)
+    if rows is None:
+        return data.iloc[0:0]
+    return data.iloc[rows]
+
+
+def child_names(index, country, admin_1=None):
+    """Sorted admin_1 names of a country, or admin_2 names of an admin_1."""
+    key = (country,) if admin_1 is None else (country, admin_1)
+    return index['children'].get(key, [])
+
+
+def country_names(index):
+    return sorted(key[0] for key in index['rows'].get(('country',), {}))
@@ -0,0 +1,129 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - Arrow export is optional
+    pa = None
+
+from aggregation import ALL_ROWS, row_filter_mask
+from dataset import row_positions
+from serialization import dumps_lines
+
+# Rows serialized per streamed chunk; bounds server memory whatever the export size
+EXPORT_CHUNK_ROWS = 50_000
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+EXPORT_EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'arrow': 'arrows'}
+
+
+def export_formats():
+    """Formats this server can stream (Arrow needs pyarrow)."""
+    return ['csv', 'ndjson', 'arrow'] if pa is not None else ['csv', 'ndjson']
+
+
+def _country_rows(index, country, admin_1, admin_2, products):
+    if not products:
+        return row_positions(index, country, admin_1, admin_2)
+    parts = [row_positions(index, country, admin_1, admin_2, product) for product in products]
+    parts = [rows for rows in parts if rows is not None]
+    if not parts:
+        return None
+    # Merge back into file order
+    return np.sort(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+
+
+def _chunk_bounds(rows, chunk_rows):
+    if isinstance(rows, slice):
+        for start in range(rows.start, rows.stop, chunk_rows):
+            yield slice(start, min(start + chunk_rows, rows.stop))
+    else:
+        for start in range(0, len(rows), chunk_rows):
+            yield rows[start:start + chunk_rows]
+
+
+def export_chunks(data, index, countries, admin_1=None, admin_2=None, products=None, row_filters=ALL_ROWS,
+                  chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield the matching rows as frames of at most `chunk_rows` rows.
+
+    Countries come out in the given order and each country's rows in file
+    order. Keys are resolved through the row index; `row_filters` (harvest
+    years, seasons, production systems) are applied to one chunk at a time.
+    """
+    for country in countries:
+        rows = _country_rows(index, country, admin_1, admin_2, products)
+        if rows is None:
+            continue
+        for bounds in _chunk_bounds(rows, chunk_rows):
+            chunk = data.iloc[bounds]
+            if row_filters != ALL_ROWS:
+                mask = row_filter_mask(chunk, row_filters)
+                if not mask.all():
+                    chunk = chunk[mask]
+            if len(chunk):
+                yield chunk
+
+
+def stream_csv(chunks, columns):
+    yield pd.DataFrame(columns=columns).to_csv(index=False)
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False)
+
+
+def _chunk_records(chunk):
+    # Python values with None for every kind of missing value; floats keep full precision
+    columns = [values.where(values.notna(), None).tolist() for values in (chunk[col].astype(object) for col in chunk.columns)]
+    names = list(chunk.columns)
+    return (dict(zip(names, row)) for row in zip(*columns))
+
+
+def stream_ndjson(chunks):
+    for chunk in chunks:
+        yield dumps_lines(_chunk_records(chunk))
+
+
+def arrow_schema(data):
+    # Declared up front so every batch (and an empty export) has the same types
+    fields = []
+    for col, dtype in data.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) or not pd.api.types.is_numeric_dtype(dtype):
+            fields.append(pa.field(col, pa.string()))
+        else:
+            # Nullable integers map to their NumPy type; Arrow keeps the nulls
+            fields.append(pa.field(col, pa.from_numpy_dtype(getattr(dtype, 'numpy_dtype', dtype))))
+    return pa.schema(fields)
+
+
+def stream_arrow(chunks, data):
+    """Arrow IPC stream with one record batch per chunk."""
+    schema = arrow_schema(data)
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain():
+        payload = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return payload
+
+    for chunk in chunks:
+        writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+def stream_export(fmt, chunks, data):
+    if fmt == 'csv':
+        return stream_csv(chunks, list(data.columns))
+    if fmt == 'ndjson':
+        return stream_ndjson(chunks)
+    if fmt == 'arrow':
+        return stream_arrow(chunks, data)
+    raise ValueError(f"Unsupported export format: {fmt}")
@@ -0,0 +1,263 @@
+"""Incremental ingestion of added or corrected records.
+
+A delta is a CSV with the dataset's columns. Each delta row replaces the
+dataset rows with the same `RECORD_KEY` or, if there are none, is added to
+its country. Deltas are validated, applied to the live snapshot (only the
+affected countries' index entries and rollups are rebuilt) and journaled
+next to the dataset snapshot, so restarts and other server workers replay
+them on top of the same CSV.
+
+Journal a delta for the running server(s) to pick up and for future starts:
+
+    python ingest.py new_season.csv
+
+or post it to a running server with ``POST /api/admin/ingest``.
+"""
+import argparse
+import hashlib
+import io
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import COMPACT_DTYPES, DEFAULT_SNAPSHOT_DIR, NUMERIC_COLUMNS, RECORD_KEY, compact_dtypes, file_lock
+
+REQUIRED_VALUES = ['country', 'product', 'harvest_year']
+NON_NEGATIVE_COLUMNS = ['area', 'production', 'yield']
+VALUE_RANGES = {'planting_month': (1, 12), 'harvest_month': (1, 12), 'qc_flag': (0, 2)}
+
+# Rows listed per problem in a validation error
+MAX_REPORTED_ROWS = 10
+
+
+class DeltaError(ValueError):
+    """A delta file failed validation; `errors` lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def _rows(mask):
+    # 1-based data lines as in a spreadsheet, after the header line
+    lines = (np.flatnonzero(mask) + 2).tolist()
+    listed = ', '.join(str(line) for line in lines[:MAX_REPORTED_ROWS])
+    return listed + (f" and {len(lines) - MAX_REPORTED_ROWS} more" if len(lines) > MAX_REPORTED_ROWS else '')
+
+
+def read_delta(source, columns, drop_columns=()):
+    """Parse and validate a delta CSV (a path, bytes or file object) against `columns`.
+
+    Returns the delta in the load-time schema with exactly `columns`;
+    columns the delta leaves out are missing values and `drop_columns` are
+    ignored. Raises `DeltaError` listing every problem.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        delta = pd.read_csv(source, usecols=lambda col: col not in drop_columns)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise DeltaError([f"Unreadable CSV: {e}"]) from None
+
+    errors = []
+    unknown = [col for col in delta.columns if col not in columns]
+    if unknown:
+        errors.append(f"Unknown columns: {', '.join(map(str, unknown))}")
+    missing_keys = [col for col in RECORD_KEY if col in columns and col not in delta.columns]
+    if missing_keys:
+        errors.append(f"Missing key columns: {', '.join(missing_keys)}")
+    if errors:
+        raise DeltaError(errors)
+    if delta.empty:
+        raise DeltaError(["The delta has no rows"])
+
+    delta = delta.reindex(columns=columns)
+    for col in [col for col in columns if col in NUMERIC_COLUMNS or col in COMPACT_DTYPES]:
+        values = pd.to_numeric(delta[col], errors='coerce')
+        invalid = values.isna() & delta[col].notna()
+        if invalid.any():
+            errors.append(f"Non-numeric {col} on rows {_rows(invalid)}")
+        delta[col] = values
+    for col in REQUIRED_VALUES:
+        if col in columns and delta[col].isna().any():
+            errors.append(f"Missing {col} on rows {_rows(delta[col].isna())}")
+    for col in NON_NEGATIVE_COLUMNS:
+        if col in columns and (delta[col] < 0).any():
+            errors.append(f"Negative {col} on rows {_rows(delta[col] < 0)}")
+    for col in [col for col in COMPACT_DTYPES if col in columns and col not in VALUE_RANGES]:
+        # Must fit the dataset's compact integer type, or merging would fail
+        limits = np.iinfo(COMPACT_DTYPES[col].lower())
+        out_of_range = delta[col].notna() & ((delta[col] < limits.min) | (delta[col] > limits.max) | (delta[col] % 1 != 0))
+        if out_of_range.any():
+            errors.append(f"{col} is not a whole number within {limits.min}-{limits.max} on rows {_rows(out_of_range)}")
+    for col, (low, high) in VALUE_RANGES.items():
+        if col in columns:
+            out_of_range = delta[col].notna() & ((delta[col] < low) | (delta[col] > high) | (delta[col] % 1 != 0))
+            if out_of_range.any():
+                errors.append(f"{col} outside {low}-{high} on rows {_rows(out_of_range)}")
+    key = [col for col in RECORD_KEY if col in columns]
+    duplicated = delta.duplicated(subset=key, keep=False)
+    if duplicated.any():
+        errors.append(f"Rows {_rows(duplicated)} repeat the same record key ({', '.join(key)})")
+    if errors:
+        raise DeltaError(errors)
+    return compact_dtypes(delta)
+
+
+def _align_dtypes(data, delta):
+    """Give `data` and `delta` identical column dtypes.
+
+    Categoricals get the sorted union of both categories, which keeps the
+    country-sorted order a fresh load of the merged file would have.
+    """
+    for col in data.columns:
+        dtype = data[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            values = delta[col].astype(object).dropna().unique()
+            new_values = set(values) - set(dtype.categories)
+            if new_values:
+                categories = sorted(set(dtype.categories) | new_values, key=str)
+                data[col] = data[col].cat.set_categories(categories)
+            delta[col] = delta[col].astype(object).astype(data[col].dtype)
+        else:
+            try:
+                delta[col] = delta[col].astype(dtype)
+            except (TypeError, ValueError) as e:
+                raise DeltaError([f"{col} does not fit the dataset's {dtype}: {e}"]) from None
+    return data, delta
+
+
+def _merge_country(block, delta_rows, key):
+    """One country's rows with `delta_rows` upserted; also returns (corrected, added)."""
+    positions = block[key].assign(_position=np.arange(len(block)))
+    delta_positions = delta_rows[key].assign(_delta=np.arange(len(delta_rows)))
+    # Missing admin names match each other, as in the row index
+    matches = positions.merge(delta_positions, on=key, how='inner')
+
+    combined = pd.concat([block, delta_rows], ignore_index=True)
+    order = np.arange(len(block))
+    keep = np.ones(len(block), dtype=bool)
+    if len(matches):
+        # A delta row takes the place of the first row with its key; the others go
+        first = matches.sort_values('_position').drop_duplicates('_delta')
+        order[first['_position'].to_numpy()] = len(block) + first['_delta'].to_numpy()
+        keep[matches['_position'].to_numpy()] = False
+        keep[first['_position'].to_numpy()] = True
+    matched = np.zeros(len(delta_rows), dtype=bool)
+    matched[matches['_delta'].to_numpy()] = True
+    added = len(block) + np.flatnonzero(~matched)
+    merged = combined.take(np.concatenate([order[keep], added])).reset_index(drop=True)
+    return merged, int(matched.sum()), int((~matched).sum())
+
+
+def merge_delta(data, bounds, delta):
+    """Upsert `delta` into country-sorted `data`; `bounds` maps countries to row slices.
+
+    Returns ``(merged, report)``. Countries the delta does not touch keep
+    their rows as they are.
+    """
+    data, delta = _align_dtypes(data.copy(deep=False), delta)
+    key = [col for col in RECORD_KEY if col in data.columns]
+    delta_by_country = {country: rows for country, rows in delta.groupby('country', sort=False, observed=True)}
+
+    blocks = []
+    report = {'rows': len(delta), 'corrected': 0, 'added': 0, 'countries': sorted(delta_by_country)}
+    last_stop = 0
+    for country in data['country'].cat.categories:
+        rows = bounds.get(country)
+        if rows is not None:
+            last_stop = rows.stop
+        if country in delta_by_country:
+            block = data.iloc[rows] if rows is not None else data.iloc[0:0]
+            merged, corrected, added = _merge_country(block.reset_index(drop=True), delta_by_country[country].reset_index(drop=True), key)
+            report['corrected'] += corrected
+            report['added'] += added
+            blocks.append(merged)
+        elif rows is not None:
+            blocks.append(data.iloc[rows])
+    # Rows without a country stay last
+    blocks.append(data.iloc[last_stop:])
+    return pd.concat(blocks, ignore_index=True), report
+
+
+def delta_sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def chain_version(version, delta_version):
+    """Dataset version after applying a delta to `version`."""
+    return hashlib.sha256(f"{version}:{delta_version}".encode()).hexdigest()
+
+
+def journal_dir(snapshot_dir, csv_path, csv_version):
+    """Where deltas applied on top of this exact CSV are kept (None without snapshots).
+
+    Keyed by the CSV's hash, so publishing a new release starts a new journal.
+    """
+    if not snapshot_dir:
+        return None
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(snapshot_dir, f"{stem}-{csv_version[:16]}.deltas")
+
+
+def journal_entries(directory):
+    """Journaled delta file names, oldest first."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.endswith('.csv'))
+
+
+def write_journal_entry(directory, content):
+    """Append `content` to the journal and return its entry name.
+
+    Callers hold `journal_lock`, so sequence numbers are not raced.
+    """
+    os.makedirs(directory, exist_ok=True)
+    sequence = len(journal_entries(directory)) + 1
+    name = f"{sequence:06d}-{delta_sha256(content)[:16]}.csv"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, os.path.join(directory, name))
+    return name
+
+
+def journal_lock(directory):
+    return file_lock(directory + '.lock')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('delta', help='CSV of added or corrected records')
+    parser.add_argument('--csv', default=os.environ.get('HVSTAT_DATA_PATH', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'public', 'hvstat_africa_data_v1.0.csv')), help='dataset the delta applies to')
+    parser.add_argument('--snapshot-dir', default=os.environ.get('HVSTAT_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR))
+    parser.add_argument('--check', action='store_true', help='only validate the delta')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from dataset import file_sha256
+    with open(args.delta, 'rb') as f:
+        content = f.read()
+    columns = pd.read_csv(args.csv, nrows=0).columns.tolist()
+    try:
+        delta = read_delta(content, columns)
+    except DeltaError as e:
+        raise SystemExit("Invalid delta:\n  " + "\n  ".join(e.errors))
+    countries = sorted(delta['country'].dropna().unique().tolist())
+    print(f"Delta is valid: {len(delta)} rows for {', '.join(countries)}.")
+    if args.check:
+        return
+
+    directory = journal_dir(args.snapshot_dir, args.csv, file_sha256(args.csv))
+    if directory is None:
+        raise SystemExit("Journaling needs a snapshot directory (HVSTAT_SNAPSHOT_DIR).")
+    with journal_lock(directory):
+        name = write_journal_entry(directory, content)
+    print(f"Journaled as {os.path.join(directory, name)}. Servers watching the dataset apply it on their next poll; others on restart.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# Latency buckets in seconds and payload buckets in bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with fixed buckets and label values."""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, dict(series, counts=list(series['counts']))) for labels, series in self._series.items())
+        for labelvalues, series in items:
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': repr(float(bound))})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+class Gauge:
+    """Metric whose samples are read from a callback at scrape time.
+
+    The callback returns (labels dict, value) pairs, so values owned by other
+    objects (cache hit counters, the live dataset) need no bookkeeping here.
+    """
+
+    def __init__(self, name, documentation, collect, kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(labels)} {value!r}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.request_seconds = self.register(Histogram(
+            'hvstat_request_duration_seconds', 'Time spent handling a request.',
+            ['route', 'method', 'status'], LATENCY_BUCKETS))
+        self.phase_seconds = self.register(Histogram(
+            'hvstat_request_phase_seconds', 'Time spent in each phase of a request.',
+            ['route', 'phase'], LATENCY_BUCKETS))
+        self.response_bytes = self.register(Histogram(
+            'hvstat_response_size_bytes', 'Size of response bodies as sent.',
+            ['route'], SIZE_BUCKETS))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Per-request phase timing. `mark` closes the phase that ran since the
+# previous boundary; `phase` times a block. Both are no-ops outside requests.
+
+def mark(name):
+    """Record the time since the last phase boundary as phase `name`."""
+    if not has_request_context() or 'phase_clock' not in g:
+        return
+    now = time.perf_counter()
+    _record(name, now - g.phase_clock)
+    g.phase_clock = now
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time the enclosed block as phase `name`."""
+    if not has_request_context() or 'phase_clock' not in g:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        _record(name, now - started)
+        g.phase_clock = now
+
+
+def _record(name, seconds):
+    g.phases[name] = g.phases.get(name, 0.0) + seconds
+
+
+def annotate(name, description):
+    """Attach a description (e.g. cache hit/miss) to the Server-Timing entry `name`."""
+    if has_request_context() and 'phase_notes' in g:
+        g.phase_notes[name] = description
+
+
+def _metric_name(name):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', name)
+
+
+def server_timing(phases, notes, total):
+    entries = []
+    for name, seconds in phases.items():
+        entry = f"{_metric_name(name)};dur={seconds * 1000:.3f}"
+        if name in notes:
+            entry += f';desc="{_escape(notes[name])}"'
+        entries.append(entry)
+    entries.extend(f'{_metric_name(name)};desc="{_escape(desc)}"' for name, desc in notes.items() if name not in phases)
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ', '.join(entries)
+
+
+class SlowRequestProfiler:
+    """Profile a random sample of requests and keep the profiles of slow ones.
+
+    Profiles are written as ``.prof`` files (open with pstats or snakeviz)
+    and the top functions are logged.
+    """
+
+    def __init__(self, sample_rate, slow_seconds, output_dir, top=15):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.output_dir = output_dir
+        self.top = top
+
+    def start(self):
+        if random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter
+            return None
+        return profiler
+
+    def finish(self, profiler, route, seconds):
+        profiler.disable()
+        if seconds < self.slow_seconds:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{_metric_name(route.strip('/'))}-{seconds * 1000:.0f}ms.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(self.top)
+        logging.warning(f"Slow request {route} took {seconds * 1000:.0f}ms; profile written to {path}\n{summary.getvalue()}")
+
+
+def instrument_app(app, registry, server_timing_header=True, profiler=None):
+    """Time every request of `app` into `registry` and add Server-Timing headers."""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = g.phase_clock = time.perf_counter()
+        g.phases = {}
+        g.phase_notes = {}
+        g.profiler = profiler.start() if profiler is not None else None
+
+    @app.after_request
+    def record_request_timing(response):
+        if 'request_started' not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        registry.request_seconds.observe(total, route, request.method, str(response.status_code))
+        for name, seconds in g.phases.items():
+            registry.phase_seconds.observe(seconds, route, name)
+        if not response.is_streamed:
+            registry.response_bytes.observe(response.calculate_content_length() or 0, route)
+        if server_timing_header:
+            response.headers['Server-Timing'] = server_timing(g.phases, g.phase_notes, total)
+        if g.profiler is not None:
+            profiler.finish(g.profiler, route, total)
+        return response
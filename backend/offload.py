@@ -0,0 +1,178 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+class PoolBusy(RuntimeError):
+    """The pool already has as many tasks in flight as it accepts."""
+
+
+class OffloadTimeout(TimeoutError):
+    """A task (or the call a request was waiting on) did not finish in time."""
+
+
+def _noop():
+    return None
+
+
+class ComputePool:
+    """Bounded process pool for CPU-heavy, stateless work such as aggregating rows or compressing bodies.
+
+    At most `max_pending` tasks are queued or running at once; `run` waits up
+    to `queue_timeout` seconds for a slot and then raises `PoolBusy`, so a
+    burst is pushed back to clients instead of piling up behind the GIL. A
+    slot is freed when its task finishes, not when the caller stops waiting,
+    so timed-out work still counts against the bound.
+
+    Workers only ever run the function they are given on its arguments; they
+    hold no dataset state, so reloads do not touch them. Call `start` while
+    the process still runs a single thread to fork them there (cheapest);
+    a pool started later, or restarted after a worker died, uses the
+    forkserver (or spawn) start method, since forking a multithreaded
+    process can deadlock on locks other threads held. With ``processes=0``
+    tasks run inline on the calling thread.
+    """
+
+    def __init__(self, processes, max_pending=None, queue_timeout=5.0):
+        self.processes = processes
+        self.max_pending = max_pending or max(1, processes) * 4
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @staticmethod
+    def _context():
+        if threading.active_count() == 1:
+            return multiprocessing.get_context('fork')
+        methods = multiprocessing.get_all_start_methods()
+        return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+    def _get_executor(self):
+        with self._lock:
+            # A forked server worker must not reuse its parent's pool
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=self._context())
+                self._pid = os.getpid()
+            return self._executor
+
+    def start(self):
+        """Start the worker processes now (see the class docstring); a no-op with ``processes=0``."""
+        if self.processes <= 0:
+            return
+        executor = self._get_executor()
+        # A fork-based executor forks all its workers on the first task
+        executor.submit(_noop).result()
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def run(self, timeout, fn, *args):
+        """Run ``fn(*args)`` in the pool and return its result within `timeout` seconds."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusy(f"{self.max_pending} tasks already in flight")
+        with self._lock:
+            self.in_flight += 1
+
+        if self.processes <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self._release()
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise OffloadTimeout(f"{getattr(fn, '__name__', fn)} did not finish within {timeout}s") from None
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool next time
+            logging.error("Compute pool worker died, restarting the pool.")
+            self._reset(executor)
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one.
+
+    The first caller of a key runs the function; callers arriving while it
+    runs wait for it and get the same result (or exception). Nothing is
+    remembered once the call returns, that is what the response cache is for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, fn, timeout=None):
+        """Return ``(fn(), shared)``; ``shared`` is True if another caller ran it."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise OffloadTimeout(f"Timed out after {timeout}s waiting for a concurrent identical request")
+            with self._lock:
+                self.shared += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def __len__(self):
+        return len(self._calls)
@@ -0,0 +1,224 @@
+"""Render every response the app can ask for into a static directory tree.
+
+The frontend's selectable space is finite: countries, their admin_1 and
+admin_2 units, and for each unit the time series levels and season split
+of /api/data and of every crop's /api/crop-timeseries. This walks all of it
+through the Flask routes and writes each 200 response as a file, with
+gzip/brotli siblings for nginx's gzip_static/brotli_static, plus a
+manifest.json. A web server or CDN can then answer those requests without
+Python, falling back to the app for anything else.
+
+    python precompute.py --out /srv/hvstat-static --processes 8
+
+Files are named by the request's query string in a fixed parameter order
+per route (`STATIC_ROUTES`), with every parameter present (empty if
+unused) and values encoded as the frontend's HTTP client (axios) sends
+them, so the server can build the name from the query arguments, e.g.
+``/api/admin1/country=${arg_country}.json``. The tree is built next to
+`--out` and swapped in when complete.
+"""
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+# Parameters of each precomputed route, in file name order
+STATIC_ROUTES = {
+    '/api/countries': [],
+    '/api/admin1': ['country'],
+    '/api/admin2': ['country', 'admin_1_name'],
+    '/api/data': ['country', 'admin_level', 'admin_1_name', 'admin_2_name', 'timeseries_admin_level', 'split_by_season'],
+    '/api/crop-timeseries': ['country', 'admin_level', 'admin_1_name', 'admin_2_name', 'crop_name', 'timeseries_admin_level',
+                             'split_by_season'],
+}
+
+# (timeseries_admin_level, split_by_season) pairs the frontend requests:
+# the season split only applies to the national series
+TIME_SERIES_VARIANTS = [('0', 'false'), ('0', 'true'), ('1', 'false'), ('2', 'false')]
+
+# File extensions of each content-coding
+ENCODING_EXTENSIONS = {'gzip': '.gz', 'br': '.br'}
+
+# Longest file name most filesystems accept
+MAX_NAME_BYTES = 255
+
+# Requests rendered per worker task
+TASK_CHUNK = 200
+
+DEFAULT_OUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.static')
+
+
+def encode_value(value):
+    """Percent-encode like encodeURIComponent with spaces as '+', which is what axios sends."""
+    return quote(str(value), safe="-_.!~*'():$,[]").replace('%20', '+')
+
+
+def static_name(route, params):
+    """Path of a request's file relative to the output directory."""
+    names = STATIC_ROUTES[route]
+    query = '&'.join(f"{name}={encode_value(params.get(name, ''))}" for name in names)
+    return route.lstrip('/') + '/' + (query or 'index') + '.json'
+
+
+def static_requests(snapshot, routes=STATIC_ROUTES, countries=None):
+    """Every (route, params) the frontend can request, for `countries` (default all)."""
+    from dataset import child_names, country_names
+    from rollups import rollup_crop_names, scope_key
+
+    if '/api/countries' in routes:
+        yield '/api/countries', {}
+    for country in countries or country_names(snapshot.index):
+        units = [(0, None, None)]
+        if '/api/admin1' in routes:
+            yield '/api/admin1', {'country': country}
+        for admin_1 in child_names(snapshot.index, country):
+            units.append((1, admin_1, None))
+            if '/api/admin2' in routes:
+                yield '/api/admin2', {'country': country, 'admin_1_name': admin_1}
+            units.extend((2, admin_1, admin_2) for admin_2 in child_names(snapshot.index, country, admin_1))
+
+        for admin_level, admin_1, admin_2 in units:
+            unit = {'country': country, 'admin_level': str(admin_level)}
+            if admin_1 is not None:
+                unit['admin_1_name'] = admin_1
+            if admin_2 is not None:
+                unit['admin_2_name'] = admin_2
+            crops = []
+            if '/api/crop-timeseries' in routes:
+                crops = rollup_crop_names(snapshot.rollups, admin_level, scope_key(admin_level, country, admin_1, admin_2))
+            for timeseries_admin_level, split in TIME_SERIES_VARIANTS:
+                variant = {'timeseries_admin_level': timeseries_admin_level, 'split_by_season': split}
+                if '/api/data' in routes:
+                    yield '/api/data', {**unit, **variant}
+                for crop in crops:
+                    yield '/api/crop-timeseries', {**unit, 'crop_name': crop, **variant}
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def render_requests(out_dir, requests):
+    """Render `requests` through the app into `out_dir`; returns manifest entries and skipped requests."""
+    import app
+    from serialization import available_encodings
+
+    client = app.app.test_client()
+    files = {}
+    skipped = []
+    for route, params in requests:
+        name = static_name(route, params)
+        if any(len(part.encode()) > MAX_NAME_BYTES - 3 for part in name.split('/')):
+            skipped.append({'route': route, 'params': params, 'reason': 'file name too long'})
+            continue
+        response = client.get(route, query_string=params, headers={'Accept-Encoding': 'identity'})
+        if response.status_code != 200:
+            skipped.append({'route': route, 'params': params, 'reason': f"status {response.status_code}"})
+            continue
+        path = os.path.join(out_dir, name)
+        _write(path, response.data)
+        encodings = []
+        for encoding in available_encodings():
+            # Served from the response cache entry the first request made
+            encoded = client.get(route, query_string=params, headers={'Accept-Encoding': encoding})
+            if encoded.headers.get('Content-Encoding') == encoding:
+                _write(path + ENCODING_EXTENSIONS[encoding], encoded.data)
+                encodings.append(encoding)
+        files[name] = {'bytes': len(response.data), 'etag': response.get_etag()[0], 'encodings': encodings}
+        # Every response is wanted once; keep the cache from growing
+        app.response_cache.clear()
+    return files, skipped
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def precompute(out_dir, processes=None, routes=STATIC_ROUTES, countries=None):
+    """Build the static tree in a sibling directory and swap it in as `out_dir`. Returns the manifest."""
+    import app
+
+    started = time.perf_counter()
+    snapshot = app.store.current()
+    if snapshot.data.empty:
+        raise SystemExit("The dataset did not load; nothing to precompute.")
+    building = out_dir.rstrip(os.sep) + '.partial'
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    chunks = _chunks(static_requests(snapshot, routes, countries), TASK_CHUNK)
+    render = functools.partial(render_requests, building)
+    files = {}
+    skipped = []
+    processes = processes or os.cpu_count() or 1
+    with contextlib.ExitStack() as stack:
+        if processes == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            results = map(render, chunks)
+        else:
+            # Forked workers share the loaded dataset and rollups with this process
+            pool = stack.enter_context(ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')))
+            results = pool.map(render, chunks)
+        for chunk_files, chunk_skipped in results:
+            files.update(chunk_files)
+            skipped.extend(chunk_skipped)
+
+    manifest = {
+        'version': snapshot.version,
+        'dataset': snapshot.path,
+        'generated_at': time.time(),
+        'routes': {route: STATIC_ROUTES[route] for route in routes},
+        'files': files,
+        'skipped': skipped,
+    }
+    _write(os.path.join(building, 'manifest.json'), json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+    previous = out_dir.rstrip(os.sep) + '.previous'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, previous)
+    os.replace(building, out_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    logging.warning(f"Precomputed {len(files)} responses ({len(skipped)} skipped) for dataset version {snapshot.version[:12]} "
+                    f"into {out_dir} in {time.perf_counter() - started:.1f}s.")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default=os.environ.get('HVSTAT_STATIC_DIR', DEFAULT_OUT_DIR), help='output directory')
+    parser.add_argument('--processes', type=int, default=0, help='rendering processes (default: one per core)')
+    parser.add_argument('--route', action='append', choices=list(STATIC_ROUTES), help='only these routes (repeatable)')
+    parser.add_argument('--country', action='append', help='only these countries (repeatable)')
+    args = parser.parse_args()
+
+    # Workers compress on their own thread rather than through a nested pool,
+    # and the live dataset is not watched while a snapshot of it is exported
+    os.environ['HVSTAT_COMPUTE_PROCESSES'] = '0'
+    os.environ['HVSTAT_WATCH_INTERVAL'] = '0'
+    import app
+    # Per-request logs would drown the summary
+    logging.getLogger().setLevel(logging.WARNING)
+    app.app.logger.setLevel(logging.WARNING)
+
+    routes = {route: STATIC_ROUTES[route] for route in args.route} if args.route else STATIC_ROUTES
+    precompute(os.path.abspath(args.out), args.processes or None, routes, args.country)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import file_sha256
+
+# Names accepted by the exclude_qc / exclude_flagged_crops options, with the
+# row-level qc_flag code and the QC table count column of each
+QC_FLAGS = {
+    'outlier': {'code': 1, 'count_column': 'outlier_cnt'},
+    'low_variance': {'code': 2, 'count_column': 'low_variance_cnt'},
+}
+QC_COLUMNS = ['outlier_cnt', 'low_variance_cnt', 'outlier_pct', 'low_variance_pct']
+
+
+def load_qc_flags(qc_path):
+    """Read the per-country/crop QC table into a (country, product) lookup.
+
+    Returns ``(flags, sha256)``; a missing file gives an empty lookup and
+    None, so the API still serves, just without QC information.
+    """
+    if not qc_path or not os.path.isfile(qc_path):
+        if qc_path:
+            logging.warning(f"QC flag file {qc_path} not found; serving without QC flags.")
+        return {}, None
+    table = pd.read_csv(qc_path, usecols=['country', 'crop'] + QC_COLUMNS)
+    flags = {}
+    for country, crop, outlier_cnt, low_variance_cnt, outlier_pct, low_variance_pct in table.itertuples(index=False):
+        flags[(country, crop)] = {
+            'outlier_cnt': int(outlier_cnt),
+            'low_variance_cnt': int(low_variance_cnt),
+            'outlier_pct': float(outlier_pct),
+            'low_variance_pct': float(low_variance_pct),
+        }
+    logging.info(f"Loaded QC flags for {len(flags)} country/crop pairs from {qc_path}.")
+    return flags, file_sha256(qc_path)
+
+
+def parse_qc_flags(value):
+    """Parse a comma-separated list of QC flag names into a frozenset.
+
+    Accepts a list too (JSON bodies). Raises ValueError on unknown names.
+    """
+    if value is None or value == '':
+        return frozenset()
+    names = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    names = frozenset(str(name).strip() for name in names if str(name).strip())
+    unknown = names - set(QC_FLAGS)
+    if unknown:
+        raise ValueError(f"Unknown QC flag(s): {', '.join(sorted(unknown))}. Use {', '.join(QC_FLAGS)}.")
+    return names
+
+
+def flagged_crops(qc_flags, country, flags):
+    """Products of `country` the QC table reports any of `flags` for."""
+    columns = [QC_FLAGS[name]['count_column'] for name in flags]
+    return {crop for (qc_country, crop), entry in qc_flags.items()
+            if qc_country == country and any(entry[col] > 0 for col in columns)}
+
+
+def qc_row_mask(country_data, qc_flags, country, row_flags=frozenset(), crop_flags=frozenset()):
+    """Boolean mask of one country's rows to keep.
+
+    Drops rows whose qc_flag is one of `row_flags` and rows of the products
+    the QC table flags with any of `crop_flags`.
+    """
+    keep = np.ones(len(country_data), dtype=bool)
+    if row_flags and 'qc_flag' in country_data.columns:
+        codes = [QC_FLAGS[name]['code'] for name in row_flags]
+        keep &= ~country_data['qc_flag'].isin(codes).to_numpy(dtype=bool, na_value=False)
+    if crop_flags and 'product' in country_data.columns:
+        crops = flagged_crops(qc_flags, country, crop_flags)
+        if crops:
+            keep &= ~country_data['product'].isin(crops).to_numpy(dtype=bool, na_value=False)
+    return keep
+
+
+def attach_qc_flags(crops_summary, qc_flags, country):
+    """Add each crop's QC table entry (or None) to its crops_summary details."""
+    for product, details in crops_summary.items():
+        details['qc_flags'] = qc_flags.get((country, product))
+    return crops_summary
@@ -0,0 +1,477 @@
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+import aggregation
+import coverage
+from aggregation import (ALL_SERIES, build_tables, block_ranges, emit_crop_details, emit_time_series_page, scope_summaries,
+                         time_series_layout)
+from coverage import build_country_coverage, group_coverage
+from dataset import file_lock, row_positions
+from slices import table_slice_level
+from trends import OUTLIER_Z, emit_crop_statistics
+
+# Columns identifying the selected unit at each admin_level, and the column
+# whose distinct count is reported for that unit.
+SCOPE_COLUMNS = {
+    0: ['country'],
+    1: ['country', 'admin_1'],
+    2: ['country', 'admin_1', 'admin_2'],
+}
+SCOPE_CHILD_COLUMN = {0: 'admin_1', 1: 'admin_2', 2: None}
+
+KEY_COLUMNS = ['country', 'admin_1', 'admin_2', 'product', 'season_name', 'crop_production_system']
+
+
+def _available_layouts(columns):
+    layouts = {
+        time_series_layout(columns, level, split)
+        for level in (0, 1, 2)
+        for split in (False, True)
+    }
+    layouts.discard(None)
+    return sorted(layouts)
+
+
+def build_country_rollups(country_data):
+    """Precompute everything /api/data and /api/crop-timeseries read for one country.
+
+    For each admin level this holds the per-unit headline figures and the
+    crop, season and time series tables for every layout, keyed by
+    (unit..., product). The national level also has a 'season' layout (one
+    series per season, whatever the production system) for
+    /api/continental. Under 'coverage' are the year bitmasks of the
+    country's series (see `coverage`).
+    """
+    layouts = _available_layouts(country_data.columns)
+    national_layouts = layouts + ['season'] if 'season_name' in country_data.columns else layouts
+    country_data = _factorize_keys(country_data)
+    levels = {}
+    for level, scope_columns in SCOPE_COLUMNS.items():
+        if all(col in country_data.columns for col in scope_columns + ['product']):
+            levels[level] = _build_level(country_data, level, national_layouts if level == 0 else layouts)
+    levels['coverage'] = build_country_coverage(country_data)
+    return levels
+
+
+def _factorize_keys(data):
+    # Factorize the string keys once so the many groupbys reuse the codes.
+    # Columns loaded as categoricals carry the whole dataset's categories;
+    # trimming them to these rows' keeps every groupby small.
+    return data.assign(**{
+        col: (data[col].cat.remove_unused_categories()
+              if isinstance(data[col].dtype, pd.CategoricalDtype)
+              else data[col].astype('category'))
+        for col in KEY_COLUMNS if col in data.columns
+    })
+
+
+def _build_level(data, level, layouts, time_series_only=False):
+    scope_columns = SCOPE_COLUMNS[level]
+    tables = build_tables(data, scope_columns + ['product'], layouts, seasons=not time_series_only)
+    return {
+        'tables': tables,
+        'crops': block_ranges(tables['groups'], scope_columns),
+        'summaries': {} if time_series_only else scope_summaries(data, scope_columns, SCOPE_CHILD_COLUMN[level]),
+    }
+
+
+def build_rollups(data, index):
+    """Build the rollups of every country in the dataset.
+
+    Rollups are kept per country so a country's rows can be re-aggregated
+    on their own.
+    """
+    rollups = {'columns': list(data.columns), 'countries': {}}
+    if data.empty:
+        return rollups
+    started = time.perf_counter()
+    for (country,), rows in index['rows'].get(('country',), {}).items():
+        rollups['countries'][country] = build_country_rollups(data.iloc[rows])
+    logging.info(f"Built rollups for {len(rollups['countries'])} countries in {time.perf_counter() - started:.2f}s.")
+    return rollups
+
+
+def _rollups_fingerprint(columns):
+    """Hash of what persisted rollups depend on besides the data: columns and the code building them."""
+    digest = hashlib.sha256(f"{columns}:{np.__version__}:{pd.__version__}".encode())
+    for module_path in sorted({aggregation.__file__, coverage.__file__, __file__}):
+        with open(module_path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def rollups_path(snapshot_dir, csv_path, csv_version, columns):
+    """Where the rollups of `csv_path`'s `columns` are persisted, next to its dataset snapshot."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(snapshot_dir, f"{stem}-{csv_version[:16]}.rollups-{_rollups_fingerprint(columns)[:16]}.pickle")
+
+
+def _read_rollups(path):
+    try:
+        with open(path, 'rb') as f:
+            started = time.perf_counter()
+            rollups = pickle.load(f)
+        logging.info(f"Loaded rollups {path} in {time.perf_counter() - started:.2f}s.")
+        return rollups
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logging.warning(f"Ignoring unreadable rollups {path}: {e}")
+        return None
+
+
+def load_rollups(data, index, path):
+    """`build_rollups` of `data`, persisted at `path` (see `rollups_path`) and read back on later starts.
+
+    The file is written by us next to the dataset snapshot, so it is
+    trusted like the snapshot itself. Only one process builds it; the
+    others wait and read what it wrote. Rollups of other dataset versions
+    or code are removed once the new file is written.
+    """
+    rollups = _read_rollups(path)
+    if rollups is not None:
+        return rollups
+    with file_lock(path + '.lock'):
+        # Another process may have written them while we waited
+        rollups = _read_rollups(path)
+        if rollups is not None:
+            return rollups
+        rollups = build_rollups(data, index)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(rollups, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            logging.info(f"Wrote rollups {path}.")
+        except OSError as e:
+            logging.warning(f"Could not persist rollups to {path}: {e}")
+            return rollups
+    stem = os.path.basename(path).split('.rollups-')[0].rsplit('-', 1)[0]
+    for stale in glob.glob(os.path.join(glob.escape(os.path.dirname(path)), f"{glob.escape(stem)}-*.rollups-*.pickle")):
+        if stale != path:
+            for stale_path in (stale, stale + '.lock'):
+                try:
+                    os.remove(stale_path)
+                except OSError:
+                    pass
+    return rollups
+
+
+def update_rollups(rollups, data, index, countries):
+    """Rollups of `data` given `rollups` of a version differing only in `countries`.
+
+    Only those countries are rebuilt; the others are shared with `rollups`.
+    """
+    updated = {'columns': list(data.columns), 'countries': dict(rollups['countries'])}
+    started = time.perf_counter()
+    country_rows = index['rows'].get(('country',), {})
+    for country in countries:
+        rows = country_rows.get((country,))
+        if rows is None:
+            updated['countries'].pop(country, None)
+        else:
+            updated['countries'][country] = build_country_rollups(data.iloc[rows])
+    logging.info(f"Rebuilt rollups for {len(countries)} countries in {time.perf_counter() - started:.2f}s.")
+    return updated
+
+
+def run_inline(fn, *args):
+    return fn(*args)
+
+
+class MaskedCountryRollups(Mapping):
+    """Per-country rollups of only the rows ``row_mask(country_data, country)`` keeps.
+
+    Countries are built on first access and then kept, so each filter costs
+    one country build instead of a scan per request. A country with no rows
+    left is absent. Builds run through ``compute(fn, *args)``, e.g. in a
+    process pool.
+    """
+
+    def __init__(self, data, index, row_mask, compute=run_inline):
+        self._data = data
+        self._rows = index['rows'].get(('country',), {})
+        self._row_mask = row_mask
+        self._compute = compute
+        self._built = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, country):
+        built = self._built.get(country)
+        if built is None:
+            rows = self._rows.get((country,))
+            if rows is None:
+                raise KeyError(country)
+            with self._lock:
+                built = self._built.get(country)
+                if built is None:
+                    country_data = self._data.iloc[rows]
+                    keep = self._row_mask(country_data, country)
+                    built = self._compute(build_country_rollups, country_data[keep]) if keep.any() else False
+                    self._built[country] = built
+        if built is False:
+            raise KeyError(country)
+        return built
+
+    def __iter__(self):
+        return (key[0] for key in self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def masked_rollups(data, index, row_mask, compute=run_inline):
+    """Rollups (in the shape `build_rollups` returns) of the rows `row_mask` keeps."""
+    return {'columns': list(data.columns), 'countries': MaskedCountryRollups(data, index, row_mask, compute)}
+
+
+def build_slice_level(unit_data, admin_level, layouts, time_series_only=False):
+    """`admin_level` of the rollups of one unit's rows (see `slice_rollups`)."""
+    return _build_level(_factorize_keys(unit_data), admin_level, layouts, time_series_only)
+
+
+def slice_rollups(data, index, admin_level, scope, row_mask, layouts, product=None, time_series_only=False, base=None,
+                  row_filters=None, compute=run_inline):
+    """Rollups (in the shape `build_rollups` returns) of the rows of one unit that `row_mask` keeps.
+
+    Only the unit's rows, or its `product` rows when given, are read (found
+    through the row index) and only `admin_level` with `layouts` is built.
+    `row_mask(rows)` gives the boolean mask of `rows` to keep. With
+    `time_series_only` the season table and unit summary are skipped.
+
+    When `base` holds the rollups of every row the QC part of `row_mask`
+    keeps and `row_filters` is the rest of it, the slice is read from
+    `base`'s tables (see `slices`). Otherwise, or where those tables cannot
+    express it, the kept rows are aggregated through ``compute(fn, *args)``.
+    """
+    rollups = {'columns': list(data.columns), 'countries': {}}
+    rows = row_positions(index, *scope, product=product)
+    if rows is None:
+        return rollups
+    unit_data = data.iloc[rows]
+    keep = row_mask(unit_data)
+    layouts = [layout for layout in layouts if layout]
+    base_level = _level(base, admin_level, scope) if base is not None and row_filters is not None else None
+    if base_level is not None:
+        level = table_slice_level(base_level, unit_data, keep, admin_level, scope, SCOPE_CHILD_COLUMN[admin_level], row_filters,
+                                  layouts, product, time_series_only)
+        if level is not None:
+            if level['crops']:
+                rollups['countries'][scope[0]] = {admin_level: level}
+            return rollups
+    if keep.any():
+        level = compute(build_slice_level, unit_data[keep] if not keep.all() else unit_data, admin_level, layouts, time_series_only)
+        rollups['countries'][scope[0]] = {admin_level: level}
+    return rollups
+
+
+def scope_key(admin_level, country, admin_1=None, admin_2=None):
+    return (country, admin_1, admin_2)[:admin_level + 1]
+
+
+def _level(rollups, admin_level, scope):
+    return rollups['countries'].get(scope[0], {}).get(admin_level)
+
+
+def rollup_crop_names(rollups, admin_level, scope):
+    """Products of a unit, in table order (empty if it has no rows)."""
+    level = _level(rollups, admin_level, scope)
+    if level is None or scope not in level['crops']:
+        return []
+    start, stop = level['crops'][scope]
+    return [key[-1] for key in level['tables']['keys'][start:stop]]
+
+
+def rollup_summary(rollups, admin_level, scope):
+    """Headline figures of a unit (see `scope_summaries`), or None if it has no rows."""
+    level = _level(rollups, admin_level, scope)
+    if level is None:
+        return None
+    return level['summaries'].get(scope)
+
+
+def rollup_crops_summary(rollups, admin_level, scope, timeseries_admin_level=0, split_by_season_production_system=False,
+                         series_options=ALL_SERIES):
+    """Crop details of every product of a unit, keyed by product name."""
+    level = _level(rollups, admin_level, scope)
+    if level is None or scope not in level['crops']:
+        return {}
+    layout = time_series_layout(rollups['columns'], timeseries_admin_level, split_by_season_production_system)
+    tables = level['tables']
+    start, stop = level['crops'][scope]
+    return {tables['keys'][i][-1]: emit_crop_details(tables, i, layout, series_options) for i in range(start, stop)}
+
+
+def rollup_crop_time_series(rollups, admin_level, scope, crop_name, timeseries_admin_level=0, split_by_season_production_system=False,
+                            series_options=ALL_SERIES):
+    """``(time series, number of series paged over)`` of one crop in a unit, or None if it has no such crop."""
+    specs = [(crop_name, timeseries_admin_level, split_by_season_production_system)]
+    return rollup_crop_time_series_pages(rollups, admin_level, scope, specs, series_options)[0]
+
+
+def rollup_crop_time_series_pages(rollups, admin_level, scope, specs, series_options=ALL_SERIES):
+    """Time series of several (crop_name, timeseries_admin_level, split) specs of one unit.
+
+    The unit's crops and each layout are resolved once for the whole batch.
+    Each result is ``(time series, number of series paged over)``; crops the
+    unit does not have give None.
+    """
+    level = _level(rollups, admin_level, scope)
+    if level is None or scope not in level['crops']:
+        return [None] * len(specs)
+    tables = level['tables']
+    start, stop = level['crops'][scope]
+    crops = {key[-1] for key in tables['keys'][start:stop]}
+    layouts = {}
+    results = []
+    for crop_name, timeseries_admin_level, split in specs:
+        if crop_name not in crops:
+            results.append(None)
+            continue
+        options = (timeseries_admin_level, split)
+        if options not in layouts:
+            layouts[options] = time_series_layout(rollups['columns'], timeseries_admin_level, split)
+        results.append(emit_time_series_page(tables, scope + (crop_name,), layouts[options], series_options))
+    return results
+
+
+def rollup_crop_statistics(rollups, admin_level, scope, crop_names=None, timeseries_admin_level=0,
+                           split_by_season_production_system=False, series_options=ALL_SERIES, outlier_z=OUTLIER_Z):
+    """Yield trend and anomaly statistics (see `trends`) of a unit's crops.
+
+    Covers `crop_names`, or every crop of the unit when None. Returns
+    ``{crop_name: (statistics per series, number of series paged over)}``
+    for the crops with yield years, or None if the unit has no rows.
+    """
+    level = _level(rollups, admin_level, scope)
+    if level is None or scope not in level['crops']:
+        return None
+    layout = time_series_layout(rollups['columns'], timeseries_admin_level, split_by_season_production_system)
+    if layout is None:
+        return {}
+    tables = level['tables']
+    series = tables['series'][layout]
+    start, stop = level['crops'][scope]
+    blocks = {}
+    for key in tables['keys'][start:stop]:
+        block = series['ranges'].get(key)
+        if block is not None and (crop_names is None or key[-1] in crop_names):
+            blocks[key[-1]] = block
+    return emit_crop_statistics(series, blocks, series_options, outlier_z)
+
+
+def _yearly_points(years, production, area):
+    return [{'year': year, 'production': prod, 'area': ar, 'yield': prod / ar if ar > 0 else 0}
+            for year, prod, ar in zip(years.tolist(), production.tolist(), area.tolist())]
+
+
+def _sum_by_year(years, production, area):
+    """Yearly production and area totals of (year, production, area) rows, by year."""
+    unique_years, positions = np.unique(years, return_inverse=True)
+    return (unique_years, np.bincount(positions, weights=production, minlength=len(unique_years)),
+            np.bincount(positions, weights=area, minlength=len(unique_years)))
+
+
+def _country_slice(level, country, product, season_name):
+    """Totals and yearly rows of one country's `product` and/or `season_name`, or None if it has neither.
+
+    Read from the country's national tables: crop totals (or the season
+    table) and the 'total' (or 'season') yearly series. Records without a
+    harvest year count towards the totals only.
+    """
+    tables = level['tables']
+    start, stop = level['crops'].get((country,), (0, 0))
+    positions = [i for i in range(start, stop) if product is None or tables['keys'][i][-1] == product]
+    if not positions:
+        return None
+    keys = [tables['keys'][i] for i in positions]
+    if season_name is None:
+        production = float(np.nansum(tables['production'][positions]))
+        area = float(np.nansum(tables['area'][positions]))
+        series = tables['series'].get('total')
+    else:
+        seasons = tables['seasons']
+        if seasons is None:
+            return None
+        rows = [i for key in keys for i in range(*seasons['ranges'].get(key, (0, 0)))
+                if seasons['season_name'][i] == season_name]
+        if not rows:
+            return None
+        production = float(np.nansum(seasons['production'][rows]))
+        area = float(np.nansum(seasons['area'][rows]))
+        series = tables['series'].get('season')
+
+    if series is None:
+        yearly = (np.array([], dtype=np.int64), np.array([]), np.array([]))
+    else:
+        rows = np.concatenate([np.arange(*series['ranges'][key]) for key in keys if key in series['ranges']] or [[]]).astype(np.int64)
+        if season_name is not None:
+            in_season = np.array([values == (season_name,) for values in series['series_values']], dtype=bool)
+            rows = rows[in_season[series['series_id'][rows]]]
+        yearly = _sum_by_year(series['year'][rows].astype(np.int64), np.nan_to_num(series['production'][rows]),
+                              np.nan_to_num(series['area'][rows]))
+    return {'production': production, 'area': area, 'yearly': yearly}
+
+
+def rollup_continental(rollups, countries, product=None, season_name=None):
+    """Totals and yearly series of `product` and/or `season_name` per country and summed over `countries`.
+
+    Only the countries' national rollup tables are read, never their rows.
+    Returns None if none of the countries has the product/season.
+    """
+    results = {}
+    for country in countries:
+        level = rollups['countries'].get(country, {}).get(0)
+        if level is None:
+            continue
+        found = _country_slice(level, country, product, season_name)
+        if found is not None:
+            results[country] = found
+    if not results:
+        return None
+
+    production = sum(result['production'] for result in results.values())
+    area = sum(result['area'] for result in results.values())
+    years, yearly_production, yearly_area = _sum_by_year(*(np.concatenate(parts) for parts in zip(*(result['yearly'] for result in results.values()))))
+    return {
+        'countries': {
+            country: {
+                'total_production': result['production'],
+                'total_area_harvested': result['area'],
+                'average_yield': result['production'] / result['area'] if result['area'] else 0,
+                'percentage_of_total_production': result['production'] / production * 100 if production else 0,
+                'time_series': _yearly_points(*result['yearly']),
+            }
+            for country, result in results.items()
+        },
+        'total': {
+            'countries_count': len(results),
+            'total_production': production,
+            'total_area_harvested': area,
+            'average_yield': production / area if area else 0,
+            'time_series': _yearly_points(years, yearly_production, yearly_area),
+        },
+    }
+
+
+def rollup_coverage(rollups, countries, group_by, product=None):
+    """``{country: (keys, masks)}`` of `countries`' coverage grouped by `group_by` (see `group_coverage`).
+
+    Countries without rows, or without one of the `group_by` columns, are left out.
+    """
+    groups = {}
+    for country in countries:
+        coverage = rollups['countries'].get(country, {}).get('coverage')
+        if coverage is not None and all(col in coverage['columns'] for col in group_by):
+            groups[country] = group_coverage(coverage, group_by, product)
+    return groups
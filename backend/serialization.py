@@ -0,0 +1,111 @@
+import gzip
+import json
+import math
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+from metrics import phase
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional speedup
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _finite(obj):
+    """Stdlib fallback: turn numpy scalars into Python and NaN/inf into None."""
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    if isinstance(obj, np.ndarray):
+        return _finite(obj.tolist())
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def dumps(obj, indent=False):
+    """Serialize `obj` to JSON bytes.
+
+    Keys are sorted, numpy scalars and arrays are encoded natively, and NaN
+    or infinite floats become ``null`` so every response is valid JSON.
+    Uses orjson when it is installed and the standard library otherwise.
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(
+        _finite(obj), sort_keys=True, allow_nan=False, ensure_ascii=False,
+        indent=2 if indent else None, separators=None if indent else (',', ':'),
+    ).encode('utf-8')
+
+
+def dumps_lines(records):
+    """Serialize `records` (dicts) as newline-delimited JSON bytes.
+
+    Unlike `dumps`, keys keep their order. Floats are written in full
+    (shortest round-trip form) and NaN becomes ``null``.
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+        return b''.join(orjson.dumps(record, option=option) for record in records)
+    return ''.join(json.dumps(_finite(record), allow_nan=False, ensure_ascii=False, separators=(',', ':')) + '\n'
+                   for record in records).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that routes `jsonify` through `dumps`."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        with phase('serialize'):
+            body = dumps(obj, indent=indent) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def available_encodings():
+    """Content-codings this server can produce, most preferred first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def precompress(body):
+    """Every supported encoding of `body`, or none if it is too small to bother."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return {}
+    return {encoding: compress(body, encoding) for encoding in available_encodings()}
+
+
+def negotiate_encoding(accept_encodings, encoded):
+    """Pick the client's preferred encoding among those in `encoded` (None = identity)."""
+    offered = [encoding for encoding in available_encodings() if encoding in encoded]
+    if not offered:
+        return None
+    return accept_encodings.best_match(offered)
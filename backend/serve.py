@@ -0,0 +1,88 @@
+"""Production entry point: serve the API from several worker processes.
+
+The master process imports the app once, which loads the dataset from its
+memory-mapped snapshot (publishing the snapshot first if the CSV has none),
+then forks the workers. Every worker inherits the same read-only mapping,
+so the columns live once in the page cache however many workers run, and
+the row index and rollups built by the master are shared copy-on-write.
+
+    python serve.py --workers 8 --bind 0.0.0.0:5000
+
+Requires gunicorn (``pip install gunicorn``), so it runs on Linux and macOS.
+"""
+import argparse
+import gc
+import logging
+import os
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # pragma: no cover - multi-worker serving is optional
+    BaseApplication = None
+
+
+def default_workers():
+    return int(os.environ.get('HVSTAT_WORKERS', os.cpu_count() or 1))
+
+
+# The master must not poll the CSV (its watch thread would not survive fork
+# and a reload there would only cost memory), so the interval is taken out of
+# the environment before the app is imported and handed to the workers.
+WATCH_INTERVAL = float(os.environ.pop('HVSTAT_WATCH_INTERVAL', '0'))
+# Likewise the compute pool: a pool forked in the master is no use to the
+# workers, so each worker starts its own right after it is forked, while it
+# still runs a single thread.
+os.environ['HVSTAT_START_COMPUTE_POOL'] = '0'
+
+
+def post_fork(server, worker):
+    import app
+    app.compute_pool.start()
+    # Each worker polls the CSV itself. The first to see a change republishes
+    # the snapshot and the others map what it wrote.
+    if WATCH_INTERVAL > 0:
+        app.store.watch(WATCH_INTERVAL)
+
+
+def make_application(options):
+    class HvstatApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import app
+            # Move everything allocated so far out of the collector's reach so
+            # collections in the workers do not write to (and so copy) the
+            # pages holding the index and rollups shared with the master.
+            gc.freeze()
+            return app.app
+
+    return HvstatApplication()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default=os.environ.get('HVSTAT_BIND', '127.0.0.1:5000'))
+    parser.add_argument('--workers', type=int, default=default_workers(), help='worker processes (default: one per core)')
+    # Threads let identical concurrent requests in a worker share one render
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('HVSTAT_THREADS', '4')), help='threads per worker')
+    parser.add_argument('--timeout', type=int, default=120, help='seconds before a silent worker is restarted')
+    args = parser.parse_args()
+
+    if BaseApplication is None:
+        raise SystemExit("Multi-worker serving requires gunicorn: pip install gunicorn")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    make_application({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'timeout': args.timeout,
+        # Load the dataset once in the master and fork workers from it
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Slices of one unit's rollups (harvest years, seasons, production systems) read from its precomputed tables.
+
+The series tables hold one row per (crop, series, harvest year), and the
+'split' layout's series are exactly the (season, production system) pairs,
+so a slice's yearly points, crop totals and season sums are a selection of
+table rows. What the tables do not hold (distinct production systems,
+months, planting years and child units) is read from the unit's kept rows
+with NumPy. Sums of table rows equal the per-request sums up to float
+rounding; yearly points are the same values.
+"""
+import numpy as np
+
+from aggregation import SEASON_SPLIT_COLUMNS, missing_years
+
+
+def _key_blocks(series, keys):
+    """Rows of `series` belonging to `keys` (in table order) and the position in `keys` of each."""
+    blocks = [(position, series['ranges'][key]) for position, key in enumerate(keys) if key in series['ranges']]
+    if not blocks:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    rows = np.concatenate([np.arange(start, stop) for _, (start, stop) in blocks])
+    positions = np.repeat([position for position, _ in blocks], [stop - start for _, (start, stop) in blocks])
+    return rows, positions
+
+
+def _year_mask(years, row_filters):
+    keep = np.ones(len(years), dtype=bool)
+    if row_filters.year_from is not None:
+        keep &= years >= row_filters.year_from
+    if row_filters.year_to is not None:
+        keep &= years <= row_filters.year_to
+    return keep
+
+
+def _position_ranges(positions, keys):
+    """Map ``keys[p]`` to the (start, stop) run of `p` in non-decreasing `positions`."""
+    if not len(positions):
+        return {}
+    starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]])
+    stops = np.r_[starts[1:], len(positions)]
+    return {keys[p]: (int(start), int(stop)) for p, start, stop in zip(positions[starts].tolist(), starts.tolist(), stops.tolist())}
+
+
+def _series_block(series_id, year, production, area, labels, series_columns, series_values, positions, keys):
+    """A series table (as `_series_table` builds) of rows already sorted by key, series and year."""
+    starts = np.flatnonzero(np.r_[True, series_id[1:] != series_id[:-1]]) if len(series_id) else np.array([], dtype=np.int64)
+    return {
+        'series_id': series_id,
+        'year': year,
+        'production': production,
+        'area': area,
+        'labels': labels,
+        'ranges': _position_ranges(positions, keys),
+        'series_columns': series_columns,
+        'series_values': series_values,
+        'series_start': starts,
+        'series_stop': np.r_[starts[1:], len(series_id)].astype(np.int64),
+        'series_production': np.bincount(series_id, weights=np.nan_to_num(production), minlength=len(starts)) if len(series_id) else np.array([]),
+    }
+
+
+def _series_subset(series, rows, positions, keys):
+    """The rows `rows` (ascending) of a precomputed series table, as a table of their own."""
+    ids, series_id = np.unique(series['series_id'][rows], return_inverse=True)
+    ids = ids.tolist()
+    return _series_block(series_id.astype(np.int64), series['year'][rows], series['production'][rows], series['area'][rows],
+                         [series['labels'][i] for i in ids], series['series_columns'], [series['series_values'][i] for i in ids],
+                         positions, keys)
+
+
+def _summed_total(split, rows, positions, keys):
+    """The 'total' layout of split-table `rows`: one series per crop, summed by year."""
+    years = split['year'][rows].astype(np.int64)
+    groups, group_ids = np.unique(np.stack([positions, years]), axis=1, return_inverse=True)
+    group_ids = group_ids.reshape(-1)
+    production = np.bincount(group_ids, weights=split['production'][rows], minlength=groups.shape[1])
+    area = np.bincount(group_ids, weights=split['area'][rows], minlength=groups.shape[1])
+    crop_positions = groups[0]
+    _, series_id = np.unique(crop_positions, return_inverse=True)
+    count = int(series_id.max()) + 1 if len(series_id) else 0
+    return _series_block(series_id.astype(np.int64), groups[1], production, area, ['Total'] * count, [], [()] * count,
+                         crop_positions, keys)
+
+
+def _codes(values, names):
+    """Category codes of `values` translated to positions in `names` (-1 elsewhere, or for missing values)."""
+    lookup = np.full(len(values.cat.categories) + 1, -1, dtype=np.int64)
+    positions = {name: position for position, name in enumerate(names)}
+    for code, name in enumerate(values.cat.categories.tolist()):
+        lookup[code] = positions.get(name, -1)
+    # Code -1 (missing) reads the trailing -1
+    return lookup[values.cat.codes.to_numpy()]
+
+
+def _season_lists(kept, crop_positions, season_ranks, seasons_count):
+    """Production systems (in order of appearance) and sorted planting/harvest months of each (crop, season) group.
+
+    Groups are numbered ``crop position * seasons_count + season rank``.
+    """
+    group_ids = crop_positions * seasons_count + season_ranks
+    systems = kept['crop_production_system']
+    system_codes = systems.cat.codes.to_numpy().astype(np.int64)
+    names = systems.cat.categories.tolist()
+    combos, first = np.unique(group_ids * (len(names) + 1) + system_codes, return_index=True)
+    production_systems = {}
+    for combo in combos[np.argsort(first, kind='stable')].tolist():
+        production_systems.setdefault(combo // (len(names) + 1), []).append(names[combo % (len(names) + 1)])
+
+    months = {}
+    for col in ('planting_month', 'harvest_month'):
+        lists = {}
+        if col in kept.columns:
+            values = kept[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            present = ~np.isnan(values)
+            combos = np.unique(group_ids[present] * 100 + values[present].astype(np.int64))
+            for combo in combos.tolist():
+                lists.setdefault(combo // 100, []).append(combo % 100)
+        months[col] = lists
+    return production_systems, months
+
+
+def table_slice_level(level, unit_data, keep, admin_level, scope, child_column, row_filters, layouts, product=None,
+                      time_series_only=False):
+    """The level `_build_level` gives for the rows of `unit_data` that `keep` selects, read from `level`.
+
+    `level` holds the unit's rollups of every row `keep` could select and
+    `row_filters` is the slice `keep` applies on top. Returns None when the
+    tables cannot express the slice (admin unit layouts of a season or
+    system slice, records without a harvest year, season or system), and
+    the caller aggregates the rows instead.
+    """
+    tables = level['tables']
+    split = tables['series'].get('split')
+    if split is None or split['series_columns'] != SEASON_SPLIT_COLUMNS:
+        return None
+    by_series = bool(row_filters.seasons or row_filters.production_systems)
+    if by_series and any(layout in ('admin_1', 'admin_2') for layout in layouts):
+        return None
+    kept = unit_data[keep] if not keep.all() else unit_data
+    if any(kept[col].isna().any() for col in ['harvest_year'] + SEASON_SPLIT_COLUMNS):
+        # The series tables leave these records out
+        return None
+
+    start, stop = level['crops'].get(scope, (0, 0))
+    keys = [key for key in tables['keys'][start:stop] if product is None or key[-1] == product]
+    rows, positions = _key_blocks(split, keys)
+    series_ids = split['series_id'][rows]
+    ids, id_positions = np.unique(series_ids, return_inverse=True)
+    wanted = np.array([(not row_filters.seasons or season in row_filters.seasons) and
+                       (not row_filters.production_systems or system in row_filters.production_systems)
+                       for season, system in (split['series_values'][i] for i in ids.tolist())], dtype=bool)
+    selected = wanted[id_positions.reshape(-1)] & _year_mask(split['year'][rows], row_filters) if len(rows) else np.zeros(0, dtype=bool)
+    rows, positions = rows[selected], positions[selected]
+    if bool(len(rows)) != bool(len(kept)):
+        return None
+
+    # Keep only the crops with rows left, renumbered in table order
+    present = np.bincount(positions, minlength=len(keys)) > 0
+    renumber = np.cumsum(present) - 1
+    keys = [key for key, has_rows in zip(keys, present.tolist()) if has_rows]
+    positions = renumber[positions]
+    production = np.bincount(positions, weights=split['production'][rows], minlength=len(keys))
+    area = np.bincount(positions, weights=split['area'][rows], minlength=len(keys))
+    sliced = {'keys': keys, 'production': production, 'area': area, 'seasons': None, 'series': {}}
+
+    for layout in layouts:
+        if layout is None or layout in sliced['series']:
+            continue
+        if layout == 'split':
+            sliced['series'][layout] = _series_subset(split, rows, positions, keys)
+        elif layout == 'total' and by_series:
+            sliced['series'][layout] = _summed_total(split, rows, positions, keys)
+        elif layout in tables['series']:
+            series = tables['series'][layout]
+            layout_rows, layout_positions = _key_blocks(series, keys)
+            in_years = _year_mask(series['year'][layout_rows], row_filters)
+            sliced['series'][layout] = _series_subset(series, layout_rows[in_years], layout_positions[in_years], keys)
+
+    summaries = {}
+    if not time_series_only and keys:
+        # Season sums from the table rows; the distinct values from the records
+        season_values = [split['series_values'][i][0] for i in split['series_id'][rows].tolist()]
+        season_names = sorted(set(season_values), key=str)
+        ranks = {name: rank for rank, name in enumerate(season_names)}
+        groups, group_ids = np.unique(positions * len(season_names) + np.array([ranks[name] for name in season_values]),
+                                      return_inverse=True)
+        group_ids = group_ids.reshape(-1)
+        crop_positions = _codes(kept['product'], [key[-1] for key in keys])
+        season_ranks = _codes(kept['season_name'], season_names)
+        if (crop_positions < 0).any() or (season_ranks < 0).any():
+            return None
+        production_systems, months = _season_lists(kept, crop_positions, season_ranks, len(season_names))
+        group_list = groups.tolist()
+        sliced['seasons'] = {
+            'season_name': [season_names[group % len(season_names)] for group in group_list],
+            'production': np.bincount(group_ids, weights=split['production'][rows], minlength=len(groups)),
+            'area': np.bincount(group_ids, weights=split['area'][rows], minlength=len(groups)),
+            'production_systems': [production_systems.get(group, []) for group in group_list],
+            'planting_months': [months['planting_month'].get(group, []) for group in group_list],
+            'harvest_months': [months['harvest_month'].get(group, []) for group in group_list],
+            'ranges': _position_ranges(groups // len(season_names), keys),
+        }
+
+        children = 0
+        if child_column is not None and child_column in kept.columns:
+            codes = kept[child_column].cat.codes.to_numpy()
+            children = len(np.unique(codes[codes >= 0]))
+        years = []
+        if 'planting_year' in kept.columns:
+            planting = kept['planting_year'].to_numpy(dtype=np.float64, na_value=np.nan)
+            years = np.unique(planting[~np.isnan(planting)]).astype(np.int64).tolist()
+        summaries[scope] = {
+            'unique_crops_count': len(keys),
+            'total_production': production.sum(),
+            'unique_children_count': children,
+            'min_planting_year': years[0] if years else None,
+            'max_planting_year': years[-1] if years else None,
+            'missing_planting_years': missing_years(years),
+        }
+
+    return {'tables': sliced, 'crops': {scope: (0, len(keys))} if keys else {}, 'summaries': summaries}
@@ -0,0 +1,261 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from aggregation import row_filter_mask
+from dataset import build_index, country_bounds, load_dataset, log_footprint, update_index
+from ingest import (DeltaError, chain_version, delta_sha256, journal_dir, journal_entries, journal_lock, merge_delta,
+                    read_delta, write_journal_entry)
+from qc import load_qc_flags, qc_row_mask
+from rollups import build_rollups, load_rollups, masked_rollups, rollups_path, run_inline, slice_rollups, update_rollups
+
+# Everything derived from one dataset file. Snapshots are never mutated:
+# a reload builds a new one and swaps the reference, so a request that
+# grabbed a snapshot keeps a consistent view until it finishes. The only
+# thing filled in later is `rollup_variants`, a memo of QC-filtered rollups.
+# `deltas` names the journaled deltas (in `journal`) applied on top of the CSV
+# and `load_report` is the validation report of the CSV's parse.
+DatasetSnapshot = namedtuple('DatasetSnapshot', ['data', 'version', 'index', 'rollups', 'path', 'loaded_at', 'qc_flags',
+                                                 'rollup_variants', 'journal', 'deltas', 'load_report'])
+
+
+def _upsert_deltas(data, version, deltas, drop_columns=()):
+    """Apply `deltas` ((name, CSV bytes) pairs) in order to `data`.
+
+    Returns the merged data, its version and one report per delta.
+    """
+    reports = []
+    for name, content in deltas:
+        delta = read_delta(content, list(data.columns), drop_columns)
+        data, report = merge_delta(data, country_bounds(data), delta)
+        reports.append({'delta': name, **report})
+        version = chain_version(version, delta_sha256(content))
+    return data, version, reports
+
+
+def _read_journal(directory, names):
+    deltas = []
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            deltas.append((name, f.read()))
+    return deltas
+
+
+def build_snapshot(csv_path, snapshot_dir, drop_columns=(), qc_path=None, load_options=None):
+    data, csv_version, load_report = load_dataset(csv_path, snapshot_dir, drop_columns, **(load_options or {}))
+    version = csv_version
+    qc_flags, qc_version = load_qc_flags(qc_path)
+    if qc_version is not None:
+        # Responses carry QC flags, so a new QC table needs new cache keys too
+        version = hashlib.sha256(f"{version}:{qc_version}".encode()).hexdigest()
+    index = build_index(data)
+    if snapshot_dir:
+        rollups = load_rollups(data, index, rollups_path(snapshot_dir, csv_path, csv_version, list(data.columns)))
+    else:
+        rollups = build_rollups(data, index)
+    journal = journal_dir(snapshot_dir, csv_path, csv_version)
+    snapshot = DatasetSnapshot(data, version, index, rollups, csv_path, time.time(), qc_flags, {}, journal, (), load_report)
+    deltas = journal_entries(journal)
+    if deltas:
+        # The persisted rollups are of the CSV; only countries the deltas touch are rebuilt
+        snapshot, reports = apply_deltas(snapshot, _read_journal(journal, deltas), drop_columns)
+        logging.info(f"Applied {len(deltas)} journaled deltas ({sum(r['rows'] for r in reports)} rows) from {journal}.")
+    log_footprint(snapshot.data)
+    return snapshot
+
+
+def empty_snapshot(csv_path=None):
+    data = pd.DataFrame()
+    index = build_index(data)
+    return DatasetSnapshot(data, 'empty', index, build_rollups(data, index), csv_path, time.time(), {}, {}, None, (), None)
+
+
+def apply_deltas(snapshot, deltas, drop_columns=()):
+    """A new snapshot with `deltas` ((name, CSV bytes) pairs) upserted into `snapshot`.
+
+    Only the countries the deltas touch get their index entries and rollups
+    rebuilt. Returns ``(snapshot, reports)``.
+    """
+    data, version, reports = _upsert_deltas(snapshot.data, snapshot.version, deltas, drop_columns)
+    countries = sorted({country for report in reports for country in report['countries']})
+    index = update_index(snapshot.index, data, countries)
+    rollups = update_rollups(snapshot.rollups, data, index, countries)
+    names = tuple(name for name, _ in deltas if name is not None)
+    return snapshot._replace(data=data, version=version, index=index, rollups=rollups, loaded_at=time.time(),
+                             rollup_variants={}, deltas=snapshot.deltas + names), reports
+
+
+def snapshot_rollups(snapshot, row_flags=frozenset(), crop_flags=frozenset(), compute=run_inline):
+    """The snapshot's rollups, leaving out QC-flagged rows and crops (see `qc_row_mask`).
+
+    Filtered rollups are built per country on first use, through
+    ``compute(fn, *args)``, and kept for the snapshot's lifetime.
+    """
+    if not row_flags and not crop_flags:
+        return snapshot.rollups
+    key = (row_flags, crop_flags)
+    rollups = snapshot.rollup_variants.get(key)
+    if rollups is None:
+        def row_mask(country_data, country):
+            return qc_row_mask(country_data, snapshot.qc_flags, country, row_flags, crop_flags)
+        rollups = snapshot.rollup_variants.setdefault(key, masked_rollups(snapshot.data, snapshot.index, row_mask, compute))
+    return rollups
+
+
+def snapshot_slice_rollups(snapshot, admin_level, scope, row_filters, layouts, row_flags=frozenset(), crop_flags=frozenset(),
+                           product=None, time_series_only=False, compute=run_inline):
+    """Rollups of one unit's records that `row_filters` and the QC filters keep (see `slice_rollups`).
+
+    Unlike `snapshot_rollups` these are made per request, since year ranges
+    and season/system lists combine in too many ways to keep. Most are
+    selections of the unit's rollup tables (with the QC filters applied).
+    """
+    def row_mask(rows):
+        return qc_row_mask(rows, snapshot.qc_flags, scope[0], row_flags, crop_flags) & row_filter_mask(rows, row_filters)
+    base = snapshot_rollups(snapshot, row_flags, crop_flags, compute)
+    return slice_rollups(snapshot.data, snapshot.index, admin_level, scope, row_mask, layouts, product, time_series_only, base,
+                         row_filters, compute)
+
+
+class DatasetStore:
+    """Holds the live snapshot and rebuilds it in the background on reload.
+
+    `before_swap` callbacks run on the freshly built snapshot before it goes
+    live (e.g. to warm caches), so switching datasets has no cold start.
+    Deltas (see `ingest`) are applied incrementally rather than by a reload.
+    """
+
+    def __init__(self, csv_path, snapshot_dir, drop_columns=(), qc_path=None, load_options=None):
+        self.csv_path = csv_path
+        self.snapshot_dir = snapshot_dir
+        self.drop_columns = tuple(drop_columns)
+        self.qc_path = qc_path
+        # Keyword arguments for `load_dataset`, e.g. parse processes
+        self.load_options = dict(load_options or {})
+        self.before_swap = []
+        self.after_swap = []
+        self._current = empty_snapshot(csv_path)
+        self._reload_lock = threading.Lock()
+        self.status = {'state': 'idle', 'error': None, 'report': None, 'started_at': None, 'finished_at': None}
+
+    def current(self):
+        return self._current
+
+    def load(self, csv_path=None):
+        """Build a snapshot of `csv_path` (default: the current file) and swap it in."""
+        csv_path = csv_path or self.csv_path
+        snapshot = build_snapshot(csv_path, self.snapshot_dir, self.drop_columns, self.qc_path, self.load_options)
+        self._swap(snapshot)
+        self.csv_path = csv_path
+        return snapshot
+
+    def _swap(self, snapshot):
+        for callback in self.before_swap:
+            callback(snapshot)
+        previous, self._current = self._current, snapshot
+        for callback in self.after_swap:
+            callback(snapshot, previous)
+
+    def ingest(self, content):
+        """Validate a delta CSV (bytes), apply it to the live snapshot and journal it.
+
+        Waits for a running reload to finish first. Deltas other processes
+        journaled in the meantime are applied before this one. Returns the
+        report of this delta; raises `DeltaError` if it is invalid.
+        """
+        with self._reload_lock:
+            current = self._current
+            if current.data.empty:
+                raise DeltaError(["No dataset is loaded to apply the delta to"])
+            # Validate before anything is written
+            read_delta(content, list(current.data.columns), self.drop_columns)
+            started = time.perf_counter()
+            if current.journal is None:
+                logging.warning("No snapshot directory to journal the delta in; it will be lost on restart.")
+                snapshot, reports = apply_deltas(current, [(None, content)], self.drop_columns)
+                name = None
+            else:
+                with journal_lock(current.journal):
+                    pending = [n for n in journal_entries(current.journal) if n not in current.deltas]
+                    # Journal only a delta that applies: replays must not fail on restart
+                    snapshot, reports = apply_deltas(current, _read_journal(current.journal, pending) + [(None, content)],
+                                                     self.drop_columns)
+                    name = write_journal_entry(current.journal, content)
+                snapshot = snapshot._replace(deltas=snapshot.deltas + (name,))
+            self._swap(snapshot)
+            report = {**reports[-1], 'seconds': round(time.perf_counter() - started, 3), 'version': snapshot.version}
+            logging.info(f"Ingested delta {name}: {report['corrected']} corrected and {report['added']} added rows "
+                         f"for {', '.join(report['countries'])} in {report['seconds']}s.")
+            return report
+
+    def sync_deltas(self):
+        """Apply deltas journaled by other processes. Returns how many were applied."""
+        if not self._reload_lock.acquire(blocking=False):
+            return 0
+        try:
+            current = self._current
+            pending = [n for n in journal_entries(current.journal) if n not in current.deltas]
+            if not pending:
+                return 0
+            snapshot, reports = apply_deltas(current, _read_journal(current.journal, pending), self.drop_columns)
+            self._swap(snapshot)
+            logging.info(f"Applied {len(pending)} journaled deltas for {', '.join(sorted({c for r in reports for c in r['countries']}))}.")
+            return len(pending)
+        except Exception as e:
+            logging.error(f"Applying journaled deltas failed, keeping version {self._current.version[:12]}: {e}")
+            return 0
+        finally:
+            self._reload_lock.release()
+
+    def reload_in_background(self, csv_path=None):
+        """Start a background reload. Returns False if one is already running."""
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        self.status = {'state': 'running', 'error': None, 'report': None, 'started_at': time.time(), 'finished_at': None}
+        thread = threading.Thread(target=self._reload, args=(csv_path,), name='dataset-reload', daemon=True)
+        thread.start()
+        return True
+
+    def _reload(self, csv_path):
+        try:
+            snapshot = self.load(csv_path)
+            logging.info(f"Reloaded dataset {snapshot.path} (version {snapshot.version[:12]}, {len(snapshot.data)} rows).")
+            self.status = {**self.status, 'state': 'idle', 'finished_at': time.time()}
+        except Exception as e:
+            # Keep serving the previous snapshot
+            logging.error(f"Dataset reload failed, keeping version {self._current.version[:12]}: {e}")
+            self.status = {**self.status, 'state': 'failed', 'error': str(e), 'report': getattr(e, 'report', None),
+                           'finished_at': time.time()}
+        finally:
+            self._reload_lock.release()
+
+    def watch(self, interval):
+        """Poll the dataset file every `interval` seconds and reload when it changes."""
+        def file_signature():
+            try:
+                stat = os.stat(self.csv_path)
+            except OSError:
+                return None
+            return self.csv_path, stat.st_size, stat.st_mtime_ns
+
+        def poll():
+            last = file_signature()
+            while True:
+                time.sleep(interval)
+                signature = file_signature()
+                # A changed path means a reload switched files, not that the file changed
+                if signature is not None and last is not None and signature[0] == last[0] and signature != last:
+                    logging.info(f"Detected a change to {self.csv_path}, reloading.")
+                    self.reload_in_background()
+                elif len(journal_entries(self._current.journal)) > len(self._current.deltas):
+                    self.sync_deltas()
+                last = signature
+
+        thread = threading.Thread(target=poll, name='dataset-watch', daemon=True)
+        thread.start()
+        return thread
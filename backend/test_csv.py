@@ -6,14 +6,14 @@ try:
     print(f"CSV loaded successfully. Shape: {data.shape}")
     print(f"Columns: {data.columns.tolist()}")
     
-    if 'Country' in data.columns:
-        print(f"Country column found!")
-        print(f"First 5 Country values: {data['Country'].head().tolist()}")
-        unique_countries = data['Country'].dropna().unique()
+    if 'country' in data.columns:
+        print(f"country column found!")
+        print(f"First 5 Country values: {data['country'].head().tolist()}")
+        unique_countries = data['country'].dropna().unique()
         print(f"Number of unique countries: {len(unique_countries)}")
         print(f"Unique countries: {sorted(unique_countries.tolist())}")
     else:
-        print("No 'Country' column found!")
+        print("No 'country' column found!")
         print("Available columns:", data.columns.tolist())
         
 except Exception as e:
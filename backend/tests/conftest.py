@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.synthetic import generate  # noqa: E402
+from store import DatasetStore  # noqa: E402
+
+# A few countries at both admin resolutions keep the suite quick
+TEST_COUNTRIES = ['Benin', 'Kenya', 'Togo']
+
+
+@pytest.fixture(scope='session')
+def csv_path(tmp_path_factory):
+    """A small synthetic dataset with the published schema."""
+    data = generate(20000, seed=1)
+    data = data[data['country'].isin(TEST_COUNTRIES)].reset_index(drop=True)
+    # Published files have the odd record without a harvest year or production system
+    kenya = data.index[data['country'] == 'Kenya']
+    data.loc[kenya[5::200], 'harvest_year'] = None
+    data.loc[kenya[7::20], 'crop_production_system'] = None
+    path = tmp_path_factory.mktemp('data') / 'hvstat_test.csv'
+    data.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def store(csv_path, tmp_path):
+    """A loaded `DatasetStore` with its own snapshot directory (and journal)."""
+    store = DatasetStore(csv_path, str(tmp_path / 'snapshots'))
+    store.load()
+    return store
+
+
+@pytest.fixture(scope='session')
+def app_module(csv_path, tmp_path_factory):
+    """The Flask app module serving the test dataset, without QC flags or worker processes."""
+    os.environ.update({
+        'HVSTAT_DATA_PATH': csv_path,
+        'HVSTAT_SNAPSHOT_DIR': str(tmp_path_factory.mktemp('app-snapshots')),
+        'HVSTAT_QC_PATH': '',
+        'HVSTAT_COMPUTE_PROCESSES': '0',
+    })
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
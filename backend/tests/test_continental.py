@@ -0,0 +1,73 @@
+import pytest
+
+
+def _oracle(data, countries, crop_name=None, season_name=None):
+    """Per-country totals and yearly production of the selected records, from pandas."""
+    rows = data[data['country'].isin(countries)]
+    if crop_name is not None:
+        rows = rows[rows['product'] == crop_name]
+    if season_name is not None:
+        rows = rows[rows['season_name'] == season_name]
+    expected = {}
+    for country, country_rows in rows.groupby('country', observed=True):
+        yearly = country_rows.groupby('harvest_year')['production'].sum()
+        expected[country] = {
+            'total_production': country_rows['production'].sum(),
+            'total_area_harvested': country_rows['area'].sum(),
+            'undated_production': country_rows.loc[country_rows['harvest_year'].isna(), 'production'].sum(),
+            'time_series': {int(year): production for year, production in yearly.items()},
+        }
+    return expected
+
+
+def _selections(data):
+    kenya = data[data['country'] == 'Kenya']
+    return [
+        {'crop_name': data['product'].value_counts().index[0]},
+        {'season_name': kenya['season_name'].value_counts().index[0]},
+        {'season_name': kenya['season_name'].value_counts().index[0], 'crop_name': kenya['product'].value_counts().index[0]},
+        {'crop_name': kenya['product'].value_counts().index[0], 'country': ['Kenya', 'Togo']},
+    ]
+
+
+@pytest.mark.parametrize('selection', range(4))
+def test_continental_matches_pandas(client, app_module, selection):
+    data = app_module.store.current().data
+    query = _selections(data)[selection]
+    body = client.get('/api/continental', query_string=query).get_json()
+    countries = query.get('country', sorted(data['country'].unique()))
+    expected = _oracle(data, countries, query.get('crop_name'), query.get('season_name'))
+    assert set(body['countries']) == set(expected)
+
+    for country, result in body['countries'].items():
+        oracle = expected[country]
+        assert result['total_production'] == pytest.approx(oracle['total_production'])
+        assert result['total_area_harvested'] == pytest.approx(oracle['total_area_harvested'])
+        series = {point['year']: point['production'] for point in result['time_series']}
+        assert series == pytest.approx(oracle['time_series'])
+        # Records without a harvest year are in the totals but in no year
+        assert result['total_production'] == pytest.approx(sum(series.values()) + oracle['undated_production'])
+
+    total = body['total']
+    assert total['countries_count'] == len(expected)
+    assert total['total_production'] == pytest.approx(sum(oracle['total_production'] for oracle in expected.values()))
+    combined = {}
+    for oracle in expected.values():
+        for year, production in oracle['time_series'].items():
+            combined[year] = combined.get(year, 0) + production
+    assert {point['year']: point['production'] for point in total['time_series']} == pytest.approx(combined)
+
+
+def test_continental_season_counts_records_without_a_production_system(client, app_module):
+    data = app_module.store.current().data
+    kenya = data[data['country'] == 'Kenya']
+    season = kenya.loc[kenya['crop_production_system'].isna(), 'season_name'].iloc[0]
+    result = client.get('/api/continental', query_string={'season_name': season, 'country': 'Kenya'}).get_json()['countries']['Kenya']
+    dated = kenya[(kenya['season_name'] == season) & kenya['harvest_year'].notna()]
+    assert sum(point['production'] for point in result['time_series']) == pytest.approx(dated['production'].sum())
+
+
+def test_continental_validates_its_parameters(client):
+    assert client.get('/api/continental').status_code == 400
+    assert client.get('/api/continental', query_string={'crop_name': 'Maize', 'country': 'Atlantis'}).status_code == 404
+    assert client.get('/api/continental', query_string={'crop_name': 'Moonbeans'}).status_code == 404
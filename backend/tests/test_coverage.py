@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from coverage import COVERAGE_COLUMNS, build_country_coverage, emit_coverage, group_coverage
+
+GROUPINGS = [list(COVERAGE_COLUMNS), ['product'], ['admin_1', 'season_name'], []]
+
+
+def _expected(country_data, group_by):
+    """Covered harvest years of every `group_by` series, from pandas."""
+    covered = country_data[country_data['harvest_year'].notna() &
+                           (country_data['production'].notna() | country_data['area'].notna())]
+    if not group_by:
+        return {(): set(covered['harvest_year'].astype(int))} if len(covered) else {}
+    years = covered.groupby(group_by, observed=True, dropna=False)['harvest_year'].agg(lambda values: set(values.astype(int)))
+    return {tuple(None if pd.isna(value) else value for value in (key if isinstance(key, tuple) else (key,))): value
+            for key, value in years.items()}
+
+
+def _rows_by_key(rows, group_by):
+    return {tuple(row[col] for col in group_by): row for row in rows}
+
+
+def _assert_rows_match(rows, matrix, years, expected, group_by):
+    by_key = _rows_by_key(rows, group_by)
+    assert set(by_key) == set(expected)
+    for key, covered in expected.items():
+        row = by_key[key]
+        first, last = min(covered), max(covered)
+        assert row['years_count'] == len(covered)
+        assert (row['first_year'], row['last_year']) == (first, last)
+        assert row['missing_years'] == [year for year in range(first, last + 1) if year not in covered]
+    for row, bits in zip(rows, matrix):
+        key = tuple(row[col] for col in group_by)
+        assert [year for year, bit in zip(years, bits) if bit] == sorted(expected[key])
+
+
+@pytest.mark.parametrize('group_by', GROUPINGS)
+def test_gaps_match_series_year_sets(store, group_by):
+    data = store.current().data
+    groups = {}
+    expected = {}
+    for country in sorted(data['country'].unique()):
+        country_data = data[data['country'] == country]
+        groups[country] = group_coverage(build_country_coverage(country_data), group_by)
+        expected[country] = _expected(country_data, group_by)
+    emitted = emit_coverage(groups, group_by)
+
+    all_years = set().union(*(years for series in expected.values() for years in series.values()))
+    assert emitted['years'] == list(range(min(all_years), max(all_years) + 1))
+    for country, series in expected.items():
+        result = emitted['countries'][country]
+        _assert_rows_match(result['rows'], result['matrix'], emitted['years'], series, group_by)
+
+
+def test_coverage_ignores_uncovered_and_out_of_range_years():
+    country_data = pd.DataFrame({
+        'admin_1': ['A', 'A', 'A', 'A', 'B'],
+        'admin_2': [None, None, None, None, None],
+        'product': ['Maize'] * 5,
+        'season_name': ['Main'] * 5,
+        'harvest_year': pd.array([2000, 2003, 2001, 1900, 2001], dtype='Int16'),
+        'production': [1.0, np.nan, 2.0, 3.0, np.nan],
+        'area': [np.nan, 5.0, np.nan, 4.0, np.nan],
+    })
+    keys, masks = group_coverage(build_country_coverage(country_data), ['admin_1'])
+    # B has no production or area, 1900 is before the mask's first year
+    assert keys == [('A',)]
+    rows = emit_coverage({'X': (keys, masks)}, ['admin_1'])['countries']['X']['rows']
+    assert rows == [{'admin_1': 'A', 'years_count': 3, 'first_year': 2000, 'last_year': 2003, 'missing_years': [2002]}]
+
+
+def test_coverage_endpoint_matches_series_year_sets(client, store):
+    data = store.current().data
+    product = data['product'].value_counts().index[0]
+    response = client.get('/api/coverage', query_string={'group_by': 'admin_1,product', 'crop_name': product})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['group_by'] == ['admin_1', 'product']
+    for country, result in body['countries'].items():
+        country_data = data[(data['country'] == country) & (data['product'] == product)]
+        _assert_rows_match(result['rows'], result['matrix'], body['years'],
+                           _expected(country_data, ['admin_1', 'product']), ['admin_1', 'product'])
+
+
+def test_coverage_endpoint_rejects_unknown_columns(client):
+    assert client.get('/api/coverage', query_string={'group_by': 'fnid'}).status_code == 400
+    assert client.get('/api/coverage', query_string={'country': 'Atlantis'}).status_code == 404
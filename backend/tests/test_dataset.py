@@ -0,0 +1,42 @@
+import io
+
+import pandas as pd
+import pytest
+
+import dataset
+from dataset import _chunk_ranges, read_csv_dataset
+
+
+@pytest.fixture
+def multiline_csv(csv_path, tmp_path):
+    """The test dataset with a last column of quoted names (with escaped quotes) that end on a second line."""
+    data = pd.read_csv(csv_path)
+    data['admin_2'] = data['admin_2'] + ' "North"\nzone'
+    path = tmp_path / 'multiline.csv'
+    # Most of each record comes before the line break inside it
+    data[[col for col in data.columns if col != 'admin_2'] + ['admin_2']].to_csv(path, index=False)
+    return str(path)
+
+
+def test_chunks_start_at_records(multiline_csv):
+    size = len(open(multiline_csv, 'rb').read())
+    whole = pd.read_csv(multiline_csv)
+    ranges = _chunk_ranges(multiline_csv, size, 16)
+    assert len(ranges) > 1
+    with open(multiline_csv, 'rb') as f:
+        header = f.readline()
+        raw = f.read()
+    pieces = [pd.read_csv(io.BytesIO(header + raw[start - len(header):stop - len(header)])) for start, stop in ranges]
+    pd.testing.assert_frame_equal(pd.concat(pieces, ignore_index=True), whole)
+
+
+def test_parallel_parse_keeps_multiline_fields(multiline_csv, monkeypatch):
+    expected, expected_report = read_csv_dataset(multiline_csv, processes=1)
+    monkeypatch.setattr(dataset, 'PARALLEL_MIN_BYTES', 0)
+    monkeypatch.setattr(dataset, 'CHUNK_MIN_BYTES', 1 << 14)
+    data, report = read_csv_dataset(multiline_csv, processes=4)
+    assert report['chunks'] > 1
+    assert not any(entry['invalid'] for entry in report['columns'].values())
+    assert report['columns'] == expected_report['columns']
+    pd.testing.assert_frame_equal(data, expected)
+    assert data['admin_2'].dropna().astype(str).str.endswith(' "North"\nzone').all()
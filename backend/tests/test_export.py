@@ -0,0 +1,80 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregation import RowFilters
+from export import export_chunks, stream_export
+
+MEASURES = ['area', 'production', 'yield']
+
+
+def _export(store, fmt, row_filters=RowFilters()):
+    snapshot = store.current()
+    countries = snapshot.data['country'].cat.categories.tolist()
+    chunks = export_chunks(snapshot.data, snapshot.index, countries, row_filters=row_filters, chunk_rows=500)
+    body = b''.join(part if isinstance(part, bytes) else part.encode() for part in stream_export(fmt, chunks, snapshot.data))
+    return snapshot.data, body
+
+
+def _assert_same_records(exported, data):
+    assert list(exported.columns) == list(data.columns)
+    assert len(exported) == len(data)
+    for col in MEASURES:
+        # Bit for bit: every float survives the round trip
+        assert np.array_equal(exported[col].to_numpy(dtype=np.float64), data[col].to_numpy(dtype=np.float64), equal_nan=True)
+    for col in ['country', 'admin_2', 'product', 'harvest_year', 'planting_month']:
+        expected = data[col].astype(object).where(data[col].notna(), None).tolist()
+        assert exported[col].astype(object).where(exported[col].notna(), None).tolist() == expected
+
+
+def test_csv_export_round_trips(store):
+    data, body = _export(store, 'csv')
+    _assert_same_records(pd.read_csv(io.BytesIO(body), float_precision='round_trip'), data)
+
+
+def test_ndjson_export_round_trips(store):
+    data, body = _export(store, 'ndjson')
+    records = [json.loads(line) for line in body.decode().splitlines()]
+    assert list(records[0]) == list(data.columns)
+    _assert_same_records(pd.DataFrame.from_records(records, columns=list(data.columns)), data)
+
+
+def test_ndjson_writes_missing_values_as_null(store):
+    _, body = _export(store, 'ndjson')
+    assert b'NaN' not in body
+    assert any(json.loads(line)['admin_2'] is None for line in body.decode().splitlines())
+
+
+def _read(fmt, body, data):
+    if fmt == 'csv':
+        return pd.read_csv(io.BytesIO(body), float_precision='round_trip')
+    return pd.DataFrame.from_records([json.loads(line) for line in body.decode().splitlines()], columns=list(data.columns))
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_export_filters_by_harvest_year(store, fmt):
+    data, body = _export(store, fmt, RowFilters(2000, 2005))
+    assert data['harvest_year'].isna().any()
+    # Records without a harvest year are outside every year range
+    expected = data[((data['harvest_year'] >= 2000) & (data['harvest_year'] <= 2005)).fillna(False)].reset_index(drop=True)
+    _assert_same_records(_read(fmt, body, data), expected)
+
+
+def test_export_endpoint_filters_by_harvest_year(client, app_module):
+    data = app_module.store.current().data
+    country = data.loc[data['harvest_year'].isna(), 'country'].iloc[0]
+    response = client.get('/api/export', query_string={'country': country, 'year_from': 2000, 'format': 'ndjson'})
+    assert response.status_code == 200
+    rows = data[data['country'] == country]
+    expected = rows[(rows['harvest_year'] >= 2000).fillna(False)].reset_index(drop=True)
+    _assert_same_records(_read('ndjson', response.get_data(), data), expected)
+
+
+@pytest.mark.parametrize('query', [{'year_from': 2005, 'year_to': 2000}, {'year_to': 'recent'}])
+def test_export_endpoint_rejects_bad_year_ranges(client, query):
+    response = client.get('/api/export', query_string=query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+import store as store_module
+from ingest import DeltaError, journal_entries, read_delta
+from store import DatasetStore
+
+
+def _delta(store, **values):
+    """A one-row delta CSV correcting the first record, with `values` changed."""
+    row = store.current().data.iloc[[0]].astype(object).copy()
+    for col, value in values.items():
+        row[col] = value
+    return row.to_csv(index=False).encode()
+
+
+def test_ingest_corrects_and_journals(store):
+    before = len(store.current().data)
+    report = store.ingest(_delta(store, production=123.5))
+    snapshot = store.current()
+    assert (report['corrected'], report['added']) == (1, 0)
+    assert len(snapshot.data) == before
+    assert snapshot.data['production'].iloc[0] == 123.5
+    assert journal_entries(snapshot.journal) == list(snapshot.deltas)
+
+
+def test_rejected_delta_leaves_journal_unchanged(store, csv_path):
+    store.ingest(_delta(store, production=1.0))
+    journal, entries, version = store.current().journal, journal_entries(store.current().journal), store.current().version
+    with pytest.raises(DeltaError, match='harvest_year'):
+        store.ingest(_delta(store, harvest_year=70000))
+    assert journal_entries(journal) == entries
+    assert store.current().version == version
+
+    # A restart replays the journal as before
+    restarted = DatasetStore(csv_path, store.snapshot_dir)
+    assert len(restarted.load().data) == len(store.current().data)
+    assert restarted.current().version == version
+
+
+def test_delta_failing_to_apply_is_not_journaled(store, monkeypatch):
+    def fail(*args, **kwargs):
+        raise DeltaError(["does not fit"])
+    monkeypatch.setattr(store_module, 'apply_deltas', fail)
+    journal = store.current().journal
+    with pytest.raises(DeltaError):
+        store.ingest(_delta(store, production=2.0))
+    assert journal_entries(journal) == []
+
+
+@pytest.mark.parametrize('col, value', [('harvest_year', 70000), ('harvest_year', 2001.5), ('planting_year', -40000),
+                                        ('harvest_month', 13), ('qc_flag', 3)])
+def test_read_delta_rejects_values_outside_compact_dtypes(store, col, value):
+    with pytest.raises(DeltaError, match=col):
+        read_delta(_delta(store, **{col: value}), list(store.current().data.columns))
+
+
+def test_read_delta_returns_compact_dtypes(store):
+    delta = read_delta(_delta(store), list(store.current().data.columns))
+    assert delta['harvest_year'].dtype == pd.Int16Dtype()
+    assert delta['harvest_month'].dtype == pd.Int8Dtype()
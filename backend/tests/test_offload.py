@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from offload import ComputePool, PoolBusy
+
+
+def _square(value):
+    return value * value
+
+
+def test_inline_pool_runs_on_the_calling_thread():
+    pool = ComputePool(0)
+    pool.start()
+    assert pool.run(5, threading.get_ident) == threading.get_ident()
+    assert pool._executor is None
+    assert pool.completed == 1
+
+
+def test_pool_runs_tasks_in_worker_processes():
+    pool = ComputePool(1)
+    try:
+        pool.start()
+        assert pool.run(30, _square, 7) == 49
+    finally:
+        pool.shutdown()
+
+
+def test_pool_forks_only_while_single_threaded():
+    release = threading.Event()
+    thread = threading.Thread(target=release.wait)
+    assert ComputePool._context().get_start_method() == ('fork' if threading.active_count() == 1 else 'forkserver')
+    thread.start()
+    try:
+        assert ComputePool._context().get_start_method() != 'fork'
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_full_pool_rejects_tasks():
+    pool = ComputePool(0, max_pending=1, queue_timeout=0.01)
+    entered, release = threading.Event(), threading.Event()
+
+    def block():
+        entered.set()
+        release.wait()
+
+    thread = threading.Thread(target=pool.run, args=(5, block))
+    thread.start()
+    entered.wait()
+    try:
+        with pytest.raises(PoolBusy):
+            pool.run(5, _square, 2)
+        assert pool.rejected == 1
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_busy_pool_waits_for_a_slot_within_the_queue_timeout():
+    pool = ComputePool(0, max_pending=1, queue_timeout=5)
+    entered = threading.Event()
+
+    def hold():
+        entered.set()
+        time.sleep(0.2)
+
+    thread = threading.Thread(target=pool.run, args=(5, hold))
+    thread.start()
+    entered.wait()
+    try:
+        assert pool.run(5, _square, 3) == 9
+        assert pool.rejected == 0
+    finally:
+        thread.join()
@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+
+from aggregation import calculate_crop_details
+from dataset import build_index
+from rollups import SCOPE_COLUMNS, build_rollups, rollup_crops_summary, rollup_summary, rollups_path
+from serialization import dumps
+from store import DatasetStore, build_snapshot
+
+LAYOUTS = [(0, False), (0, True), (1, False), (2, False)]
+
+
+def _units(data, admin_level):
+    return [tuple(key) for key in data[SCOPE_COLUMNS[admin_level]].dropna().drop_duplicates().itertuples(index=False)]
+
+
+def _responses(rollups, data):
+    """Everything the rollups answer for every unit, as JSON bytes."""
+    responses = []
+    for admin_level in SCOPE_COLUMNS:
+        for scope in _units(data, admin_level):
+            responses.append([rollup_summary(rollups, admin_level, scope)] +
+                             [rollup_crops_summary(rollups, admin_level, scope, *layout) for layout in LAYOUTS])
+    return dumps(responses)
+
+
+@pytest.mark.parametrize('admin_level', [0, 1, 2])
+def test_rollups_match_calculate_crop_details(store, admin_level):
+    snapshot = store.current()
+    data = snapshot.data
+    units = _units(data, admin_level)
+    assert units
+    for scope in units[:6]:
+        rows = data
+        for col, value in zip(SCOPE_COLUMNS[admin_level], scope):
+            rows = rows[rows[col] == value]
+        for timeseries_admin_level, split in LAYOUTS:
+            expected = {product: calculate_crop_details(rows[rows['product'] == product], None, timeseries_admin_level, split)
+                        for product in sorted(rows['product'].unique())}
+            actual = rollup_crops_summary(snapshot.rollups, admin_level, scope, timeseries_admin_level, split)
+            # Byte-identical responses, as the pre-rollup endpoints served
+            assert dumps(actual) == dumps(expected)
+
+
+def test_rollups_match_the_baseline_responses(store):
+    # Frozen output of the per-request calculate_crop_details and unit totals
+    # that served these endpoints before the rollups (the first commit's
+    # app.py), for the conftest data; regenerate it if that data changes
+    with open(os.path.join(os.path.dirname(__file__), 'data', 'baseline_crop_details.json')) as f:
+        baseline = json.load(f)
+    rollups = store.current().rollups
+    for entry in baseline:
+        admin_level, scope = entry['admin_level'], tuple(entry['scope'])
+        assert rollup_summary(rollups, admin_level, scope)['total_production'] == entry['total_production'], scope
+        for layout, expected in entry['crops'].items():
+            timeseries_admin_level, split = layout.split('-')
+            actual = rollup_crops_summary(rollups, admin_level, scope, int(timeseries_admin_level), split == '1')
+            # Same values to the last bit; months were floats in the baseline (1.0, not 1)
+            assert json.loads(dumps(actual)) == json.loads(dumps(expected)), (scope, layout)
+
+
+def test_rollup_totals_match_pandas(store):
+    snapshot = store.current()
+    data = snapshot.data
+    totals = data.groupby(['country', 'admin_1'], observed=True)['production'].sum()
+    for (country, admin_1), production in totals.items():
+        summary = rollup_summary(snapshot.rollups, 1, (country, admin_1))
+        assert summary['total_production'] == pytest.approx(production)
+        assert summary['unique_crops_count'] == data[(data['country'] == country) & (data['admin_1'] == admin_1)]['product'].nunique()
+
+
+def test_rollups_are_persisted_and_read_back(csv_path, tmp_path, caplog):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    first = build_snapshot(csv_path, snapshot_dir)
+    path = rollups_path(snapshot_dir, csv_path, first.version, list(first.data.columns))
+    assert os.path.exists(path)
+
+    caplog.set_level('INFO')
+    second = build_snapshot(csv_path, snapshot_dir)
+    assert 'Built rollups' not in caplog.text
+    assert _responses(second.rollups, second.data) == _responses(first.rollups, first.data)
+
+
+def test_persisted_rollups_are_keyed_by_columns(csv_path, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    full = build_snapshot(csv_path, snapshot_dir)
+    dropped = build_snapshot(csv_path, snapshot_dir, drop_columns=('qc_flag',))
+    assert 'qc_flag' not in dropped.rollups['columns']
+    assert rollups_path(snapshot_dir, csv_path, full.version, list(full.data.columns)) != \
+        rollups_path(snapshot_dir, csv_path, dropped.version, list(dropped.data.columns))
+
+
+def test_journaled_deltas_update_persisted_rollups_at_start(store, csv_path):
+    row = store.current().data.iloc[[0]].astype(object).copy()
+    row['production'] = 1e9
+    store.ingest(row.to_csv(index=False).encode())
+
+    restarted = DatasetStore(csv_path, store.snapshot_dir)
+    snapshot = restarted.load()
+    assert snapshot.version == store.current().version
+    fresh = build_rollups(snapshot.data, build_index(snapshot.data))
+    assert _responses(snapshot.rollups, snapshot.data) == _responses(fresh, snapshot.data)
+    country = row['country'].iloc[0]
+    assert rollup_summary(snapshot.rollups, 0, (country,))['total_production'] >= 1e9
@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture(scope='module')
+def crop_query(app_module):
+    """A country and crop with several admin 1 series, as /api/crop-timeseries parameters."""
+    data = app_module.store.current().data
+    counts = data.groupby(['country', 'product'], observed=True)['admin_1'].nunique()
+    country, product = counts.idxmax()
+    assert counts.max() >= 3
+    return {'country': country, 'crop_name': product, 'admin_level': 0, 'timeseries_admin_level': 1}
+
+
+def _series_totals(series):
+    return sum(point['production'] for point in series['data'] if point['production'] is not None)
+
+
+def test_cursor_pages_cover_every_series_once(client, crop_query):
+    everything = client.get('/api/crop-timeseries', query_string=crop_query).get_json()['time_series_data']
+    pages = []
+    cursor = None
+    while True:
+        query = {**crop_query, 'series_limit': 2, **({'series_cursor': cursor} if cursor else {})}
+        body = client.get('/api/crop-timeseries', query_string=query).get_json()
+        assert body['time_series_count'] == len(everything)
+        assert len(body['time_series_data']) <= 2
+        pages.extend(body['time_series_data'])
+        cursor = body['next_series_cursor']
+        if cursor is None:
+            break
+    assert pages == everything
+
+
+def test_top_n_keeps_the_largest_series(client, crop_query):
+    everything = client.get('/api/crop-timeseries', query_string=crop_query).get_json()['time_series_data']
+    body = client.get('/api/crop-timeseries', query_string={**crop_query, 'top_n': 2}).get_json()
+    totals = sorted((_series_totals(series) for series in everything), reverse=True)
+    assert body['time_series_count'] == 2
+    assert [_series_totals(series) for series in body['time_series_data']] == pytest.approx(totals[:2])
+    assert body['next_series_cursor'] is None
+
+
+def test_fields_project_points(client, crop_query):
+    body = client.get('/api/crop-timeseries', query_string={**crop_query, 'fields': 'yield'}).get_json()
+    points = [point for series in body['time_series_data'] for point in series['data']]
+    assert points and all(set(point) == {'year', 'yield'} for point in points)
+
+
+@pytest.mark.parametrize('params', [
+    {'series_limit': 0},
+    {'series_limit': 'ten'},
+    {'top_n': -1},
+    {'series_cursor': 'abc'},
+    {'series_cursor': -2},
+    {'fields': 'production,colour'},
+    {'fields': ','},
+])
+def test_invalid_series_options_are_rejected(client, crop_query, params):
+    response = client.get('/api/crop-timeseries', query_string={**crop_query, **params})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,143 @@
+import math
+
+import pytest
+
+from aggregation import ALL_SERIES, RowFilters, SeriesOptions, row_filter_mask, time_series_layout
+from dataset import row_positions
+from rollups import SCOPE_CHILD_COLUMN, rollup_crops_summary, rollup_summary, slice_rollups
+from slices import table_slice_level
+
+FILTERS = [
+    RowFilters(2000, 2010),
+    RowFilters(None, 1990),
+    RowFilters(2005, 2006, ('Long',)),
+    RowFilters(seasons=('Long', 'Short')),
+    RowFilters(production_systems=('rainfed',)),
+    RowFilters(1995, None, (), ('irrigated', 'rainfed')),
+    RowFilters(3000, None),
+]
+LAYOUTS = [(0, False), (0, True), (1, False), (2, False)]
+
+
+def _assert_close(actual, expected, path=''):
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected), path
+        for key in expected:
+            _assert_close(actual[key], expected[key], f"{path}/{key}")
+    elif isinstance(expected, (list, tuple)):
+        assert len(actual) == len(expected), path
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            _assert_close(a, e, f"{path}[{i}]")
+    elif isinstance(expected, float) and math.isnan(expected):
+        # e.g. a missing production system in a season's list
+        assert isinstance(actual, float) and math.isnan(actual), path
+    elif isinstance(expected, float):
+        # Sums of table rows and of records differ in rounding only
+        assert math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-6), path
+    else:
+        assert actual == expected, path
+
+
+def _scopes(data):
+    country = 'Benin'
+    admin_1 = data.loc[data['country'] == country, 'admin_1'].iloc[0]
+    admin_2 = data.loc[(data['country'] == country) & (data['admin_1'] == admin_1), 'admin_2'].iloc[0]
+    return [(0, ('Kenya',)), (0, (country,)), (1, (country, admin_1)), (2, (country, admin_1, admin_2))]
+
+
+@pytest.mark.parametrize('row_filters', FILTERS)
+def test_slices_from_tables_match_aggregating_rows(store, row_filters):
+    snapshot = store.current()
+    data = snapshot.data
+    for admin_level, scope in _scopes(data):
+        for timeseries_admin_level, split in LAYOUTS:
+            layout = time_series_layout(data.columns, timeseries_admin_level, split)
+            def row_mask(rows):
+                return row_filter_mask(rows, row_filters)
+            from_tables = slice_rollups(data, snapshot.index, admin_level, scope, row_mask, [layout], base=snapshot.rollups,
+                                        row_filters=row_filters)
+            from_rows = slice_rollups(data, snapshot.index, admin_level, scope, row_mask, [layout])
+            for options in (ALL_SERIES, SeriesOptions(top_n=3, limit=2)):
+                expected = (rollup_summary(from_rows, admin_level, scope),
+                            rollup_crops_summary(from_rows, admin_level, scope, timeseries_admin_level, split, options))
+                actual = (rollup_summary(from_tables, admin_level, scope),
+                          rollup_crops_summary(from_tables, admin_level, scope, timeseries_admin_level, split, options))
+                _assert_close(actual, expected, f"{scope} {timeseries_admin_level} {split}")
+
+
+@pytest.mark.parametrize('row_filters, layout, expressible', [
+    (RowFilters(2000, 2010), 'admin_2', True),
+    (RowFilters(seasons=('Long',)), 'split', True),
+    (RowFilters(seasons=('Long',)), 'admin_1', False),
+])
+def test_slices_are_read_from_tables_where_they_can_be(store, row_filters, layout, expressible):
+    snapshot = store.current()
+    rows = snapshot.data.iloc[row_positions(snapshot.index, 'Benin')]
+    level = table_slice_level(snapshot.rollups['countries']['Benin'][0], rows, row_filter_mask(rows, row_filters), 0, ('Benin',),
+                              SCOPE_CHILD_COLUMN[0], row_filters, [layout])
+    assert (level is not None) == expressible
+
+
+def test_filtered_totals_match_pandas(client, app_module):
+    data = app_module.store.current().data
+    seasons = data.loc[data['country'] == 'Benin', 'season_name'].value_counts().index[:2].tolist()
+    response = client.get('/api/data', query_string={'country': 'Benin', 'admin_level': 0, 'year_from': 2000, 'year_to': 2010,
+                                                     'season_name': seasons})
+    assert response.status_code == 200
+    body = response.get_json()
+    rows = data[(data['country'] == 'Benin') & data['harvest_year'].between(2000, 2010) & data['season_name'].isin(seasons)]
+    assert len(rows)
+    totals = rows.groupby('product', observed=True)[['production', 'area']].sum()
+    assert sorted(body['crops_summary']) == sorted(totals.index)
+    for product, (production, area) in totals.iterrows():
+        crop = body['crops_summary'][product]
+        assert crop['total_production'] == pytest.approx(production)
+        assert crop['total_area_harvested'] == pytest.approx(area)
+        yearly = rows[rows['product'] == product].groupby('harvest_year')['production'].sum()
+        points = crop['time_series_data'][0]['data']
+        assert [point['year'] for point in points] == yearly.index.tolist()
+        assert [point['production'] for point in points] == pytest.approx(yearly.tolist())
+        by_season = rows[rows['product'] == product].groupby('season_name', observed=True)['production'].sum()
+        breakdown = crop['season_specific_breakdown']
+        assert [season['season_name'] for season in breakdown] == by_season.index.tolist()
+        assert [season['production_absolute'] for season in breakdown] == pytest.approx(by_season.tolist())
+    assert body['total_national_production'] == pytest.approx(rows['production'].sum())
+    assert body['unique_crops_count'] == rows['product'].nunique()
+    assert body['unique_admin_1_units_count'] == rows['admin_1'].nunique()
+    years = sorted(rows['planting_year'].dropna().astype(int).unique().tolist())
+    assert (body['min_planting_year'], body['max_planting_year']) == (years[0], years[-1])
+
+
+def test_empty_slice_is_an_empty_result(client):
+    response = client.get('/api/data?country=Benin&admin_level=0&year_from=3000')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['crops_summary'] == {}
+    assert body['unique_crops_count'] == 0
+    assert body['total_national_production'] == 0
+
+
+def test_empty_crop_slice_is_an_empty_time_series(client, app_module):
+    crop = app_module.store.current().data.query("country == 'Benin'")['product'].iloc[0]
+    response = client.get(f'/api/crop-timeseries?country=Benin&admin_level=0&crop_name={crop}&year_from=3000')
+    assert response.status_code == 200
+    assert response.get_json()['time_series_data'] == [{'admin_unit': 'Total', 'data': []}]
+
+
+@pytest.mark.parametrize('path', [
+    '/api/data?country=Atlantis&admin_level=0&year_from=2000',
+    '/api/data?country=Benin&admin_level=1&admin_1_name=Atlantis&year_from=2000',
+    '/api/crop-timeseries?country=Benin&admin_level=0&crop_name=Atlantis&year_from=2000',
+])
+def test_unknown_units_and_crops_are_still_not_found(client, path):
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize('query, message', [
+    ('year_from=x', 'year_from must be an integer'),
+    ('year_from=2010&year_to=2000', 'year_from must not be after year_to'),
+])
+def test_invalid_row_filters_are_rejected(client, query, message):
+    response = client.get(f'/api/data?country=Benin&admin_level=0&{query}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == message
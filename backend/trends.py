@@ -0,0 +1,132 @@
+import numpy as np
+
+from aggregation import ALL_SERIES, select_series
+
+# Fewest yield years a series needs for a linear trend (and residual spread)
+MIN_TREND_YEARS = 3
+
+# Detrended anomalies more than this many residual standard deviations from
+# the trend are reported as outlier years
+OUTLIER_Z = 3.0
+
+
+def yield_matrix(series, start, stop):
+    """Yields of the series rows [start, stop) as a padded years x series matrix.
+
+    Rows are consecutive harvest years from the block's first to its last,
+    columns the block's series in id order. Years a series has no harvested
+    area for are NaN. Returns ``(years, values, first_series_id)``.
+    """
+    series_id = series['series_id'][start:stop]
+    years = series['year'][start:stop].astype(np.int64)
+    production = series['production'][start:stop]
+    area = series['area'][start:stop]
+    first_year = int(years.min())
+    first_id = int(series_id[0])
+    values = np.full((int(years.max()) - first_year + 1, int(series_id[-1]) - first_id + 1), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values[years - first_year, series_id - first_id] = np.where(area > 0, production / area, np.nan)
+    return np.arange(first_year, first_year + len(values)), values, first_id
+
+
+def trend_statistics(years, values):
+    """Per-column yield statistics of a padded years x series matrix (NaN = no data).
+
+    Every column gets its least-squares line through its own years at once,
+    from the masked normal equations, so the cost is a few passes over the
+    matrix however many series there are. Returns arrays per series (``n``,
+    ``mean``, ``std``, ``cv``, ``slope``, ``intercept``, ``r_squared``) and
+    per cell (``trend``, ``anomaly``, ``z``). Trend figures are NaN for
+    series with fewer than `MIN_TREND_YEARS` years.
+    """
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+    x = years.astype(np.float64)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(valid, x, 0).sum(axis=0) / n
+        mean = np.where(valid, values, 0).sum(axis=0) / n
+        dx = np.where(valid, x - x_mean, 0)
+        dy = np.where(valid, values - mean, 0)
+        sxx = (dx * dx).sum(axis=0)
+        syy = (dy * dy).sum(axis=0)
+        slope = np.where((n >= MIN_TREND_YEARS) & (sxx > 0), (dx * dy).sum(axis=0) / sxx, np.nan)
+        intercept = mean - slope * x_mean
+        trend = intercept + slope * x
+        anomaly = values - trend
+        ssr = np.where(valid, anomaly * anomaly, 0).sum(axis=0)
+        residual_std = np.where(n >= MIN_TREND_YEARS, np.sqrt(ssr / (n - 2)), np.nan)
+        std = np.where(n >= 2, np.sqrt(syy / (n - 1)), np.nan)
+        return {
+            'n': n,
+            'mean': mean,
+            'std': std,
+            'cv': np.where(mean > 0, std / mean * 100, np.nan),
+            'slope': slope,
+            'intercept': intercept,
+            'r_squared': np.where(syy > 0, 1 - ssr / syy, np.nan),
+            'trend': trend,
+            'anomaly': anomaly,
+            'z': np.where(residual_std > 0, anomaly / residual_std, np.nan),
+        }
+
+
+def emit_crop_statistics(series, blocks, options=ALL_SERIES, outlier_z=OUTLIER_Z):
+    """Yield statistics of the series of several crops' blocks, keyed like `blocks`.
+
+    `blocks` maps each crop to its (start, stop) rows in `series`. One
+    unit's crops are adjacent in `series`, so all of them are fitted in one
+    matrix. Each result is ``(statistics per selected series, number of
+    series paged over)``. A series' yearly figures are parallel arrays under
+    ``anomalies``, one entry per year with a yield; figures that cannot be
+    computed are NaN, which responses encode as null.
+    """
+    if not blocks:
+        return {}
+    start = min(block[0] for block in blocks.values())
+    stop = max(block[1] for block in blocks.values())
+    years, values, first_id = yield_matrix(series, start, stop)
+    stats = trend_statistics(years, values)
+
+    # Flatten the cells with a yield series by series, so each series' points
+    # are slices of a few flat arrays
+    columns, rows = np.nonzero(~np.isnan(values.T))
+    offsets = np.searchsorted(columns, np.arange(values.shape[1] + 1)).tolist()
+    trend = stats['trend'][rows, columns]
+    anomaly = stats['anomaly'][rows, columns]
+    z = stats['z'][rows, columns]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        points = {
+            'year': years[rows],
+            'yield': values[rows, columns],
+            'trend': trend,
+            'anomaly': anomaly,
+            'anomaly_pct': np.where(trend > 0, anomaly / trend * 100, np.nan),
+            'z': z,
+        }
+        trend_pct = np.where(stats['mean'] > 0, stats['slope'] / stats['mean'] * 100, np.nan)
+    outlier_years = np.where(np.abs(np.nan_to_num(z)) > outlier_z, points['year'], 0)
+    n, mean, std, cv, slope, r_squared = (stats[name].tolist() for name in ('n', 'mean', 'std', 'cv', 'slope', 'r_squared'))
+    trend_pct = trend_pct.tolist()
+
+    def emit(series_id):
+        column = series_id - first_id
+        first, last = offsets[column], offsets[column + 1]
+        outliers = outlier_years[first:last]
+        return {
+            'admin_unit': series['labels'][series_id],
+            'years_count': n[column],
+            'mean_yield': mean[column],
+            'std_yield': std[column],
+            'cv_pct': cv[column],
+            'trend_slope': slope[column],
+            'trend_pct_per_year': trend_pct[column],
+            'r_squared': r_squared[column],
+            'outlier_years': outliers[outliers > 0].tolist(),
+            'anomalies': {name: values[first:last] for name, values in points.items()},
+        }
+
+    results = {}
+    for crop, block in blocks.items():
+        ids, total = select_series(series, block, options)
+        results[crop] = ([emit(series_id) for series_id in ids.tolist()], total)
+    return results